@@ -3,12 +3,14 @@
 A minimal Reticulum page node that serves .mu pages and files over RNS.
 """
 
+from .cache import PageCache
 from .cli import get_config_value, setup_logging, setup_parser
 from .config import load_config
 from .core import PageNode
 from .handlers import serve_default_index, serve_file, serve_page
 
 __all__ = [
+    "PageCache",
     "PageNode",
     "get_config_value",
     "load_config",
@@ -0,0 +1,392 @@
+"""Long-running page backends that answer requests over the frame protocol.
+
+A page is served by a persistent backend process when either
+
+* a sidecar file ``<page>.mu.backend`` exists next to it, holding
+  ``key=value`` lines with at least ``command=`` (run through shlex, with
+  the page's directory as working directory), or
+* the page declares ``#!backend`` below its shebang, in which case the
+  page itself is started as the backend.
+
+Both forms accept ``timeout`` (seconds per request) and ``health``
+(seconds between health checks, 0 disables them). Like script pages, a
+page is only served by a backend when it is executable; a sidecar is also
+ignored unless it is owned by the node's user or root and not writable by
+group or others, since its command runs as the node.
+
+The backend reads frames (see protocol.py) from stdin and writes frames to
+stdout. Requests look like ``{"type": "request", "id": 1, "path":
+"/page/x.mu", "env": {...}}`` where env holds the same variables script
+pages receive (link_id, remote_identity, field_*, var_*). The backend
+answers with ``{"id": 1, "ok": true}`` and the page content as the frame
+body, or ``{"id": 1, "ok": false, "error": "..."}``. Requests are
+multiplexed, so answers may arrive in any order. Health checks are sent as
+``{"type": "ping", "id": n}`` and must be answered with ``{"id": n,
+"type": "pong"}``. Backends that exit, or fail a health check, are
+restarted with exponential backoff.
+"""
+
+import itertools
+import os
+import shlex
+import stat
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import RNS
+
+from .cache import Fingerprint, stat_fingerprint
+from .directives import Directives
+from .executor import kill_process_group
+from .protocol import read_frame, write_frame
+
+DEFAULT_REQUEST_TIMEOUT = 30.0
+DEFAULT_HEALTH_INTERVAL = 30.0
+MAX_RESTART_DELAY = 60.0
+SIDECAR_SUFFIX = ".backend"
+
+
+class BackendError(RuntimeError):
+    """Raised when a backend cannot answer a request."""
+
+
+class BackendSpec(NamedTuple):
+    """How to start a backend and how long to wait for it."""
+
+    command: Tuple[str, ...]
+    cwd: str
+    timeout: float
+    health_interval: float
+
+
+def _float_option(options: Dict[str, str], key: str, default: float) -> float:
+    try:
+        return float(options[key])
+    except (KeyError, ValueError):
+        return default
+
+
+def _spec_from_options(
+    command: Tuple[str, ...],
+    cwd: str,
+    options: Dict[str, str],
+) -> BackendSpec:
+    return BackendSpec(
+        command,
+        cwd,
+        _float_option(options, "timeout", DEFAULT_REQUEST_TIMEOUT),
+        _float_option(options, "health", DEFAULT_HEALTH_INTERVAL),
+    )
+
+
+def _trusted_sidecar(sidecar: Path, st: os.stat_result) -> bool:
+    """Return True if only the node's user or root can have written sidecar."""
+    if st.st_uid not in (os.getuid(), 0):
+        RNS.log(
+            f"Ignoring backend sidecar {sidecar} owned by another user",
+            RNS.LOG_WARNING,
+        )
+        return False
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        RNS.log(
+            f"Ignoring backend sidecar {sidecar} writable by group or others",
+            RNS.LOG_WARNING,
+        )
+        return False
+    return True
+
+
+def _read_sidecar(sidecar: Path) -> Optional[BackendSpec]:
+    options: Dict[str, str] = {}
+    with sidecar.open(encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            options[key.strip().lower()] = value.strip()
+    command = tuple(shlex.split(options.get("command", "")))
+    if not command:
+        RNS.log(f"Backend sidecar {sidecar} has no command", RNS.LOG_WARNING)
+        return None
+    return _spec_from_options(command, str(sidecar.parent), options)
+
+
+class PageBackend:
+    """A single backend process with multiplexed requests."""
+
+    def __init__(self, spec: BackendSpec) -> None:
+        """Create the backend; the process is started on first use."""
+        self.spec = spec
+        self.requests = 0
+        self.errors = 0
+        self.restarts = 0
+        self.last_health_check = time.monotonic()
+        self._process: Optional[subprocess.Popen] = None
+        # Guarded by _lock: requests, the reader thread and restarts change it.
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._crashes = 0
+        self._next_start = 0.0
+        self._stopped = False
+
+    def alive(self) -> bool:
+        """Return True if the backend process is running."""
+        return self._process is not None and self._process.poll() is None
+
+    def _ensure_started(self) -> subprocess.Popen:
+        with self._lock:
+            if self._stopped:
+                raise BackendError("backend stopped")
+            if self._process is not None and self._process.poll() is None:
+                return self._process
+            now = time.monotonic()
+            if now < self._next_start:
+                raise BackendError("backend is restarting")
+            if self._process is not None:
+                self.restarts += 1
+            try:
+                process = subprocess.Popen(
+                    list(self.spec.command),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    cwd=self.spec.cwd,
+                    start_new_session=True,
+                )
+            except OSError as e:
+                self._schedule_restart()
+                raise BackendError(f"could not start backend: {e}") from e
+            self._process = process
+            self.last_health_check = now
+        threading.Thread(target=self._read_loop, args=(process,), daemon=True).start()
+        RNS.log(f"Started page backend: {' '.join(self.spec.command)}", RNS.LOG_INFO)
+        return process
+
+    def _schedule_restart(self) -> None:
+        self._crashes += 1
+        delay = min(2 ** (self._crashes - 1), MAX_RESTART_DELAY)
+        self._next_start = time.monotonic() + delay
+
+    def _read_loop(self, process: subprocess.Popen) -> None:
+        reason: Exception
+        try:
+            while True:
+                header, body = read_frame(process.stdout)
+                with self._lock:
+                    future = self._pending.pop(header.get("id"), None)
+                if future is not None:
+                    future.set_result((header, body))
+        except (EOFError, OSError, TypeError, ValueError) as e:
+            reason = e
+        for stream in (process.stdin, process.stdout):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.wait()
+        with self._lock:
+            if process is self._process and not self._stopped:
+                RNS.log(
+                    f"Page backend {' '.join(self.spec.command)} exited "
+                    f"(status {process.returncode}): {reason}",
+                    RNS.LOG_WARNING,
+                )
+                self._schedule_restart()
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(BackendError("backend exited"))
+
+    def call(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """Send a frame and wait for the matching answer.
+
+        Raises:
+            BackendError: If the backend is unavailable or does not answer
+
+        """
+        process = self._ensure_started()
+        request_id = next(self._ids)
+        future: Future = Future()
+        with self._lock:
+            self._pending[request_id] = future
+        try:
+            with self._write_lock:
+                write_frame(process.stdin, {**header, "id": request_id})
+            return future.result(timeout=self.spec.timeout)
+        except FutureTimeoutError as e:
+            raise BackendError(f"backend timed out after {self.spec.timeout}s") from e
+        except (OSError, TypeError, ValueError) as e:
+            raise BackendError(f"could not send to backend: {e}") from e
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def request(self, request_path: str, env: Dict[str, Any]) -> bytes:
+        """Send a page request and return the page content."""
+        self.requests += 1
+        try:
+            header, body = self.call(
+                {"type": "request", "path": request_path, "env": env},
+            )
+        except BackendError:
+            self.errors += 1
+            raise
+        if not header.get("ok", False):
+            self.errors += 1
+            raise BackendError(header.get("error") or "backend reported an error")
+        self._crashes = 0
+        return body
+
+    def check_health(self) -> None:
+        """Ping the backend and restart it if it does not answer."""
+        self.last_health_check = time.monotonic()
+        try:
+            header, _ = self.call({"type": "ping"})
+            if header.get("type") != "pong":
+                raise BackendError(f"unexpected health check answer: {header}")
+        except BackendError as e:
+            RNS.log(
+                f"Page backend {' '.join(self.spec.command)} failed health check: {e}",
+                RNS.LOG_WARNING,
+            )
+            self.kill()
+
+    def kill(self) -> None:
+        """Kill the backend process; it is restarted on next use."""
+        with self._lock:
+            process = self._process
+        if process is not None:
+            kill_process_group(process)
+
+    def stop(self) -> None:
+        """Stop the backend for good."""
+        with self._lock:
+            self._stopped = True
+            process = self._process
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.wait()
+
+
+class BackendManager:
+    """Resolve backend declarations and keep one process per page."""
+
+    def __init__(self) -> None:
+        """Start the health check thread."""
+        self._backends: Dict[str, PageBackend] = {}
+        self._sidecars: Dict[str, Tuple[Fingerprint, Optional[BackendSpec]]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def resolve(self, page_path: Path, directives: Directives) -> Optional[BackendSpec]:
+        """Return the backend declared for page_path, if any.
+
+        Pages that are not executable, like script pages, and sidecars that
+        others could have written never get a backend.
+        """
+        if not os.access(page_path, os.X_OK):
+            return None
+        sidecar = page_path.with_name(page_path.name + SIDECAR_SUFFIX)
+        key = str(sidecar)
+        try:
+            st: Optional[os.stat_result] = os.stat(key)
+        except OSError:
+            st = None
+        if st is not None:
+            if not _trusted_sidecar(sidecar, st):
+                return None
+            fingerprint = stat_fingerprint(st)
+            cached = self._sidecars.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+            try:
+                spec = _read_sidecar(sidecar)
+            except OSError as e:
+                RNS.log(f"Error reading backend sidecar {sidecar}: {e}", RNS.LOG_ERROR)
+                return None
+            self._sidecars[key] = (fingerprint, spec)
+            return spec
+        if "backend" in directives:
+            return _spec_from_options(
+                (str(page_path),),
+                str(page_path.parent),
+                directives["backend"],
+            )
+        return None
+
+    def request(
+        self,
+        page_path: Path,
+        spec: BackendSpec,
+        request_path: str,
+        env: Dict[str, Any],
+    ) -> bytes:
+        """Forward a page request to the backend for page_path."""
+        key = str(page_path)
+        with self._lock:
+            backend = self._backends.get(key)
+            replaced = None
+            if backend is None or backend.spec != spec:
+                replaced = backend
+                backend = PageBackend(spec)
+                self._backends[key] = backend
+        if replaced is not None:
+            replaced.stop()
+        return backend.request(request_path, env)
+
+    def _health_loop(self) -> None:
+        while not self._stop_event.wait(1.0):
+            with self._lock:
+                backends = list(self._backends.values())
+            now = time.monotonic()
+            for backend in backends:
+                interval = backend.spec.health_interval
+                if (
+                    interval > 0
+                    and backend.alive()
+                    and now - backend.last_health_check >= interval
+                ):
+                    backend.check_health()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return per-page request, error and restart counters."""
+        with self._lock:
+            return {
+                key: {
+                    "alive": int(backend.alive()),
+                    "requests": backend.requests,
+                    "errors": backend.errors,
+                    "restarts": backend.restarts,
+                }
+                for key, backend in self._backends.items()
+            }
+
+    def shutdown(self) -> None:
+        """Stop the health check thread and all backends."""
+        self._stop_event.set()
+        self._health_thread.join(timeout=5)
+        with self._lock:
+            backends = list(self._backends.values())
+            self._backends.clear()
+        for backend in backends:
+            backend.stop()
@@ -0,0 +1,305 @@
+"""In-memory caches used by the page node."""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, NamedTuple, Optional, Tuple, Union
+
+from .directives import Directives, is_script, parse_directives
+
+DEFAULT_PAGE_CACHE_SIZE = 4 * 1024 * 1024
+DEFAULT_RESPONSE_CACHE_SIZE = 8 * 1024 * 1024
+
+ETAG_SIZE = 8
+
+Fingerprint = Tuple[int, int, int]
+
+
+def stat_fingerprint(st: os.stat_result) -> Fingerprint:
+    """Return the (mtime_ns, size, inode) tuple used to validate cache entries."""
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def content_etag(content: bytes) -> bytes:
+    """Return the version hash of content: the first bytes of its SHA-256."""
+    return hashlib.sha256(content).digest()[:ETAG_SIZE]
+
+
+def requested_etag(data: Any) -> Optional[bytes]:
+    """Return the version hash a client sent as ``etag`` (bytes or hex)."""
+    if not isinstance(data, dict):
+        return None
+    etag = data.get("etag")
+    if isinstance(etag, str):
+        try:
+            return bytes.fromhex(etag)
+        except ValueError:
+            return None
+    return etag if isinstance(etag, bytes) else None
+
+
+class PageEntry(NamedTuple):
+    """A cached page: raw content, shebang flag, header directives and etag."""
+
+    content: bytes
+    is_script: bool
+    fingerprint: Fingerprint
+    directives: Directives
+    etag: bytes
+
+
+class PageCache:
+    """LRU cache of page file contents bounded by a byte budget.
+
+    Entries are validated against the file's stat fingerprint on every
+    lookup, so edits on disk are picked up without an explicit refresh.
+    A budget of 0 disables storage; lookups then always read from disk.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_PAGE_CACHE_SIZE) -> None:
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Maximum total size of cached page contents in bytes
+
+        """
+        self.max_bytes = max(max_bytes, 0)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, PageEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: Union[Path, str]) -> PageEntry:
+        """Return the page entry for file_path, reading it from disk on a miss.
+
+        Raises:
+            OSError: If the file cannot be stat'ed or read
+
+        """
+        key = str(file_path)
+        fingerprint = stat_fingerprint(os.stat(key))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        with open(key, "rb") as file_handle:
+            content = file_handle.read()
+        entry = PageEntry(
+            content,
+            is_script(content),
+            fingerprint,
+            parse_directives(content),
+            content_etag(content),
+        )
+        self._store(key, entry)
+        return entry
+
+    def invalidate(self, file_path: Union[Path, str]) -> None:
+        """Drop the cached entry for file_path, if any."""
+        with self._lock:
+            entry = self._entries.pop(str(file_path), None)
+            if entry is not None:
+                self.current_bytes -= len(entry.content)
+
+    def clear(self) -> None:
+        """Drop all cached entries."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """Return cache counters for sizing and monitoring."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _store(self, key: str, entry: PageEntry) -> None:
+        size = len(entry.content)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old.content)
+            if size > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted.content)
+                self.evictions += 1
+            self._entries[key] = entry
+            self.current_bytes += size
+
+
+DEFAULT_CACHE_DIRECTIVE_TTL = 60.0
+
+
+def response_cache_policy(
+    directives: Directives,
+    default_ttl: float = 0,
+) -> Tuple[float, bool]:
+    """Return (ttl, vary_on_identity) for a script page.
+
+    A ``#!cache ttl=60 vary=identity`` directive takes precedence over the
+    configured default TTL; ``#!cache off`` disables caching for the page.
+    """
+    options = directives.get("cache")
+    if options is None:
+        return default_ttl, False
+    if "off" in options:
+        return 0, False
+    try:
+        ttl = float(options.get("ttl") or default_ttl or DEFAULT_CACHE_DIRECTIVE_TTL)
+    except ValueError:
+        ttl = default_ttl
+    vary = {v.strip() for v in options.get("vary", "").split(",")}
+    return ttl, "identity" in vary
+
+
+ResponseKey = Tuple[str, Tuple[Tuple[str, str], ...], Optional[str]]
+
+
+def response_cache_key(
+    path: str,
+    data: Any,
+    identity_hash: Optional[str] = None,
+) -> ResponseKey:
+    """Build a response cache key from the request path and its variables.
+
+    Only field_* and var_* entries take part, sorted so that the order in
+    which a client sent them does not matter.
+    """
+    variables: Tuple[Tuple[str, str], ...] = ()
+    if isinstance(data, dict):
+        variables = tuple(
+            sorted(
+                (key, str(value))
+                for key, value in data.items()
+                if isinstance(key, str) and key.startswith(("field_", "var_"))
+            ),
+        )
+    return (path, variables, identity_hash)
+
+
+class CachedResponse(NamedTuple):
+    """Cached script output with its expiry, script fingerprint and etag."""
+
+    content: bytes
+    expires: float
+    fingerprint: Optional[Fingerprint]
+    etag: bytes
+
+
+class ResponseCache:
+    """LRU cache of script page output with per-entry TTLs.
+
+    Entries expire after their TTL and are dropped early if the script's
+    stat fingerprint changes. Total content size is bounded by max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_RESPONSE_CACHE_SIZE) -> None:
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Maximum total size of cached responses in bytes
+
+        """
+        self.max_bytes = max(max_bytes, 0)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[ResponseKey, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: ResponseKey,
+        fingerprint: Optional[Fingerprint] = None,
+    ) -> Optional[bytes]:
+        """Return the cached response for key, or None if absent or stale."""
+        entry = self.get_entry(key, fingerprint)
+        return entry.content if entry is not None else None
+
+    def get_entry(
+        self,
+        key: ResponseKey,
+        fingerprint: Optional[Fingerprint] = None,
+    ) -> Optional[CachedResponse]:
+        """Return the cache entry for key, or None if absent or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic() or entry.fingerprint != fingerprint:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(
+        self,
+        key: ResponseKey,
+        content: bytes,
+        ttl: float,
+        fingerprint: Optional[Fingerprint] = None,
+    ) -> None:
+        """Store content under key for ttl seconds."""
+        size = len(content)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if ttl <= 0 or size > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted.content)
+                self.evictions += 1
+            self._entries[key] = CachedResponse(
+                content,
+                time.monotonic() + ttl,
+                fingerprint,
+                content_etag(content),
+            )
+            self.current_bytes += size
+
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """Return cache counters for sizing and monitoring."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _drop(self, key: ResponseKey) -> None:
+        entry = self._entries.pop(key)
+        self.current_bytes -= len(entry.content)
@@ -6,6 +6,12 @@ from typing import Type, TypeVar
 
 import RNS
 
+from .cache import DEFAULT_PAGE_CACHE_SIZE, DEFAULT_RESPONSE_CACHE_SIZE
+from .compression import DEFAULT_SAMPLE_SIZE
+from .executor import DEFAULT_MAX_CONCURRENT, DEFAULT_QUEUE_SIZE, DEFAULT_TIMEOUT
+from .precompress import DEFAULT_PRECOMPRESS_SIZE
+from .transfers import DEFAULT_MAX_TRANSFERS
+
 T = TypeVar("T")
 
 
@@ -80,6 +86,177 @@ def setup_parser() -> argparse.ArgumentParser:
         default=0,
         help="File refresh interval in seconds, 0 disables auto-refresh",
     )
+    parser.add_argument(
+        "--page-cache-size",
+        dest="page_cache_size",
+        type=int,
+        default=DEFAULT_PAGE_CACHE_SIZE,
+        help="Page cache size in bytes, 0 disables the page cache",
+    )
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        default=False,
+        help="Watch pages and files with inotify instead of periodic rescans",
+    )
+    parser.add_argument(
+        "--scan-workers",
+        dest="scan_workers",
+        type=int,
+        default=0,
+        help="Threads used to scan pages and files, 0 scans sequentially",
+    )
+    parser.add_argument(
+        "--script-workers",
+        dest="script_workers",
+        type=int,
+        default=0,
+        help="Persistent worker processes for Python script pages, 0 disables",
+    )
+    parser.add_argument(
+        "--page-backends",
+        dest="page_backends",
+        action="store_true",
+        default=False,
+        help="Serve pages that declare a backend from a persistent process",
+    )
+    parser.add_argument(
+        "--script-cache-size",
+        dest="script_cache_size",
+        type=int,
+        default=DEFAULT_RESPONSE_CACHE_SIZE,
+        help="Script output cache size in bytes, 0 disables the cache",
+    )
+    parser.add_argument(
+        "--script-cache-ttl",
+        dest="script_cache_ttl",
+        type=int,
+        default=0,
+        help="Seconds to cache script output for pages without a #!cache directive",
+    )
+    parser.add_argument(
+        "--script-max-concurrent",
+        dest="script_max_concurrent",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT,
+        help="Maximum number of script pages running at once",
+    )
+    parser.add_argument(
+        "--script-queue-size",
+        dest="script_queue_size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Maximum number of script requests waiting for a free slot",
+    )
+    parser.add_argument(
+        "--script-timeout",
+        dest="script_timeout",
+        type=int,
+        default=DEFAULT_TIMEOUT,
+        help="Seconds a script page may run before it is killed, 0 disables",
+    )
+    parser.add_argument(
+        "--script-coalesce",
+        dest="script_coalesce",
+        action="store_true",
+        default=False,
+        help="Share one execution between identical concurrent script requests",
+    )
+    parser.add_argument(
+        "--script-stream",
+        dest="script_stream",
+        action="store_true",
+        default=False,
+        help="Send script output as a file spooled on disk instead of in memory",
+    )
+    parser.add_argument(
+        "--precompress-dir",
+        dest="precompress_dir",
+        default=None,
+        help="Directory for pre-compressed copies of served files",
+    )
+    parser.add_argument(
+        "--precompress-size",
+        dest="precompress_size",
+        type=int,
+        default=DEFAULT_PRECOMPRESS_SIZE,
+        help="Disk budget in bytes for pre-compressed files",
+    )
+    parser.add_argument(
+        "--compress-rules",
+        dest="compress_rules",
+        default=None,
+        help="Comma separated glob:action file compression rules "
+        "(action: never, always, auto or a size limit in bytes)",
+    )
+    parser.add_argument(
+        "--compress-sample",
+        dest="compress_sample",
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE,
+        help="Bytes sampled per file to detect compressed data, 0 disables",
+    )
+    parser.add_argument(
+        "--mmap-threshold",
+        dest="mmap_threshold",
+        type=int,
+        default=0,
+        help="Serve files of at least this many bytes from shared memory "
+        "mappings, 0 disables",
+    )
+    parser.add_argument(
+        "--max-transfers",
+        dest="max_transfers",
+        type=int,
+        default=DEFAULT_MAX_TRANSFERS,
+        help="Maximum number of file transfers open at once, 0 disables the limit",
+    )
+    parser.add_argument(
+        "--files-manifest",
+        dest="files_manifest",
+        action="store_true",
+        default=False,
+        help="Serve a manifest of all files with sizes, mtimes and hashes",
+    )
+    parser.add_argument(
+        "--content-index",
+        dest="content_index",
+        default=None,
+        help="File persisting content hashes of served files across restarts",
+    )
+    parser.add_argument(
+        "--scan-manifest",
+        dest="scan_manifest",
+        default=None,
+        help="File saving the last scan so handlers are registered before rescanning",
+    )
+    parser.add_argument(
+        "--file-listings",
+        dest="file_listings",
+        action="store_true",
+        default=False,
+        help="Serve generated directory listings of the files at /page/.files.mu",
+    )
+    parser.add_argument(
+        "--page-search",
+        dest="page_search",
+        action="store_true",
+        default=False,
+        help="Serve a full-text search page over the pages at /page/.search.mu",
+    )
+    parser.add_argument(
+        "--search-index",
+        dest="search_index",
+        default=None,
+        help="File persisting the page search index (implies --page-search)",
+    )
+    parser.add_argument(
+        "--script-schedule",
+        dest="script_schedule",
+        default=None,
+        help="Comma separated glob:seconds rules rendering script pages on a schedule",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -119,6 +296,13 @@ def get_config_value(
         try:
             if value_type is int:
                 return int(config[config_key])  # type: ignore
+            if value_type is bool:
+                value = config[config_key].lower()
+                if value in ("1", "true", "yes", "on"):
+                    return True  # type: ignore
+                if value in ("0", "false", "no", "off"):
+                    return False  # type: ignore
+                raise ValueError(value)
             return config[config_key]  # type: ignore
         except (ValueError, TypeError):
             RNS.log(
@@ -0,0 +1,273 @@
+"""Per-file choice of the auto_compress setting for file handlers.
+
+RNS compresses a Resource with bzip2 when the handler's auto_compress
+allows it, and compares the result with the original. For formats that are
+already compressed that attempt only costs CPU, while a single size limit
+for every file also keeps large, very compressible files such as logs from
+being compressed at all.
+
+CompressionPolicy decides per file, in this order:
+
+1. The first matching configured rule, ``<glob>:<action>`` where action is
+   ``never``, ``always``, ``auto`` or a size limit in bytes. Globs match the
+   path relative to the files directory or the file name.
+2. A known compressed file extension.
+3. The magic bytes at the start of the file.
+4. The byte entropy of a sample from the start of the file: near-random
+   data is not compressed, while clearly compressible data is compressed
+   regardless of its size.
+
+Files that fall through keep the default size limit. Savings and CPU time
+are estimated from the sample entropy and a one-time measurement of bzip2
+throughput, since the compression itself happens inside RNS.
+"""
+
+import bz2
+import fnmatch
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+import RNS
+
+from .cache import Fingerprint, stat_fingerprint
+
+DEFAULT_COMPRESS_LIMIT = 32_000_000
+DEFAULT_SAMPLE_SIZE = 64 * 1024
+ALWAYS_COMPRESS_LIMIT = 2**62
+HIGH_ENTROPY = 7.5
+LOW_ENTROPY = 6.0
+
+AutoCompress = Union[bool, int]
+
+COMPRESSED_EXTENSIONS = frozenset(
+    {
+        "7z", "aac", "apk", "avi", "br", "bz2", "deb", "flac", "gif", "gz",
+        "heic", "jar", "jpeg", "jpg", "lz", "lz4", "lzma", "m4a", "m4v", "mkv",
+        "mov", "mp3", "mp4", "odt", "ogg", "opus", "png", "rar", "rpm", "tbz2",
+        "tgz", "txz", "webm", "webp", "whl", "xz", "zip", "zst",
+    },
+)  # fmt: skip
+
+_MAGIC_PREFIXES = (
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"PK\x03\x04",  # zip and derived formats
+    b"7z\xbc\xaf\x27\x1c",  # 7-zip
+    b"Rar!\x1a\x07",  # rar
+    b"\x89PNG\r\n\x1a\n",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",  # gif
+    b"OggS",  # ogg
+    b"fLaC",  # flac
+    b"ID3",  # mp3 with id3 tag
+    b"\x1a\x45\xdf\xa3",  # matroska / webm
+)
+
+
+class CompressionRule(NamedTuple):
+    """A configured glob and the compression setting it selects."""
+
+    pattern: str
+    action: str
+
+
+class Decision(NamedTuple):
+    """The auto_compress value chosen for a file and why."""
+
+    auto_compress: AutoCompress
+    reason: str
+    size: int
+    ratio: float
+    fingerprint: Optional[Fingerprint] = None
+
+
+def parse_rules(spec: Optional[str]) -> List[CompressionRule]:
+    """Parse ``glob:action`` rules separated by commas.
+
+    Invalid rules are logged and skipped.
+    """
+    rules: List[CompressionRule] = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        pattern, _, action = item.rpartition(":")
+        action = action.strip().lower()
+        valid = action in ("never", "always", "auto") or action.isdigit()
+        if not pattern or not valid:
+            RNS.log(f"Invalid compression rule: {item}", RNS.LOG_WARNING)
+            continue
+        rules.append(CompressionRule(pattern.strip(), action))
+    return rules
+
+
+def sample_entropy(sample: bytes) -> float:
+    """Return the Shannon entropy of sample in bits per byte."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(
+        count / total * math.log2(count / total) for count in Counter(sample).values()
+    )
+
+
+def is_compressed_format(head: bytes) -> bool:
+    """Return True if head starts with the magic bytes of a compressed format."""
+    if head.startswith(_MAGIC_PREFIXES):
+        return True
+    if head[4:8] == b"ftyp":  # mp4, m4a, mov, heic
+        return True
+    return head[:4] == b"RIFF" and head[8:12] in (b"WEBP", b"AVI ")
+
+
+class CompressionPolicy:
+    """Choose auto_compress per file and estimate what compression costs."""
+
+    def __init__(
+        self,
+        rules: Optional[List[CompressionRule]] = None,
+        default_limit: int = DEFAULT_COMPRESS_LIMIT,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+    ) -> None:
+        """Initialize the policy.
+
+        Args:
+            rules: Rules checked before any sniffing, first match wins
+            default_limit: Size limit for files no other check decides
+            sample_size: Bytes read from each file for magic bytes and
+                entropy (0 = decide on rules and extensions only)
+
+        """
+        self.rules = rules or []
+        self.default_limit = default_limit
+        self.sample_size = max(sample_size, 0)
+        self.transfers = 0
+        self.bytes_compressed = 0
+        self.bytes_saved = 0
+        self.bytes_skipped = 0
+        self.cpu_seconds = 0.0
+        self.cpu_seconds_avoided = 0.0
+        self._decisions: Dict[str, Decision] = {}
+        self._reasons: Counter = Counter()
+        self._seconds_per_byte: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def decide(self, full_path: str, request_path: str) -> AutoCompress:
+        """Return the auto_compress value for the file at full_path."""
+        try:
+            st = os.stat(full_path)
+            decision = self._decide(full_path, request_path, st.st_size)
+            decision = decision._replace(fingerprint=stat_fingerprint(st))
+        except OSError as e:
+            RNS.log(f"Could not sample {full_path}: {e}", RNS.LOG_DEBUG)
+            decision = Decision(self.default_limit, "default", 0, 1.0)
+        return self.restore(request_path, decision)
+
+    def restore(self, request_path: str, decision: Decision) -> AutoCompress:
+        """Record a decision, such as one saved by an earlier run, and apply it."""
+        with self._lock:
+            self._decisions[request_path] = decision
+            self._reasons[decision.reason] += 1
+        return decision.auto_compress
+
+    def decision(self, request_path: str) -> Optional[Decision]:
+        """Return the decision recorded for request_path, if any."""
+        with self._lock:
+            return self._decisions.get(request_path)
+
+    def settings(self) -> List[Any]:
+        """Return the configuration decisions depend on, for saved decisions."""
+        return [
+            [[rule.pattern, rule.action] for rule in self.rules],
+            self.default_limit,
+            self.sample_size,
+        ]
+
+    def _decide(self, full_path: str, request_path: str, size: int) -> Decision:
+        relative = request_path.split("/", 2)[-1]
+        name = relative.rsplit("/", 1)[-1]
+        action = None
+        for rule in self.rules:
+            if any(fnmatch.fnmatch(p, rule.pattern) for p in (relative, name)):
+                action = rule.action
+                break
+
+        if action == "never":
+            return Decision(False, "rule", size, 1.0)
+        extension = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+        if action in (None, "auto") and extension in COMPRESSED_EXTENSIONS:
+            return Decision(False, "extension", size, 1.0)
+
+        sample = b""
+        if self.sample_size:
+            with open(full_path, "rb") as handle:
+                sample = handle.read(self.sample_size)
+            self._calibrate(sample)
+        entropy = sample_entropy(sample) if sample else 8.0
+        ratio = min(entropy / 8, 1.0)
+
+        if action == "always":
+            return Decision(ALWAYS_COMPRESS_LIMIT, "rule", size, ratio)
+        if action is not None and action.isdigit():
+            return Decision(int(action), "rule", size, ratio)
+        if not sample:
+            return Decision(self.default_limit, "default", size, ratio)
+        if is_compressed_format(sample[:16]):
+            return Decision(False, "magic", size, 1.0)
+        if entropy >= HIGH_ENTROPY:
+            return Decision(False, "entropy", size, 1.0)
+        if entropy <= LOW_ENTROPY:
+            return Decision(ALWAYS_COMPRESS_LIMIT, "entropy", size, ratio)
+        return Decision(self.default_limit, "default", size, ratio)
+
+    def _calibrate(self, sample: bytes) -> None:
+        """Measure bzip2 CPU time per byte once, on the first sample."""
+        if self._seconds_per_byte is not None or not sample:
+            return
+        started = time.process_time()
+        bz2.compress(sample)
+        elapsed = max(time.process_time() - started, 1e-6)
+        self._seconds_per_byte = elapsed / len(sample)
+
+    def forget(self, request_path: str) -> None:
+        """Drop the decision for a file that is no longer served."""
+        with self._lock:
+            self._decisions.pop(request_path, None)
+
+    def record_transfer(self, request_path: str) -> None:
+        """Account for one transfer of a file served under request_path."""
+        with self._lock:
+            decision = self._decisions.get(request_path)
+            if decision is None:
+                return
+            self.transfers += 1
+            seconds = decision.size * (self._seconds_per_byte or 0.0)
+            limit = decision.auto_compress
+            if limit is not False and decision.size <= limit:
+                self.bytes_compressed += decision.size
+                self.bytes_saved += int(decision.size * (1 - decision.ratio))
+                self.cpu_seconds += seconds
+            else:
+                self.bytes_skipped += decision.size
+                self.cpu_seconds_avoided += seconds
+
+    def stats(self) -> Dict[str, Union[int, float, Dict[str, int]]]:
+        """Return decision counts and estimated bytes saved against CPU time."""
+        with self._lock:
+            return {
+                "files": len(self._decisions),
+                "reasons": dict(self._reasons),
+                "transfers": self.transfers,
+                "bytes_compressed": self.bytes_compressed,
+                "bytes_saved": self.bytes_saved,
+                "bytes_skipped": self.bytes_skipped,
+                "cpu_seconds": round(self.cpu_seconds, 3),
+                "cpu_seconds_avoided": round(self.cpu_seconds_avoided, 3),
+            }
+
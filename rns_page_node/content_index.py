@@ -0,0 +1,254 @@
+"""Content-addressed index of the served files.
+
+The index maps every served file to the SHA-256 of its content and every
+digest to the files that share it, so work that only depends on content
+(compressed copies, memory mappings, chunk manifests) is done once per
+unique content instead of once per path. Digests are computed in a
+background thread and kept per file until its (mtime, size, inode)
+fingerprint changes.
+
+The index can be persisted to a file, msgpack encoded, so that a restart
+only rehashes files that changed while the node was down.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+import RNS
+from RNS.vendor import umsgpack
+
+from .cache import Fingerprint, stat_fingerprint
+
+INDEX_VERSION = 1
+_CHUNK_SIZE = 1024 * 1024
+_STOP = object()
+
+
+class IndexEntry(NamedTuple):
+    """The fingerprint of a file and its digest, None until hashed."""
+
+    fingerprint: Fingerprint
+    sha256: Optional[bytes]
+
+
+def hash_file(path: Union[str, os.PathLike]) -> bytes:
+    """Return the SHA-256 digest of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while chunk := handle.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class ContentIndex:
+    """Map served files to content digests and digests back to files."""
+
+    def __init__(self, persist_path: Optional[str] = None) -> None:
+        """Load the persisted index, if any, and start the hashing thread.
+
+        Args:
+            persist_path: File the index is saved to and loaded from
+                (None = kept in memory only)
+
+        """
+        self.persist_path = persist_path
+        self.generation = 0
+        self.hashed = 0
+        self.loaded = 0
+        self._entries: Dict[str, IndexEntry] = {}
+        self._paths: Dict[bytes, Set[str]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._load()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as handle:
+                stored = umsgpack.unpackb(handle.read())
+            if stored.get("version") != INDEX_VERSION:
+                return
+            for path, mtime_ns, size, inode, digest in stored["entries"]:
+                self._set(path, IndexEntry((mtime_ns, size, inode), digest))
+        except Exception as e:
+            RNS.log(
+                f"Ignoring unreadable content index {self.persist_path}: {e}",
+                RNS.LOG_WARNING,
+            )
+            self._entries.clear()
+            self._paths.clear()
+            return
+        self.loaded = len(self._entries)
+        self._dirty = False
+
+    def save(self) -> None:
+        """Write the index to persist_path if it changed since the last save."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [
+                [path, *entry.fingerprint, entry.sha256]
+                for path, entry in self._entries.items()
+                if entry.sha256 is not None
+            ]
+            self._dirty = False
+        temp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(temp_path, "wb") as handle:
+                handle.write(
+                    umsgpack.packb({"version": INDEX_VERSION, "entries": entries}),
+                )
+            os.replace(temp_path, self.persist_path)
+        except OSError as e:
+            RNS.log(f"Could not save content index: {e}", RNS.LOG_ERROR)
+
+    def sync(self, files: Iterable[str]) -> None:
+        """Queue a full scan result; files not in it are dropped."""
+        self._queue.put(("sync", list(files)))
+
+    def refresh(self, paths: Iterable[str]) -> None:
+        """Queue added or modified files to be hashed."""
+        self._queue.put(("refresh", list(paths)))
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """Drop files that are no longer served."""
+        with self._lock:
+            for path in paths:
+                self._set(os.path.realpath(path), None)
+
+    def _set(self, path: str, entry: Optional[IndexEntry]) -> None:
+        """Replace the entry for path, keeping the reverse map in step."""
+        old = self._entries.pop(path, None)
+        if old is not None and old.sha256 is not None:
+            shared = self._paths.get(old.sha256)
+            if shared is not None:
+                shared.discard(path)
+                if not shared:
+                    del self._paths[old.sha256]
+        if entry is not None:
+            self._entries[path] = entry
+            if entry.sha256 is not None:
+                self._paths.setdefault(entry.sha256, set()).add(path)
+        if old != entry:
+            self.generation += 1
+            self._dirty = True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            action, paths = item  # type: ignore[misc]
+            paths = [os.path.realpath(path) for path in paths]
+            if action == "sync":
+                current = set(paths)
+                with self._lock:
+                    for path in [p for p in self._entries if p not in current]:
+                        self._set(path, None)
+            self._update(paths)
+            if self._queue.empty():
+                self.save()
+
+    def _update(self, paths: List[str]) -> None:
+        """Record fingerprints first, then hash what changed.
+
+        A file whose fingerprint changed while it was hashed is queued
+        again instead of being stored with a digest of other content.
+        """
+        changed = []
+        for path in paths:
+            try:
+                fingerprint = stat_fingerprint(os.stat(path))
+            except OSError:
+                with self._lock:
+                    self._set(path, None)
+                continue
+            with self._lock:
+                entry = self._entries.get(path)
+                if (
+                    entry is None
+                    or entry.fingerprint != fingerprint
+                    or entry.sha256 is None
+                ):
+                    self._set(path, IndexEntry(fingerprint, None))
+                    changed.append(path)
+        for path in changed:
+            try:
+                before = stat_fingerprint(os.stat(path))
+                digest = hash_file(path)
+                fingerprint = stat_fingerprint(os.stat(path))
+            except OSError as e:
+                RNS.log(f"Error hashing {path}: {e}", RNS.LOG_DEBUG)
+                continue
+            if fingerprint != before:
+                RNS.log(f"{path} changed while hashing, queued again", RNS.LOG_DEBUG)
+                self.refresh([path])
+                continue
+            with self._lock:
+                if path in self._entries:
+                    self._set(path, IndexEntry(fingerprint, digest))
+                    self.hashed += 1
+
+    def digest(self, path: str) -> Optional[bytes]:
+        """Return the digest of path if it is indexed and unchanged on disk."""
+        path = os.path.realpath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry.sha256 is None:
+            return None
+        try:
+            if stat_fingerprint(os.stat(path)) != entry.fingerprint:
+                return None
+        except OSError:
+            return None
+        return entry.sha256
+
+    def paths(self, digest: bytes) -> List[str]:
+        """Return the real paths of the files whose content has digest."""
+        with self._lock:
+            return sorted(self._paths.get(digest, ()))
+
+    def snapshot(self) -> Tuple[int, List[Tuple[str, IndexEntry]]]:
+        """Return the generation and a copy of all entries."""
+        with self._lock:
+            return self.generation, list(self._entries.items())
+
+    def join(self) -> None:
+        """Wait until all queued updates have been applied."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def stats(self) -> Dict[str, int]:
+        """Return file, unique content and hashing counters."""
+        with self._lock:
+            hashed = [e for e in self._entries.values() if e.sha256 is not None]
+            sizes = {e.sha256: e.fingerprint[1] for e in hashed}
+            return {
+                "files": len(self._entries),
+                "pending": len(self._entries) - len(hashed),
+                "unique": len(self._paths),
+                "duplicates": len(hashed) - len(self._paths),
+                "duplicate_bytes": sum(e.fingerprint[1] for e in hashed)
+                - sum(sizes.values()),
+                "hashed": self.hashed,
+                "loaded": self.loaded,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the hashing thread and save the index."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+        self.save()
@@ -1,13 +1,75 @@
 """Core logic for the RNS Page Node."""
 
+import os
 import threading
 import time
 from pathlib import Path
-from typing import Any, List, Optional, Union
+from typing import Any, Iterable, List, Optional, Tuple, Union
 
 import RNS
 
-from .handlers import serve_default_index, serve_file, serve_page
+from .backends import BackendManager
+from .cache import (
+    DEFAULT_PAGE_CACHE_SIZE,
+    DEFAULT_RESPONSE_CACHE_SIZE,
+    PageCache,
+    ResponseCache,
+    stat_fingerprint,
+)
+from .compression import (
+    DEFAULT_COMPRESS_LIMIT,
+    DEFAULT_SAMPLE_SIZE,
+    AutoCompress,
+    CompressionPolicy,
+    parse_rules,
+)
+from .content_index import ContentIndex
+from .executor import (
+    DEFAULT_MAX_CONCURRENT,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_TIMEOUT,
+    ScriptExecutor,
+    SingleFlight,
+)
+from .handlers import (
+    DEFAULT_BUSY,
+    DEFAULT_NOTALLOWED,
+    render_script,
+    serve_default_index,
+    serve_file,
+    serve_files_manifest,
+    serve_listing,
+    serve_page,
+    serve_search,
+)
+from .listings import DirectoryListings
+from .manifest import MANIFEST_PATH, FilesManifest
+from .mapped import MappedFiles
+from .pathindex import PathIndex
+from .precompress import (
+    COMPRESSED_PREFIX,
+    DEFAULT_PRECOMPRESS_SIZE,
+    CompressedStore,
+)
+from .ranges import ManifestCache
+from .routes import Route, RouteTable
+from .scan_manifest import (
+    ScannedFile,
+    ScanState,
+    load_scan_manifest,
+    save_scan_manifest,
+)
+from .scanner import scan_tree
+from .schedule import PageScheduler, parse_schedule
+from .search import SEARCH_PATH, PageSearch
+from .templates import TemplateCache
+from .transfers import DEFAULT_MAX_TRANSFERS, TransfersBusy, TransferTracker
+from .watcher import InotifyWatcher, inotify_available
+from .workers import ScriptWorkerPool
+
+# Seconds without watcher events before their changes are saved to the
+# scan manifest, so a burst of changes is written once.
+SCAN_SAVE_DELAY = 5.0
 
 
 class PageNode:
@@ -22,6 +84,31 @@ class PageNode:
         name: Optional[str] = None,
         page_refresh_interval: int = 0,
         file_refresh_interval: int = 0,
+        page_cache_size: int = DEFAULT_PAGE_CACHE_SIZE,
+        watch: bool = False,
+        scan_workers: int = 0,
+        script_workers: int = 0,
+        page_backends: bool = False,
+        script_cache_size: int = DEFAULT_RESPONSE_CACHE_SIZE,
+        script_cache_ttl: int = 0,
+        script_max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        script_queue_size: int = DEFAULT_QUEUE_SIZE,
+        script_timeout: int = DEFAULT_TIMEOUT,
+        script_coalesce: bool = False,
+        script_stream: bool = False,
+        precompress_dir: Optional[str] = None,
+        precompress_size: int = DEFAULT_PRECOMPRESS_SIZE,
+        compress_rules: Optional[str] = None,
+        compress_sample: int = DEFAULT_SAMPLE_SIZE,
+        mmap_threshold: int = 0,
+        max_transfers: int = DEFAULT_MAX_TRANSFERS,
+        files_manifest: bool = False,
+        content_index: Optional[str] = None,
+        scan_manifest: Optional[str] = None,
+        file_listings: bool = False,
+        page_search: bool = False,
+        search_index: Optional[str] = None,
+        script_schedule: Optional[str] = None,
     ) -> None:
         """Initialize the PageNode.
 
@@ -33,6 +120,48 @@ class PageNode:
             name: Display name for the node (optional)
             page_refresh_interval: Seconds between page rescans (0 = disabled)
             file_refresh_interval: Seconds between file rescans (0 = disabled)
+            page_cache_size: Byte budget for cached page contents (0 = disabled)
+            watch: Apply filesystem changes via inotify instead of periodic rescans
+            scan_workers: Threads used to scan directory trees (0 = sequential)
+            script_workers: Persistent workers for Python script pages (0 = disabled)
+            page_backends: Forward pages that declare a backend to a persistent process
+            script_cache_size: Byte budget for cached script output (0 = disabled)
+            script_cache_ttl: Default seconds to cache script output (0 = only
+                pages with a #!cache directive are cached)
+            script_max_concurrent: Maximum number of scripts running at once
+            script_queue_size: Maximum number of script requests waiting for a slot
+            script_timeout: Seconds a script may run before it is killed (0 = unlimited)
+            script_coalesce: Share one execution between identical concurrent
+                script requests, for pages without a #!coalesce directive
+            script_stream: Return script output as a file spooled on disk
+                for pages without a #!stream directive
+            precompress_dir: Directory for pre-compressed copies of served
+                files (None = files are compressed on every transfer)
+            precompress_size: Disk budget in bytes for pre-compressed files
+            compress_rules: Comma separated ``glob:action`` rules choosing
+                how files are compressed (never, always, auto or a byte limit)
+            compress_sample: Bytes sampled per file to detect compressed
+                formats and entropy (0 = rules and extensions only)
+            mmap_threshold: Minimum size in bytes of files served from a shared
+                memory mapping (0 = disabled)
+            max_transfers: Maximum number of file transfers open at once before
+                "busy" is returned (0 = unlimited)
+            files_manifest: Serve a manifest of all files with their hashes
+                at /file/.manifest
+            content_index: File persisting the content digests of served
+                files across restarts (None = kept in memory only)
+            scan_manifest: File saving the served pages and files, from which
+                handlers are registered at startup before the directories are
+                scanned again in the background (None = scan before serving)
+            file_listings: Serve generated listing pages of the files
+                directory at /page/.files.mu and /page/.files/<dir>.mu
+            page_search: Serve a full-text search page over the static pages
+                at /page/.search.mu
+            search_index: File persisting the search index across restarts;
+                enables page_search (None = kept in memory only)
+            script_schedule: Comma separated ``glob:seconds`` rules rendering
+                script pages in the background, for pages without a
+                #!schedule directive
 
         """
         self._stop_event = threading.Event()
@@ -54,11 +183,92 @@ class PageNode:
         self.file_refresh_interval = file_refresh_interval
         self.last_page_refresh = time.time()
         self.last_file_refresh = time.time()
-        self.servedpages: List[str] = []
-        self.servedfiles: List[str] = []
+        self.servedpages = PathIndex(self.pagespath)
+        self.servedfiles = PathIndex(self.filespath)
+        self.page_routes = RouteTable(str(self.pagespath.resolve()), "/page/")
+        self.file_routes = RouteTable(str(self.filespath.resolve()), "/file/")
+        self.scan_workers = scan_workers
+        self.page_cache = PageCache(page_cache_size)
+        self.templates = TemplateCache(self.pagespath)
+        self.script_pool: Optional[ScriptWorkerPool] = (
+            ScriptWorkerPool(script_workers) if script_workers > 0 else None
+        )
+        self.backends: Optional[BackendManager] = (
+            BackendManager() if page_backends else None
+        )
+        self.response_cache: Optional[ResponseCache] = (
+            ResponseCache(script_cache_size) if script_cache_size > 0 else None
+        )
+        self.script_cache_ttl = script_cache_ttl
+        self.script_executor = ScriptExecutor(
+            script_max_concurrent,
+            script_queue_size,
+            script_timeout,
+        )
+        self.single_flight = SingleFlight()
+        self.script_coalesce = script_coalesce
+        self.script_stream = script_stream
+        self.scheduler = PageScheduler(
+            str(self.pagespath),
+            self._render_scheduled,
+            parse_schedule(script_schedule),
+        )
+        precompress = bool(precompress_dir) and precompress_size > 0
+        self.content_index: Optional[ContentIndex] = (
+            ContentIndex(content_index)
+            if content_index or files_manifest or precompress
+            else None
+        )
+        self.compressed_store: Optional[CompressedStore] = (
+            CompressedStore(precompress_dir, precompress_size, self.content_index)
+            if precompress
+            else None
+        )
+        self.compression_policy = CompressionPolicy(
+            parse_rules(compress_rules),
+            sample_size=compress_sample,
+        )
+        self.file_manifests = ManifestCache()
+        self.mapped_files: Optional[MappedFiles] = (
+            MappedFiles(mmap_threshold) if mmap_threshold > 0 else None
+        )
+        self.transfers = TransferTracker(max_transfers)
+        self.files_manifest: Optional[FilesManifest] = (
+            FilesManifest(self.file_routes, self.content_index)
+            if self.content_index is not None and files_manifest
+            else None
+        )
+        self.listings: Optional[DirectoryListings] = (
+            DirectoryListings() if file_listings else None
+        )
+        self.search: Optional[PageSearch] = (
+            PageSearch(search_index) if page_search or search_index else None
+        )
+        self._page_watcher: Optional[InotifyWatcher] = None
+        self._file_watcher: Optional[InotifyWatcher] = None
+        self.scan_manifest = scan_manifest
+        self.scan_ready = threading.Event()
+        self._scan_changed: Optional[float] = None
 
-        self.register_pages()
-        self.register_files()
+        restored = self._restore_scan()
+        if not restored:
+            self.register_pages()
+            self.register_files()
+        if self.files_manifest is not None:
+            self.destination.register_request_handler(
+                MANIFEST_PATH,
+                response_generator=self.serve_files_manifest,
+                allow=RNS.Destination.ALLOW_ALL,
+                auto_compress=True,
+            )
+        if self.search is not None:
+            self.destination.register_request_handler(
+                SEARCH_PATH,
+                response_generator=self.serve_search,
+                allow=RNS.Destination.ALLOW_ALL,
+            )
+        if watch:
+            self._start_watchers()
 
         self.destination.set_link_established_callback(self.on_connect)
 
@@ -69,6 +279,14 @@ class PageNode:
         self._announce_thread.start()
         self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
         self._refresh_thread.start()
+        if scan_manifest:
+            threading.Thread(
+                target=self._reconcile_scan,
+                args=(restored,),
+                daemon=True,
+            ).start()
+        else:
+            self.scan_ready.set()
 
     def serve_page(
         self,
@@ -78,9 +296,9 @@ class PageNode:
         link_id: Optional[bytes],
         remote_identity: Any,
         requested_at: float,
-    ) -> bytes:
+    ) -> Any:
         """Serve a .mu page file."""
-        return serve_page(
+        response = serve_page(
             path,
             data,
             request_id,
@@ -88,7 +306,22 @@ class PageNode:
             remote_identity,
             requested_at,
             self.pagespath,
+            page_cache=self.page_cache,
+            script_pool=self.script_pool,
+            backends=self.backends,
+            response_cache=self.response_cache,
+            response_cache_ttl=self.script_cache_ttl,
+            executor=self.script_executor,
+            single_flight=self.single_flight,
+            coalesce_default=self.script_coalesce,
+            stream_default=self.script_stream,
+            routes=self.page_routes,
+            templates=self.templates,
+            scheduler=self.scheduler,
         )
+        if isinstance(response, list):
+            self.transfers.track(link_id, response[0])
+        return response
 
     def serve_file(
         self,
@@ -99,104 +332,615 @@ class PageNode:
         remote_identity: Any,
         requested_at: float,
     ) -> Any:
-        """Serve a file."""
-        return serve_file(
+        """Serve a file, or a busy page if too many transfers are open."""
+        try:
+            with self.transfers.admit():
+                response = serve_file(
+                    path,
+                    data,
+                    request_id,
+                    link_id,
+                    remote_identity,
+                    requested_at,
+                    self.filespath,
+                    compressed_store=self.compressed_store,
+                    manifests=self.file_manifests,
+                    mapped_files=self.mapped_files,
+                    content_index=self.content_index,
+                    routes=self.file_routes,
+                )
+                if isinstance(response, list):
+                    self.transfers.track(link_id, response[0])
+        except TransfersBusy:
+            RNS.log(f"Too many open transfers, rejecting {path}", RNS.LOG_WARNING)
+            return DEFAULT_BUSY.encode("utf-8")
+        if isinstance(response, list) and "encoding" not in response[1]:
+            self.compression_policy.record_transfer(path)
+        return response
+
+    def serve_listing(
+        self,
+        path: str,
+        data: Any,
+        request_id: bytes,
+        link_id: bytes,
+        remote_identity: Any,
+        requested_at: float,
+    ) -> bytes:
+        """Serve a directory listing page."""
+        if self.listings is None:
+            return DEFAULT_NOTALLOWED.encode("utf-8")
+        return serve_listing(
             path,
             data,
             request_id,
             link_id,
             remote_identity,
             requested_at,
-            self.filespath,
+            self.listings,
+        )
+
+    def _render_scheduled(self, full_path: str) -> bytes:
+        """Run a scheduled script page for its next snapshot."""
+        return render_script(Path(full_path), self.script_pool, self.script_executor)
+
+    def serve_search(
+        self,
+        path: str,
+        data: Any,
+        request_id: bytes,
+        link_id: bytes,
+        remote_identity: Any,
+        requested_at: float,
+    ) -> bytes:
+        """Serve the search page."""
+        if self.search is None:
+            return DEFAULT_NOTALLOWED.encode("utf-8")
+        return serve_search(
+            path,
+            data,
+            request_id,
+            link_id,
+            remote_identity,
+            requested_at,
+            self.search,
+        )
+
+    def serve_files_manifest(
+        self,
+        path: str,
+        data: Any,
+        request_id: bytes,
+        link_id: bytes,
+        remote_identity: Any,
+        requested_at: float,
+    ) -> bytes:
+        """Serve the files manifest."""
+        return serve_files_manifest(
+            path,
+            data,
+            request_id,
+            link_id,
+            remote_identity,
+            requested_at,
+            self.files_manifest,
         )
 
     def register_pages(self) -> None:
-        """Scan pages directory and register request handlers for all .mu files."""
-        pages = self._scan_pages(self.pagespath)
+        """Scan pages directory and apply the changes to the page handlers.
+
+        Only pages added since the previous scan are registered and only
+        pages that disappeared are deregistered.
+        """
+        started = time.monotonic()
+        pages = PathIndex(self.pagespath, self._scan_pages(self.pagespath))
 
         with self._lock:
+            previous = self.servedpages
             self.servedpages = pages
+            added, removed = pages.diff(previous)
 
+        self._deregister_pages(removed)
         pages_path_obj = self.pagespath.resolve()
-
         if not (pages_path_obj / "index.mu").is_file():
-            self.destination.register_request_handler(
-                "/page/index.mu",
-                response_generator=serve_default_index,
-                allow=RNS.Destination.ALLOW_ALL,
-            )
+            self._register_default_index()
+        registered = [
+            request_path
+            for full_path in added
+            if (request_path := self._register_page(full_path, pages_path_obj))
+        ]
+        self._update_routes("page_routes", added=registered)
+        self.scheduler.update(
+            added=[self.page_routes.route(p).path for p in registered]
+            + self.scheduler.changed(),
+            removed=removed,
+        )
+        if self.search is not None:
+            with self._lock:
+                routes = self.page_routes.items()
+            self.search.sync((route.path, path) for path, route in routes)
 
-        for full_path in pages:
-            page_path = Path(full_path).resolve()
-            try:
-                rel = page_path.relative_to(pages_path_obj).as_posix()
-            except ValueError:
-                continue
-            request_path = f"/page/{rel}"
-            self.destination.register_request_handler(
-                request_path,
-                response_generator=self.serve_page,
-                allow=RNS.Destination.ALLOW_ALL,
-            )
+        self._log_refresh("Pages", len(added), len(removed), len(pages), started)
+        self._save_rescan()
 
     def register_files(self) -> None:
-        """Scan files directory and register request handlers for all files."""
+        """Scan files directory and apply the changes to the file handlers.
+
+        Only files added since the previous scan are registered and only
+        files that disappeared are deregistered. Files modified in place get
+        a new compression decision.
+        """
+        started = time.monotonic()
         files = self._scan_files(self.filespath)
+        served = PathIndex(self.filespath, files)
 
         with self._lock:
-            self.servedfiles = files
+            previous = self.servedfiles
+            self.servedfiles = served
+            added, removed = served.diff(previous)
 
+        self._deregister_files(removed)
         files_path_obj = self.filespath.resolve()
+        registered = [
+            request_path
+            for full_path in added
+            if (request_path := self._register_file(full_path, files_path_obj))
+        ]
+        self._update_routes("file_routes", added=registered)
+        with self._lock:
+            routes = self.file_routes.items()
+        fresh = set(registered)
+        changed = self._redecide_changed_files(
+            [item for item in routes if item[0] not in fresh],
+        )
+        # Files changed in place are listed with their new size.
+        self._update_listings(
+            added
+            + removed
+            + [self._served_path(p, self.filespath, "/file/") for p in changed],
+        )
+        routed = [route.path for _, route in routes]
+        if self.content_index is not None:
+            self.content_index.sync(routed)
+        if self.compressed_store is not None:
+            self.compressed_store.submit(routed)
+            self.compressed_store.cleanup()
 
-        for full_path in files:
-            file_path = Path(full_path).resolve()
+        self._log_refresh("Files", len(added), len(removed), len(files), started)
+        self._save_rescan()
+
+    def _restore_scan(self) -> bool:
+        """Register handlers from the saved scan manifest, if there is one."""
+        if not self.scan_manifest:
+            return False
+        started = time.monotonic()
+        state = load_scan_manifest(
+            self.scan_manifest,
+            self.pagespath,
+            self.filespath,
+            self.compression_policy.settings(),
+        )
+        if state is None:
+            return False
+
+        with self._lock:
+            self.servedpages = PathIndex(self.pagespath, state.pages)
+            self.servedfiles = PathIndex(self.filespath, state.files)
+        if "/page/index.mu" not in state.pages.values():
+            self._register_default_index()
+        for request_path in state.pages.values():
+            self._register_page_handler(request_path)
+        self._update_routes("page_routes", added=state.pages.values())
+        self.scheduler.update(
+            added=[self.page_routes.route(p).path for p in state.pages.values()],
+        )
+        files_path_obj = self.filespath.resolve()
+        registered = [
+            request_path
+            for full_path, scanned in state.files.items()
+            if (request_path := self._register_file(full_path, files_path_obj, scanned))
+        ]
+        self._update_routes("file_routes", added=registered)
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        RNS.log(
+            f"Restored {len(state.pages)} pages and {len(state.files)} files "
+            f"from the scan manifest in {elapsed_ms:.1f} ms",
+            RNS.LOG_INFO,
+        )
+        return True
+
+    def _reconcile_scan(self, restored: bool) -> None:
+        """Rescan after a restored startup, then save the scan manifest."""
+        try:
+            if restored:
+                self._update_listings(list(self.servedfiles))
+                self.register_pages()
+                self.register_files()
+            self._save_scan()
+        except Exception as e:
+            RNS.log(f"Error reconciling the scan manifest: {e}", RNS.LOG_ERROR)
+        finally:
+            self.scan_ready.set()
+
+    def _redecide_changed_files(self, routes: List[Tuple[str, Route]]) -> List[str]:
+        """Decide compression again for routed files that changed on disk.
+
+        Decisions are made when a file is registered, possibly while it is
+        still being written, or restored from the scan manifest; files whose
+        fingerprint no longer matches are sampled again and their handlers
+        registered with the new decision.
+
+        Returns:
+            Request paths of the files that changed
+
+        """
+        files_path_obj = self.filespath.resolve()
+        changed = []
+        for request_path, route in routes:
+            decision = self.compression_policy.decision(request_path)
+            if decision is None or decision.fingerprint is None:
+                continue
             try:
-                rel = file_path.relative_to(files_path_obj).as_posix()
-            except ValueError:
+                fingerprint = stat_fingerprint(os.stat(route.path))
+            except OSError:
                 continue
-            request_path = f"/file/{rel}"
+            if fingerprint != decision.fingerprint:
+                self._register_file(route.path, files_path_obj)
+                changed.append(request_path)
+        return changed
+
+    def _save_rescan(self) -> None:
+        """Save the scan manifest after a rescan, once startup reconciled it."""
+        if self.scan_manifest and self.scan_ready.is_set():
+            self._save_scan()
+
+    def _scan_event(self) -> None:
+        """Note a watcher change to save to the scan manifest later."""
+        if self.scan_manifest:
+            with self._lock:
+                self._scan_changed = time.monotonic()
+
+    def _save_scan_events(self, force: bool = False) -> None:
+        """Save the scan manifest once watcher changes have settled.
+
+        Args:
+            force: Save pending changes without waiting for SCAN_SAVE_DELAY
+
+        """
+        with self._lock:
+            changed = self._scan_changed
+            if changed is None or (
+                not force and time.monotonic() - changed < SCAN_SAVE_DELAY
+            ):
+                return
+            self._scan_changed = None
+        self._save_scan()
+
+    def _save_scan(self) -> None:
+        """Save the served pages and files to the scan manifest."""
+        if not self.scan_manifest:
+            return
+        pages_path_obj = self.pagespath.resolve()
+        files_path_obj = self.filespath.resolve()
+        with self._lock:
+            pages = list(self.servedpages)
+            files = list(self.servedfiles)
+        state = ScanState({}, {})
+        for full_path in pages:
+            request_path = self._request_path(full_path, pages_path_obj, "/page/")
+            if request_path is not None:
+                state.pages[full_path] = request_path
+        for full_path in files:
+            request_path = self._request_path(full_path, files_path_obj, "/file/")
+            if request_path is not None:
+                state.files[full_path] = ScannedFile(
+                    request_path,
+                    self.compression_policy.decision(request_path),
+                )
+        save_scan_manifest(
+            self.scan_manifest,
+            self.pagespath,
+            self.filespath,
+            self.compression_policy.settings(),
+            state,
+        )
+
+    @staticmethod
+    def _log_refresh(
+        kind: str,
+        added: int,
+        removed: int,
+        total: int,
+        started: float,
+    ) -> None:
+        elapsed_ms = (time.monotonic() - started) * 1000
+        RNS.log(
+            f"{kind} refreshed in {elapsed_ms:.1f} ms: "
+            f"{added} added, {removed} removed, {total} served",
+            RNS.LOG_INFO if added or removed else RNS.LOG_DEBUG,
+        )
+
+    def _update_routes(
+        self,
+        attribute: str,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = (),
+    ) -> None:
+        """Add the added and drop the removed request paths from a route table."""
+        with self._lock:
+            routes: RouteTable = getattr(self, attribute)
+            routes.update(added, removed)
+
+    def _update_listings(self, changed: List[str]) -> None:
+        """Render the listings of directories with added, removed or changed files."""
+        if self.listings is None:
+            return
+        added, removed = self.listings.update(
+            self.servedfiles,
+            self.file_routes,
+            changed,
+            self._lock,
+        )
+        for request_path in removed:
+            self.destination.deregister_request_handler(request_path)
+        for request_path in added:
             self.destination.register_request_handler(
                 request_path,
+                response_generator=self.serve_listing,
+                allow=RNS.Destination.ALLOW_ALL,
+            )
+
+    def _register_page(self, full_path: str, pages_path_obj: Path) -> Optional[str]:
+        """Register the handler of a page and return its request path."""
+        request_path = self._request_path(full_path, pages_path_obj, "/page/")
+        if request_path is None:
+            return None
+        self._register_page_handler(request_path)
+        return request_path
+
+    def _register_page_handler(self, request_path: str) -> None:
+        self.destination.register_request_handler(
+            request_path,
+            response_generator=self.serve_page,
+            allow=RNS.Destination.ALLOW_ALL,
+        )
+
+    def _deregister_pages(self, pages: List[str]) -> None:
+        request_paths = []
+        for page in pages:
+            self.page_cache.invalidate(page)
+            self.templates.invalidate(page)
+            request_path = self._served_request_path(page, self.pagespath, "/page/")
+            self.destination.deregister_request_handler(request_path)
+            request_paths.append(request_path)
+            if request_path == "/page/index.mu":
+                self._register_default_index()
+        if request_paths:
+            self._update_routes("page_routes", removed=request_paths)
+        if self.search is not None and request_paths:
+            self.search.remove(request_paths)
+
+    def _register_file(
+        self,
+        full_path: str,
+        files_path_obj: Path,
+        scanned: Optional[ScannedFile] = None,
+    ) -> Optional[str]:
+        """Register the handlers of a file and return its request path.
+
+        A saved compression decision in scanned is reused instead of
+        sampling the file again.
+        """
+        if scanned is not None and scanned.decision is not None:
+            request_path = scanned.request_path
+            auto_compress = self.compression_policy.restore(
+                request_path,
+                scanned.decision,
+            )
+        else:
+            maybe_path = self._request_path(full_path, files_path_obj, "/file/")
+            if maybe_path is None:
+                return None
+            request_path = maybe_path
+            auto_compress = self.compression_policy.decide(full_path, request_path)
+        self._register_file_handler(request_path, auto_compress)
+        if self.compressed_store is not None:
+            self.destination.register_request_handler(
+                COMPRESSED_PREFIX + request_path[len("/file/") :],
                 response_generator=self.serve_file,
                 allow=RNS.Destination.ALLOW_ALL,
-                auto_compress=32_000_000,
+                auto_compress=False,
+            )
+        return request_path
+
+    def _deregister_files(self, files: List[str]) -> None:
+        request_paths = []
+        for served in files:
+            request_path = self._served_request_path(served, self.filespath, "/file/")
+            self.destination.deregister_request_handler(request_path)
+            request_paths.append(request_path)
+            self.compression_policy.forget(request_path)
+            if self.mapped_files is not None:
+                self.mapped_files.invalidate(os.path.realpath(served))
+            if self.compressed_store is not None:
+                self.destination.deregister_request_handler(
+                    COMPRESSED_PREFIX + request_path[len("/file/") :],
+                )
+        if self.compressed_store is not None and files:
+            self.compressed_store.forget(files)
+            self.compressed_store.cleanup()
+        if self.content_index is not None and files:
+            self.content_index.remove(files)
+        if request_paths:
+            self._update_routes("file_routes", removed=request_paths)
+
+    def _register_default_index(self) -> None:
+        self.destination.register_request_handler(
+            "/page/index.mu",
+            response_generator=serve_default_index,
+            allow=RNS.Destination.ALLOW_ALL,
+        )
+
+    def _register_file_handler(
+        self,
+        request_path: str,
+        auto_compress: AutoCompress = DEFAULT_COMPRESS_LIMIT,
+    ) -> None:
+        self.destination.register_request_handler(
+            request_path,
+            response_generator=self.serve_file,
+            allow=RNS.Destination.ALLOW_ALL,
+            auto_compress=auto_compress,
+        )
+
+    @staticmethod
+    def _request_path(full_path: str, base: Path, prefix: str) -> Optional[str]:
+        """Return the request path for full_path under base, or None if outside it."""
+        try:
+            rel = Path(full_path).resolve().relative_to(base).as_posix()
+        except ValueError:
+            return None
+        return f"{prefix}{rel}"
+
+    @staticmethod
+    def _served_path(request_path: str, base: Path, prefix: str) -> str:
+        """Return the served entry of request_path joined onto base."""
+        return os.path.join(str(base), *request_path[len(prefix) :].split("/"))
+
+    @staticmethod
+    def _served_request_path(full_path: str, base: Path, prefix: str) -> str:
+        """Return the request path of a served entry without touching the disk."""
+        return f"{prefix}{os.path.relpath(full_path, base).replace(os.sep, '/')}"
+
+    def _on_page_event(self, action: str, full_path: str, is_dir: bool) -> None:
+        """Apply a single watcher event to the page registrations."""
+        self._scan_event()
+        # Pages built from a changed fragment are rendered again on next request.
+        self.templates.invalidate(full_path)
+        if action == "added":
+            if not full_path.endswith(".mu"):
+                return
+            pages_path_obj = self.pagespath.resolve()
+            with self._lock:
+                new = self.servedpages.add(full_path)
+            if new:
+                request_path = self._register_page(full_path, pages_path_obj)
+                if request_path is not None:
+                    self._update_routes("page_routes", added=[request_path])
+                RNS.log(f"Page added: {full_path}", RNS.LOG_DEBUG)
+            else:
+                # Modified in place.
+                request_path = self._request_path(full_path, pages_path_obj, "/page/")
+            route = self.page_routes.get(request_path) if request_path else None
+            if route is not None:
+                self.scheduler.update(added=[route.path])
+                if self.search is not None:
+                    self.search.refresh([(route.path, request_path)])
+            return
+
+        removed = self._remove_served("servedpages", full_path, is_dir)
+        self._deregister_pages(removed)
+        self.scheduler.update(removed=removed)
+        if removed:
+            RNS.log(f"Pages removed: {len(removed)} under {full_path}", RNS.LOG_DEBUG)
+
+    def _on_file_event(self, action: str, full_path: str, is_dir: bool) -> None:
+        """Apply a single watcher event to the file registrations."""
+        self._scan_event()
+        if action == "added":
+            files_path_obj = self.filespath.resolve()
+            with self._lock:
+                new = self.servedfiles.add(full_path)
+            if new:
+                request_path = self._register_file(full_path, files_path_obj)
+                if request_path is not None:
+                    self._update_routes("file_routes", added=[request_path])
+                RNS.log(f"File added: {full_path}", RNS.LOG_DEBUG)
+            else:
+                # Modified in place: its size in the listing may have changed.
+                request_path = self._request_path(full_path, files_path_obj, "/file/")
+            route = self.file_routes.get(request_path) if request_path else None
+            if route is not None:
+                if not new:
+                    self._redecide_changed_files([(request_path, route)])
+                if self.content_index is not None:
+                    self.content_index.refresh([route.path])
+                if self.compressed_store is not None:
+                    self.compressed_store.submit([route.path])
+            self._update_listings([full_path])
+            return
+
+        removed = self._remove_served("servedfiles", full_path, is_dir)
+        self._deregister_files(removed)
+        self._update_listings(removed)
+        if removed:
+            RNS.log(f"Files removed: {len(removed)} under {full_path}", RNS.LOG_DEBUG)
+
+    def _remove_served(
+        self,
+        attribute: str,
+        full_path: str,
+        is_dir: bool,
+    ) -> List[str]:
+        """Remove full_path, or everything below it for directories, from an index."""
+        with self._lock:
+            served: PathIndex = getattr(self, attribute)
+            return served.remove_tree(full_path, is_dir)
+
+    def _start_watchers(self) -> None:
+        """Start inotify watchers, falling back to polling if unavailable."""
+        if not inotify_available():
+            RNS.log(
+                "inotify is not available, falling back to periodic rescans",
+                RNS.LOG_WARNING,
+            )
+            return
+        try:
+            self._page_watcher = InotifyWatcher(
+                self.pagespath,
+                self._on_page_event,
+                on_overflow=self.register_pages,
+            )
+            self._file_watcher = InotifyWatcher(
+                self.filespath,
+                self._on_file_event,
+                on_overflow=self.register_files,
+            )
+        except OSError as e:
+            RNS.log(
+                f"Could not start inotify watcher, using periodic rescans: {e}",
+                RNS.LOG_WARNING,
             )
+            if self._page_watcher is not None:
+                self._page_watcher.stop()
+                self._page_watcher = None
+            return
+        self._page_watcher.start()
+        self._file_watcher.start()
+        RNS.log("Watching pages and files for changes", RNS.LOG_INFO)
 
     def _scan_pages(self, base: Union[Path, str]) -> List[str]:
         """Return a list of page paths under the given directory, excluding .allowed files."""
-        if isinstance(base, str):
-            base = Path(base)
-        if not base.exists():
-            return []
-        served: List[str] = []
-        for entry in base.iterdir():
-            if entry.name.startswith("."):
-                continue
-            if entry.is_dir():
-                served.extend(self._scan_pages(entry))
-            elif entry.is_file() and entry.name.endswith(".mu"):
-                served.append(str(entry))
-        return served
+        return scan_tree(base, suffix=".mu", workers=self.scan_workers)
 
     def _scan_files(self, base: Union[Path, str]) -> List[str]:
         """Return all file paths under the given directory."""
-        if isinstance(base, str):
-            base = Path(base)
-        if not base.exists():
-            return []
-        served: List[str] = []
-        for entry in base.iterdir():
-            if entry.name.startswith("."):
-                continue
-            if entry.is_dir():
-                served.extend(self._scan_files(entry))
-            elif entry.is_file():
-                served.append(str(entry))
-        return served
+        return scan_tree(base, workers=self.scan_workers)
 
     def on_connect(self, link: Any) -> None:
         """Handle new link connections."""
-        # This can be expanded in the future
+        link.set_link_closed_callback(self.on_disconnect)
+
+    def on_disconnect(self, link: Any) -> None:
+        """Close file handles of transfers left behind by a closed link."""
+        closed = self.transfers.close_link(link.link_id)
+        if closed:
+            RNS.log(
+                f"Closed {closed} abandoned transfers for link "
+                f"{RNS.prettyhexrep(link.link_id)}",
+                RNS.LOG_DEBUG,
+            )
 
     def _announce_loop(self) -> None:
         """Periodically announce the node until shutdown is requested."""
@@ -238,16 +982,20 @@ class PageNode:
                 now = time.time()
                 if (
                     self.page_refresh_interval > 0
+                    and self._page_watcher is None
                     and now - self.last_page_refresh >= self.page_refresh_interval
                 ):
                     self.register_pages()
                     self.last_page_refresh = time.time()
                 if (
                     self.file_refresh_interval > 0
+                    and self._file_watcher is None
                     and now - self.last_file_refresh >= self.file_refresh_interval
                 ):
                     self.register_files()
                     self.last_file_refresh = time.time()
+                if self.scan_ready.is_set():
+                    self._save_scan_events()
 
                 wait_candidates: List[float] = []
                 if self.page_refresh_interval > 0:
@@ -276,11 +1024,39 @@ class PageNode:
         """Gracefully shutdown the PageNode and cleanup resources."""
         RNS.log("Shutting down PageNode...", RNS.LOG_INFO)
         self._stop_event.set()
+        for watcher in (self._page_watcher, self._file_watcher):
+            if watcher is not None:
+                watcher.stop()
         try:
             self._announce_thread.join(timeout=5)
             self._refresh_thread.join(timeout=5)
         except Exception as e:
             RNS.log(f"Error waiting for threads to shut down: {e}", RNS.LOG_ERROR)
+        if self.scan_ready.is_set():
+            self._save_scan_events(force=True)
+        self.scheduler.shutdown()
+        if self.script_pool is not None:
+            self.script_pool.shutdown()
+        if self.backends is not None:
+            self.backends.shutdown()
+        if self.compressed_store is not None:
+            self.compressed_store.shutdown()
+        self.transfers.close_all()
+        if self.content_index is not None:
+            self.content_index.shutdown()
+        if self.search is not None:
+            self.search.shutdown()
+        if self.mapped_files is not None:
+            self.mapped_files.clear()
+        compression = self.compression_policy.stats()
+        if compression["transfers"]:
+            RNS.log(
+                f"File compression over {compression['transfers']} transfers: "
+                f"~{compression['bytes_saved']} bytes saved for "
+                f"~{compression['cpu_seconds']}s CPU, "
+                f"~{compression['cpu_seconds_avoided']}s CPU avoided",
+                RNS.LOG_INFO,
+            )
         try:
             if hasattr(self.destination, "close"):
                 self.destination.close()
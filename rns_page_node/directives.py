@@ -0,0 +1,52 @@
+"""Parsing of ``#!name key=value`` directive lines at the top of pages.
+
+Directives sit directly below the shebang (or at the top of a page) and
+are read until the first line that is not a directive, for example::
+
+    #!/usr/bin/env python3
+    #!backend health=30
+
+A shebang differs from a directive in that the interpreter path starts
+with "/" or whitespace, while a directive name is a bare word.
+"""
+
+import re
+from typing import Dict
+
+_DIRECTIVE = re.compile(rb"^#!([A-Za-z][A-Za-z0-9_-]*)(?:[ \t]+(.*?))?\s*$")
+_MAX_HEADER_LINES = 32
+
+Directives = Dict[str, Dict[str, str]]
+
+
+def is_script(content: bytes) -> bool:
+    """Return True if content starts with a shebang rather than a directive."""
+    if not content.startswith(b"#!"):
+        return False
+    return _DIRECTIVE.match(content.split(b"\n", 1)[0]) is None
+
+
+def parse_directives(content: bytes) -> Directives:
+    """Return the directives declared in the header of a page.
+
+    Arguments of the form ``key=value`` are stored as such, bare words are
+    stored with an empty value. Later directives with the same name replace
+    earlier ones.
+    """
+    directives: Directives = {}
+    if not content.startswith(b"#!"):
+        return directives
+    lines = content.split(b"\n", _MAX_HEADER_LINES)[:_MAX_HEADER_LINES]
+    for index, line in enumerate(lines):
+        match = _DIRECTIVE.match(line)
+        if match is None:
+            if index == 0 and line.startswith(b"#!"):
+                continue
+            break
+        name = match.group(1).decode("ascii").lower()
+        options: Dict[str, str] = {}
+        for token in (match.group(2) or b"").decode("utf-8", "replace").split():
+            key, _, value = token.partition("=")
+            options[key.lower()] = value
+        directives[name] = options
+    return directives
@@ -0,0 +1,242 @@
+"""Bounded and coalesced execution of script pages."""
+
+import os
+import signal
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .directives import Directives
+
+DEFAULT_MAX_CONCURRENT = 8
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_TIMEOUT = 60
+
+T = TypeVar("T")
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """Kill process and everything it started in its session."""
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        process.kill()
+
+
+class ExecutorBusy(Exception):
+    """Raised when all script slots are taken and the wait queue is full."""
+
+
+class ScriptTimeout(Exception):
+    """Raised when a script exceeds its wall-clock timeout."""
+
+
+class ScriptExecutor:
+    """Limit how many scripts run at once and how long each may take.
+
+    At most max_concurrent scripts run at the same time. Up to queue_size
+    further requests wait for a free slot; beyond that ExecutorBusy is
+    raised immediately so the caller can answer with a busy page.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        """Initialize the executor.
+
+        Args:
+            max_concurrent: Maximum number of scripts running at once
+            queue_size: Maximum number of requests waiting for a slot
+            timeout: Wall-clock seconds a script may run (0 = unlimited)
+
+        """
+        self.max_concurrent = max(max_concurrent, 1)
+        self.queue_size = max(queue_size, 0)
+        self.timeout = timeout
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold an execution slot for the duration of the block.
+
+        Raises:
+            ExecutorBusy: If no slot is free and the wait queue is full
+
+        """
+        with self._condition:
+            if self.running >= self.max_concurrent:
+                if self.queued >= self.queue_size:
+                    self.rejected += 1
+                    raise ExecutorBusy("script queue is full")
+                self.queued += 1
+                try:
+                    while self.running >= self.max_concurrent:
+                        self._condition.wait()
+                finally:
+                    self.queued -= 1
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.running -= 1
+                self.completed += 1
+                self._condition.notify()
+
+    def record_timeout(self) -> None:
+        """Count a script that was stopped for exceeding the timeout."""
+        with self._condition:
+            self.timeouts += 1
+
+    def run_subprocess(
+        self,
+        argv: List[str],
+        env: Dict[str, str],
+        stdout: Optional[int] = None,
+    ) -> bytes:
+        """Run argv in its own process group and return its stdout.
+
+        The whole process group is killed if the script outlives the
+        timeout. If stdout is a file descriptor the output is written there
+        instead and an empty bytes object is returned.
+
+        Raises:
+            ExecutorBusy: If no slot is free and the wait queue is full
+            ScriptTimeout: If the script exceeded the timeout
+            subprocess.CalledProcessError: If the script exited non-zero
+
+        """
+        with self.slot():
+            process = subprocess.Popen(
+                argv,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE if stdout is None else stdout,
+                env=env,
+                start_new_session=True,
+            )
+            try:
+                output, _ = process.communicate(timeout=self.timeout or None)
+            except subprocess.TimeoutExpired as e:
+                kill_process_group(process)
+                process.communicate()
+                self.record_timeout()
+                raise ScriptTimeout(
+                    f"{argv[0]} exceeded the {self.timeout}s timeout",
+                ) from e
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, argv, output)
+            return output or b""
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth and execution counters."""
+        with self._condition:
+            return {
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "max_concurrent": self.max_concurrent,
+                "queue_size": self.queue_size,
+            }
+
+
+class _Flight:
+    """An execution in progress that later identical requests wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into a single execution.
+
+    While a call for a key is in flight, further calls with the same key
+    wait for it and receive its result, or its exception, instead of
+    running again.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty set of in-flight calls."""
+        self.executions = 0
+        self.coalesced = 0
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> T:
+        """Run func for key, or wait for the identical call already running."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                self.executions += 1
+            flight.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Return execution and coalescing counters."""
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+def coalesce_policy(directives: Directives, default: bool = False) -> Tuple[bool, bool]:
+    """Return (enabled, vary_on_identity) for coalescing a script page.
+
+    A ``#!coalesce`` directive enables coalescing for the page and
+    ``#!coalesce off`` disables it. Without a directive the configured
+    default applies, and requests from different identities are kept apart
+    since the page has not declared that its output is shared.
+    """
+    options = directives.get("coalesce")
+    if options is None:
+        return default, True
+    if "off" in options:
+        return False, False
+    vary = {v.strip() for v in options.get("vary", "").split(",")}
+    return True, "identity" in vary
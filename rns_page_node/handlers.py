@@ -2,11 +2,49 @@
 
 import os
 import subprocess
+import tempfile
 from pathlib import Path
 from typing import Any, Optional, Union
 
 import RNS
 
+from .backends import BackendError, BackendManager
+from .cache import (
+    PageCache,
+    ResponseCache,
+    content_etag,
+    requested_etag,
+    response_cache_key,
+    response_cache_policy,
+    stat_fingerprint,
+)
+from .content_index import ContentIndex
+from .directives import Directives, is_script, parse_directives
+from .executor import (
+    ExecutorBusy,
+    ScriptExecutor,
+    ScriptTimeout,
+    SingleFlight,
+    coalesce_policy,
+)
+from .listings import DirectoryListings
+from .manifest import FilesManifest
+from .mapped import MappedFiles
+from .precompress import COMPRESSED_PREFIX, CompressedStore
+from .ranges import (
+    ManifestCache,
+    build_manifest,
+    open_slice,
+    parse_range,
+    resolve_range,
+    wants_manifest,
+)
+from .routes import RouteTable
+from .schedule import PageScheduler, has_request_variables
+from .search import PageSearch, render_results
+from .templates import TemplateCache
+from .workers import ScriptWorkerPool, is_python_script
+
 DEFAULT_INDEX = """>Default Home Page
 
 This node is serving pages using rns-page-node, but index.mu was not found.
@@ -18,6 +56,20 @@ DEFAULT_NOTALLOWED = """>Request Not Allowed
 You are not authorised to carry out the request.
 """
 
+DEFAULT_BUSY = """>Node Busy
+
+This node is handling too many requests right now. Please try again shortly.
+"""
+
+DEFAULT_UNAVAILABLE = """>Page Unavailable
+
+The backend serving this page is not responding. Please try again later.
+"""
+
+# Returned instead of the page when the request's etag matches its content.
+# The leading NUL byte keeps it from being mistaken for Micron markup.
+NOT_MODIFIED = b"\x00304"
+
 
 def serve_default_index(
     _path: str,
@@ -31,6 +83,140 @@ def serve_default_index(
     return DEFAULT_INDEX.encode("utf-8")
 
 
+def script_environment(
+    link_id: Optional[bytes],
+    remote_identity: Any,
+    data: Any,
+) -> dict[str, Any]:
+    """Return the request variables passed to script pages as environment."""
+    env_map: dict[str, Any] = {}
+    if link_id is not None:
+        env_map["link_id"] = RNS.hexrep(link_id, delimit=False)
+    if remote_identity is not None:
+        env_map["remote_identity"] = RNS.hexrep(
+            remote_identity.hash,
+            delimit=False,
+        )
+    if data is not None and isinstance(data, dict):
+        for e in data:
+            if isinstance(e, str) and (e.startswith("field_") or e.startswith("var_")):
+                env_map[e] = data[e]
+    return env_map
+
+
+def _execute_script(
+    file_path: Path,
+    file_content: bytes,
+    request_env: dict[str, Any],
+    script_pool: Optional[ScriptWorkerPool],
+    executor: Optional[ScriptExecutor],
+    spool: Optional[tuple[int, str]] = None,
+) -> bytes:
+    """Run a script page and return its output, raising on failure.
+
+    If spool is given as the (descriptor, path) of an open file, the output
+    is written to that file instead and an empty bytes object is returned.
+    """
+    spool_fd, spool_path = spool if spool is not None else (None, None)
+    if script_pool is not None and is_python_script(file_content):
+        if executor is None:
+            return script_pool.run(str(file_path), request_env, 0, spool_path)
+        with executor.slot():
+            try:
+                return script_pool.run(
+                    str(file_path),
+                    request_env,
+                    timeout=executor.timeout,
+                    output_path=spool_path,
+                )
+            except ScriptTimeout:
+                executor.record_timeout()
+                raise
+    env_map = os.environ.copy()
+    env_map.update(request_env)
+    if executor is not None:
+        return executor.run_subprocess([str(file_path)], env_map, spool_fd)
+    return (
+        subprocess.run(
+            [str(file_path)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if spool_fd is None else spool_fd,
+            check=True,
+            env=env_map,
+        ).stdout
+        or b""
+    )
+
+
+def render_script(
+    file_path: Path,
+    script_pool: Optional[ScriptWorkerPool] = None,
+    executor: Optional[ScriptExecutor] = None,
+) -> bytes:
+    """Run a script page without request variables and return its output.
+
+    Used for scheduled renders; raises on failure.
+    """
+    with file_path.open("rb") as file_handle:
+        file_content = file_handle.read()
+    return _execute_script(file_path, file_content, {}, script_pool, executor)
+
+
+def stream_policy(directives: Directives, default: bool = False) -> bool:
+    """Return True if a script page's output should be streamed.
+
+    ``#!stream`` enables streaming for the page and ``#!stream off``
+    disables it; without a directive the configured default applies.
+    """
+    options = directives.get("stream")
+    if options is None:
+        return default
+    return "off" not in options
+
+
+def _stream_script(
+    file_path: Path,
+    file_content: bytes,
+    request_env: dict[str, Any],
+    script_pool: Optional[ScriptWorkerPool],
+    executor: Optional[ScriptExecutor],
+) -> list[Any]:
+    """Run a script page with its output spooled to an unlinked temp file.
+
+    Returns the ``[file, metadata]`` pair RNS sends as a Resource, so the
+    output is read from disk segment by segment instead of being held in
+    memory. The file is closed by the Resource once the transfer ends.
+    """
+    spool_fd, spool_path = tempfile.mkstemp(prefix="rns-page-")
+    try:
+        _execute_script(
+            file_path,
+            file_content,
+            request_env,
+            script_pool,
+            executor,
+            spool=(spool_fd, spool_path),
+        )
+        os.lseek(spool_fd, 0, os.SEEK_SET)
+    except BaseException:
+        os.close(spool_fd)
+        raise
+    finally:
+        os.unlink(spool_path)
+    return [open(spool_fd, "rb"), {"name": file_path.name.encode("utf-8")}]
+
+
+def _unless_matching(
+    content: bytes,
+    requested: Optional[bytes],
+    etag: Optional[bytes] = None,
+) -> bytes:
+    """Return NOT_MODIFIED if requested matches the content's etag."""
+    if requested is not None and (etag or content_etag(content)) == requested:
+        return NOT_MODIFIED
+    return content
+
+
 def serve_page(
     path: str,
     data: Any,
@@ -39,92 +225,341 @@ def serve_page(
     remote_identity: Any,
     _requested_at: float,
     pagespath: Path,
-) -> bytes:
-    """Serve a .mu page file, executing it as a script if it has a shebang."""
-    pagespath = pagespath.resolve()
-    relative_path = path[6:] if path.startswith("/page/") else path[5:]
-    file_path = (pagespath / relative_path).resolve()
+    page_cache: Optional[PageCache] = None,
+    script_pool: Optional[ScriptWorkerPool] = None,
+    backends: Optional[BackendManager] = None,
+    response_cache: Optional[ResponseCache] = None,
+    response_cache_ttl: float = 0,
+    executor: Optional[ScriptExecutor] = None,
+    single_flight: Optional[SingleFlight] = None,
+    coalesce_default: bool = False,
+    stream_default: bool = False,
+    routes: Optional[RouteTable] = None,
+    templates: Optional[TemplateCache] = None,
+    scheduler: Optional[PageScheduler] = None,
+) -> Union[bytes, list[Any]]:
+    """Serve a .mu page file, executing it as a script if it has a shebang.
 
-    if not str(file_path).startswith(str(pagespath)):
-        return DEFAULT_NOTALLOWED.encode("utf-8")
+    When a page_cache is given, page contents and the shebang flag are taken
+    from it instead of being read from disk on every request. When a
+    script_pool is given, Python script pages run in its persistent workers
+    instead of a fresh subprocess. When backends is given, pages declaring a
+    persistent backend are forwarded to it. When a response_cache is given,
+    script output is cached for the TTL set by a ``#!cache`` directive or,
+    failing that, response_cache_ttl. When an executor is given, scripts
+    run under its concurrency limit and timeout, and a busy page is returned
+    if its queue is full. When single_flight is given, identical concurrent
+    requests to pages with a ``#!coalesce`` directive (or all scripts if
+    coalesce_default is set) share one execution. Pages with a ``#!stream``
+    directive (or all scripts if stream_default is set) have their output
+    spooled to a temporary file and returned as ``[file, metadata]``; such
+    responses bypass the response cache and coalescing.
+
+    If the request data carries an ``etag`` equal to the version hash of
+    the content that would be returned (see content_etag), NOT_MODIFIED is
+    returned instead.
+
+    Paths found in routes are served without resolving them again; other
+    paths are resolved and checked to lie under pagespath.
+
+    When templates is given, static pages using ``#!include`` or
+    ``#!template`` directives are served rendered from it. When scheduler
+    is given, requests without request variables to scheduled script pages
+    are answered with the latest snapshot once there is one.
+    """
+    route = routes.get(path) if routes is not None else None
+    if route is not None:
+        file_path = Path(route.path)
+    else:
+        pagespath = pagespath.resolve()
+        relative_path = path[6:] if path.startswith("/page/") else path[5:]
+        file_path = (pagespath / relative_path).resolve()
+        if not str(file_path).startswith(str(pagespath)):
+            return DEFAULT_NOTALLOWED.encode("utf-8")
 
-    is_script = False
-    file_content: Optional[bytes] = None
     try:
-        with file_path.open("rb") as file_handle:
-            first_line = file_handle.readline()
-            is_script = first_line.startswith(b"#!")
-            file_handle.seek(0)
-            if not is_script:
-                return file_handle.read()
-            file_content = file_handle.read()
+        if page_cache is not None:
+            entry = page_cache.get(file_path)
+            file_content = entry.content
+            script = entry.is_script
+            directives = entry.directives
+            fingerprint = entry.fingerprint
+            etag: Optional[bytes] = entry.etag
+        else:
+            with file_path.open("rb") as file_handle:
+                file_content = file_handle.read()
+                fingerprint = stat_fingerprint(os.fstat(file_handle.fileno()))
+            script = is_script(file_content)
+            directives = parse_directives(file_content)
+            etag = None
     except FileNotFoundError:
         return DEFAULT_NOTALLOWED.encode("utf-8")
     except OSError as err:
         RNS.log(f"Error reading page {file_path}: {err}", RNS.LOG_ERROR)
         return DEFAULT_NOTALLOWED.encode("utf-8")
 
-    if is_script and os.access(str(file_path), os.X_OK):
-        try:
-            env_map = os.environ.copy()
-            if _link_id is not None:
-                env_map["link_id"] = RNS.hexrep(_link_id, delimit=False)
-            if remote_identity is not None:
-                env_map["remote_identity"] = RNS.hexrep(
-                    remote_identity.hash,
-                    delimit=False,
+    if_none_match = requested_etag(data)
+
+    if backends is not None:
+        spec = backends.resolve(file_path, directives)
+        if spec is not None:
+            try:
+                output = backends.request(
+                    file_path,
+                    spec,
+                    path,
+                    script_environment(_link_id, remote_identity, data),
+                )
+                return _unless_matching(output, if_none_match)
+            except BackendError as e:
+                RNS.log(f"Error from page backend for {path}: {e}", RNS.LOG_ERROR)
+                return DEFAULT_UNAVAILABLE.encode("utf-8")
+
+    if not script:
+        if templates is not None:
+            rendered = templates.render(file_path, file_content, fingerprint)
+            if rendered is not None:
+                return _unless_matching(
+                    rendered.content,
+                    if_none_match,
+                    rendered.etag,
+                )
+        return _unless_matching(file_content, if_none_match, etag)
+
+    if os.access(str(file_path), os.X_OK):
+        if scheduler is not None and not has_request_variables(data):
+            snapshot = scheduler.snapshot(str(file_path), directives, fingerprint)
+            if snapshot is not None:
+                return _unless_matching(snapshot.content, if_none_match, snapshot.etag)
+
+        if stream_policy(directives, stream_default):
+            try:
+                return _stream_script(
+                    file_path,
+                    file_content,
+                    script_environment(_link_id, remote_identity, data),
+                    script_pool,
+                    executor,
+                )
+            except ExecutorBusy:
+                RNS.log(
+                    f"Script queue full, rejecting request for {path}",
+                    RNS.LOG_WARNING,
+                )
+                return DEFAULT_BUSY.encode("utf-8")
+            except Exception as e:
+                RNS.log(f"Error executing script page: {e}", RNS.LOG_ERROR)
+                return file_content
+
+        identity_hash = None
+        if remote_identity is not None:
+            identity_hash = RNS.hexrep(remote_identity.hash, delimit=False)
+
+        cache_key = None
+        ttl = 0.0
+        if response_cache is not None:
+            ttl, vary_identity = response_cache_policy(directives, response_cache_ttl)
+            if ttl > 0:
+                cache_key = response_cache_key(
+                    path,
+                    data,
+                    identity_hash if vary_identity else None,
                 )
-            if data is not None and isinstance(data, dict):
-                for e in data:
-                    if isinstance(e, str) and (
-                        e.startswith("field_") or e.startswith("var_")
-                    ):
-                        env_map[e] = data[e]
-            result = subprocess.run(  # noqa: S603
-                [str(file_path)],
-                stdout=subprocess.PIPE,
-                check=True,
-                env=env_map,
+                cached = response_cache.get_entry(cache_key, fingerprint)
+                if cached is not None:
+                    return _unless_matching(cached.content, if_none_match, cached.etag)
+
+        request_env = script_environment(_link_id, remote_identity, data)
+
+        def run() -> bytes:
+            output = _execute_script(
+                file_path,
+                file_content,
+                request_env,
+                script_pool,
+                executor,
             )
-            return result.stdout
+            if cache_key is not None:
+                response_cache.put(cache_key, output, ttl, fingerprint)
+            return output
+
+        try:
+            coalesce, vary_identity = False, True
+            if single_flight is not None:
+                coalesce, vary_identity = coalesce_policy(directives, coalesce_default)
+            if coalesce:
+                flight_key = response_cache_key(
+                    path,
+                    data,
+                    identity_hash if vary_identity else None,
+                )
+                output = single_flight.do(flight_key, run)
+            else:
+                output = run()
+            return _unless_matching(output, if_none_match)
+        except ExecutorBusy:
+            RNS.log(f"Script queue full, rejecting request for {path}", RNS.LOG_WARNING)
+            return DEFAULT_BUSY.encode("utf-8")
         except Exception as e:
             RNS.log(f"Error executing script page: {e}", RNS.LOG_ERROR)
 
-    if file_content is not None:
-        return file_content
+    return _unless_matching(file_content, if_none_match, etag)
 
-    try:
-        with file_path.open("rb") as file_handle:
-            return file_handle.read()
-    except FileNotFoundError:
-        return DEFAULT_NOTALLOWED.encode("utf-8")
-    except OSError as err:
-        RNS.log(f"Error reading page fallback {file_path}: {err}", RNS.LOG_ERROR)
+
+def serve_files_manifest(
+    _path: str,
+    data: Any,
+    _request_id: bytes,
+    _link_id: bytes,
+    _remote_identity: Any,
+    _requested_at: float,
+    manifest: FilesManifest,
+) -> bytes:
+    """Serve the files manifest, or NOT_MODIFIED if the client's etag matches."""
+    packed, etag = manifest.current()
+    return _unless_matching(packed, requested_etag(data), etag)
+
+
+def serve_listing(
+    path: str,
+    data: Any,
+    _request_id: bytes,
+    _link_id: bytes,
+    _remote_identity: Any,
+    _requested_at: float,
+    listings: DirectoryListings,
+) -> bytes:
+    """Serve a directory listing page, selected by the ``var_page`` field.
+
+    NOT_MODIFIED is returned if the request's etag matches the page.
+    """
+    page = data.get("var_page") if isinstance(data, dict) else None
+    listing = listings.get(path, page)
+    if listing is None:
         return DEFAULT_NOTALLOWED.encode("utf-8")
+    content, etag = listing
+    return _unless_matching(content, requested_etag(data), etag)
+
+
+def serve_search(
+    path: str,
+    data: Any,
+    _request_id: bytes,
+    _link_id: bytes,
+    _remote_identity: Any,
+    _requested_at: float,
+    search: PageSearch,
+) -> bytes:
+    """Serve the search page for the ``field_q`` or ``var_q`` query."""
+    query = ""
+    if isinstance(data, dict):
+        query = str(data.get("field_q") or data.get("var_q") or "").strip()
+    return render_results(query, search.search(query) if query else [])
+
+
+def _range_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    """Return metadata for a range or manifest, where size means the source."""
+    range_metadata = dict(metadata)
+    if "encoding" in range_metadata:
+        range_metadata["original_size"] = range_metadata.pop("size")
+    return range_metadata
 
 
 def serve_file(
     path: str,
-    _data: Any,
+    data: Any,
     _request_id: bytes,
     _link_id: bytes,
     _remote_identity: Any,
     _requested_at: float,
     filespath: Path,
-) -> Union[bytes, list[Any]]:
-    """Serve a file from the files directory."""
-    filespath = filespath.resolve()
-    relative_path = path[6:] if path.startswith("/file/") else path[5:]
-    file_path = (filespath / relative_path).resolve()
+    compressed_store: Optional[CompressedStore] = None,
+    manifests: Optional[ManifestCache] = None,
+    mapped_files: Optional[MappedFiles] = None,
+    content_index: Optional[ContentIndex] = None,
+    routes: Optional[RouteTable] = None,
+) -> Union[bytes, list[Any], dict[str, Any]]:
+    """Serve a file from the files directory.
 
-    if not file_path.is_file() or not str(file_path).startswith(str(filespath)):
-        return DEFAULT_NOTALLOWED.encode("utf-8")
+    Requests under ``/file/.bz2/`` are answered with the pre-compressed
+    artifact from compressed_store, with ``encoding`` and ``size`` added to
+    the metadata. Until the artifact exists, or when compressing the file
+    did not pay off, the plain file is served instead.
+
+    Request data may select a byte range (``offset``/``length``), which is
+    returned with ``offset``, ``length``, ``size`` and ``mtime`` metadata, or
+    ask for the file's chunk manifest (``manifest``), taken from manifests
+    when given. Whole plain files are read from a shared memory mapping when
+    mapped_files is given and the file is large enough. With content_index,
+    manifests and mappings are shared between files with the same content.
+    Paths found in routes are served without resolving and checking them
+    again.
+    """
+    compressed = path.startswith(COMPRESSED_PREFIX)
+    if compressed:
+        relative_path = path[len(COMPRESSED_PREFIX) :]
+    else:
+        relative_path = path[6:] if path.startswith("/file/") else path[5:]
+    route = routes.get("/file/" + relative_path) if routes is not None else None
+    if route is not None:
+        file_path = Path(route.path)
+        name = route.name
+    else:
+        filespath = filespath.resolve()
+        file_path = (filespath / relative_path).resolve()
+        if not file_path.is_file() or not str(file_path).startswith(str(filespath)):
+            return DEFAULT_NOTALLOWED.encode("utf-8")
+        name = file_path.name.encode("utf-8")
+
+    metadata: dict[str, Any] = {"name": name}
+    source = str(file_path)
+    if compressed and compressed_store is not None:
+        artifact = compressed_store.lookup(source)
+        if artifact is not None:
+            source = artifact.path
+            metadata["encoding"] = b"bz2"
+            metadata["size"] = artifact.original_size
+
+    content_key = None
+    if content_index is not None and source == str(file_path):
+        content_key = content_index.digest(source)
 
     try:
-        return [
-            file_path.open("rb"),
-            {"name": file_path.name.encode("utf-8")},
-        ]
+        if wants_manifest(data):
+            manifest = (
+                manifests.get(source, content_key)
+                if manifests is not None
+                else build_manifest(source)
+            )
+            return {**manifest, **_range_metadata(metadata)}
+        byte_range = parse_range(data)
+        if byte_range is not None:
+            st = os.stat(source)
+            offset, length = resolve_range(byte_range, st.st_size)
+            range_metadata = _range_metadata(metadata)
+            range_metadata.update(
+                {
+                    "offset": offset,
+                    "length": length,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime_ns,
+                },
+            )
+            return [open_slice(source, offset, length), range_metadata]
+        if source != str(file_path):
+            # Open by descriptor so the transfer survives eviction of the
+            # artifact: RNS stats the handle's name for every segment.
+            return [open(os.open(source, os.O_RDONLY), "rb"), metadata]
+        if mapped_files is not None:
+            handle = mapped_files.open(source, content_key)
+            if handle is not None:
+                return [handle, metadata]
+        return [file_path.open("rb"), metadata]
+    except ValueError as err:
+        RNS.log(f"Invalid range request for {path}: {err}", RNS.LOG_DEBUG)
+        return DEFAULT_NOTALLOWED.encode("utf-8")
+    except (FileNotFoundError, IsADirectoryError):
+        return DEFAULT_NOTALLOWED.encode("utf-8")
     except OSError as err:
         RNS.log(f"Error opening file {file_path}: {err}", RNS.LOG_ERROR)
         return DEFAULT_NOTALLOWED.encode("utf-8")
@@ -0,0 +1,282 @@
+"""Generated directory listing pages for the files directory.
+
+Every directory under the files directory gets a Micron page listing its
+subdirectories and files, with sizes and links, split into pages of
+``page_size`` entries selected with a ``page`` link field (sent by clients
+as ``var_page``). The root is served at ``/page/.files.mu`` and a
+directory ``a/b`` at ``/page/.files/a/b.mu``; hidden names are never
+scanned, so these paths cannot collide with served pages.
+
+Listings are rendered from the served path index when files are
+registered, and only the directories containing added or removed files
+(and their parents) are rendered again, so a request is a dict lookup.
+Only files with a registered ``/file/`` route are listed, and only
+directories with something to list, so symlinks leading out of the files
+directory never appear.
+"""
+
+import os
+import threading
+from contextlib import nullcontext
+from typing import (
+    Any,
+    Container,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .cache import content_etag
+from .pathindex import PathIndex
+
+DEFAULT_LISTING_PAGE_SIZE = 100
+LISTING_ROOT = "/page/.files.mu"
+LISTING_PREFIX = "/page/.files/"
+_SIZE_UNITS = ("B", "KiB", "MiB", "GiB", "TiB")
+_LINE_MARKUP = ("#", "<", ">", "-")
+
+
+class Listing(NamedTuple):
+    """The rendered pages of one directory and their etags."""
+
+    pages: List[bytes]
+    etags: List[bytes]
+
+
+def listing_path(directory: str) -> str:
+    """Return the request path of the listing of a relative directory."""
+    if not directory:
+        return LISTING_ROOT
+    return f"{LISTING_PREFIX}{directory.replace(os.sep, '/')}.mu"
+
+
+def _file_path(relative: str) -> str:
+    """Return the request path of a file relative to the files directory."""
+    return "/file/" + relative.replace(os.sep, "/")
+
+
+def _depth(directory: str) -> int:
+    """Return the depth of a relative directory, 0 for the root."""
+    return directory.count(os.sep) + 1 if directory else 0
+
+
+def format_size(size: int) -> str:
+    """Return size in bytes as a short human readable string."""
+    if size < 1024:
+        return f"{size} B"
+    value = float(size)
+    for unit in _SIZE_UNITS[1:]:
+        value /= 1024
+        if value < 1024 or unit == _SIZE_UNITS[-1]:
+            break
+    return f"{value:.1f} {unit}"
+
+
+def escape_micron(text: str, line_start: bool = False) -> str:
+    """Escape Micron formatting characters in text.
+
+    Backslashes and backticks are escaped everywhere. With line_start, a
+    leading ``#``, ``<``, ``>`` or ``-``, which would make the line a
+    comment, section reset, heading or divider, is escaped too.
+    """
+    escaped = text.replace("\\", "\\\\").replace("`", "\\`")
+    if line_start and escaped.startswith(_LINE_MARKUP):
+        escaped = "\\" + escaped
+    return escaped
+
+
+def link_label(text: str) -> str:
+    """Return text made safe to use as the label of a Micron link.
+
+    A label ends at the first backtick and a link at the first ``]``, and
+    neither can be escaped there, so they are replaced with ``'`` and ``)``.
+    """
+    return text.replace("`", "'").replace("]", ")")
+
+
+def field_default(text: str) -> str:
+    """Return text made safe to use as the default value of a Micron field.
+
+    A default ends at the first ``>``, which cannot be escaped there, so it
+    is removed; backslashes and backticks are escaped as elsewhere.
+    """
+    return escape_micron(text).replace(">", "")
+
+
+def _linkable(request_path: str) -> bool:
+    """Return True if request_path can be the target of a Micron link."""
+    return "`" not in request_path and "]" not in request_path
+
+
+def _entry(name: str, link: str) -> str:
+    """Return a listing line linking name to link, or just the name.
+
+    Names whose request path cannot be written as a link are still listed.
+    """
+    if _linkable(link):
+        return f"`[{link_label(name)}`:{link}]"
+    return escape_micron(name, line_start=True)
+
+
+def _page_number(value: Any, pages: int) -> int:
+    """Return the 0-based page selected by a page field, clamped to pages."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return min(max(number, 1), pages) - 1
+
+
+class DirectoryListings:
+    """Render and keep the listing pages of every served directory."""
+
+    def __init__(self, page_size: int = DEFAULT_LISTING_PAGE_SIZE) -> None:
+        """Initialize with no listings; page_size entries are shown per page."""
+        self.page_size = max(page_size, 1)
+        self.rendered = 0
+        self._listings: Dict[str, Listing] = {}
+        self._lock = threading.Lock()
+
+    def update(
+        self,
+        served: PathIndex,
+        routes: Container[str],
+        changed: Iterable[str],
+        lock: Optional[ContextManager[Any]] = None,
+    ) -> Tuple[List[str], List[str]]:
+        """Render the directories of changed files and their parents again.
+
+        Args:
+            served: Index of the served files
+            routes: Registered ``/file/`` request paths; files without one
+                are left out
+            changed: Added, removed or modified file paths, joined onto
+                served.base
+            lock: Held while reading served and routes, if others modify them
+
+        Returns:
+            Tuple of (listing request paths that are new, listing request
+            paths of directories that no longer contain files)
+
+        """
+        directories: Set[str] = set()
+        with self._lock:
+            if LISTING_ROOT not in self._listings:
+                directories.add("")
+        for full_path in changed:
+            relative = served.relative(full_path)
+            if relative is None:
+                continue
+            parts = relative.split(os.sep)[:-1]
+            for depth in range(len(parts) + 1):
+                directories.add(os.sep.join(parts[:depth]))
+
+        with lock or nullcontext():
+            contents = {}
+            for directory in directories:
+                files, subdirs = served.children(directory)
+                routed = [
+                    name
+                    for name in files
+                    if _file_path(os.path.join(directory, name)) in routes
+                ]
+                contents[directory] = (routed, subdirs)
+
+        added: List[str] = []
+        removed: List[str] = []
+        # Deepest first, so a directory only links subdirectories left listed.
+        for directory in sorted(contents, key=_depth, reverse=True):
+            files, subdirs = contents[directory]
+            with self._lock:
+                subdirs = [
+                    name
+                    for name in subdirs
+                    if listing_path(os.path.join(directory, name)) in self._listings
+                ]
+            request_path = listing_path(directory)
+            if directory and not files and not subdirs:
+                with self._lock:
+                    if self._listings.pop(request_path, None) is not None:
+                        removed.append(request_path)
+                continue
+            listing = self._render(served.base, directory, files, subdirs)
+            with self._lock:
+                if request_path not in self._listings:
+                    added.append(request_path)
+                self._listings[request_path] = listing
+                self.rendered += 1
+        return added, removed
+
+    def _render(
+        self,
+        base: str,
+        directory: str,
+        files: List[str],
+        subdirs: List[str],
+    ) -> Listing:
+        entries = []
+        for name in subdirs:
+            link = listing_path(os.path.join(directory, name))
+            entries.append(_entry(f"{name}/", link))
+        for name in files:
+            relative = os.path.join(directory, name)
+            try:
+                size = format_size(os.stat(os.path.join(base, relative)).st_size)
+            except OSError:
+                size = "?"
+            entries.append(f"{_entry(name, _file_path(relative))}  {size}")
+
+        title = "/" + directory.replace(os.sep, "/")
+        header = [f">Index of {escape_micron(title)}", ""]
+        if directory:
+            header.append(f"`[../`:{listing_path(os.path.dirname(directory))}]")
+        if not entries:
+            header.append("No files are being served.")
+
+        request_path = listing_path(directory)
+        chunks = [
+            entries[start : start + self.page_size]
+            for start in range(0, len(entries), self.page_size)
+        ] or [[]]
+        pages = []
+        for number, chunk in enumerate(chunks, start=1):
+            lines = header + chunk
+            if len(chunks) > 1:
+                footer = f"Page {number} of {len(chunks)}"
+                if number > 1:
+                    footer += f"  `[Previous`:{request_path}`page={number - 1}]"
+                if number < len(chunks):
+                    footer += f"  `[Next`:{request_path}`page={number + 1}]"
+                lines += ["", footer]
+            pages.append(("\n".join(lines) + "\n").encode("utf-8"))
+        return Listing(pages, [content_etag(page) for page in pages])
+
+    def get(self, request_path: str, page: Any = None) -> Optional[Tuple[bytes, bytes]]:
+        """Return the (content, etag) of a listing page, or None if unknown.
+
+        Args:
+            request_path: Listing request path
+            page: 1-based page number, as int or string; out of range
+                values select the nearest page
+
+        """
+        with self._lock:
+            listing = self._listings.get(request_path)
+        if listing is None:
+            return None
+        number = _page_number(page, len(listing.pages))
+        return listing.pages[number], listing.etags[number]
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of listed directories and renders."""
+        with self._lock:
+            return {
+                "directories": len(self._listings),
+                "pages": sum(len(listing.pages) for listing in self._listings.values()),
+                "rendered": self.rendered,
+            }
@@ -5,9 +5,14 @@ from pathlib import Path
 
 import RNS
 
+from .cache import DEFAULT_PAGE_CACHE_SIZE, DEFAULT_RESPONSE_CACHE_SIZE
 from .cli import get_config_value, setup_logging, setup_parser
+from .compression import DEFAULT_SAMPLE_SIZE
 from .config import load_config
 from .core import PageNode
+from .executor import DEFAULT_MAX_CONCURRENT, DEFAULT_QUEUE_SIZE, DEFAULT_TIMEOUT
+from .precompress import DEFAULT_PRECOMPRESS_SIZE
+from .transfers import DEFAULT_MAX_TRANSFERS
 
 
 def main() -> None:
@@ -60,6 +65,169 @@ def main() -> None:
         config,
         int,
     )
+    page_cache_size = get_config_value(
+        args.page_cache_size,
+        DEFAULT_PAGE_CACHE_SIZE,
+        "page-cache-size",
+        config,
+        int,
+    )
+    watch = get_config_value(args.watch, False, "watch", config, bool)
+    scan_workers = get_config_value(
+        args.scan_workers,
+        0,
+        "scan-workers",
+        config,
+        int,
+    )
+    script_workers = get_config_value(
+        args.script_workers,
+        0,
+        "script-workers",
+        config,
+        int,
+    )
+    page_backends = get_config_value(
+        args.page_backends,
+        False,
+        "page-backends",
+        config,
+        bool,
+    )
+    script_cache_size = get_config_value(
+        args.script_cache_size,
+        DEFAULT_RESPONSE_CACHE_SIZE,
+        "script-cache-size",
+        config,
+        int,
+    )
+    script_cache_ttl = get_config_value(
+        args.script_cache_ttl,
+        0,
+        "script-cache-ttl",
+        config,
+        int,
+    )
+    script_max_concurrent = get_config_value(
+        args.script_max_concurrent,
+        DEFAULT_MAX_CONCURRENT,
+        "script-max-concurrent",
+        config,
+        int,
+    )
+    script_queue_size = get_config_value(
+        args.script_queue_size,
+        DEFAULT_QUEUE_SIZE,
+        "script-queue-size",
+        config,
+        int,
+    )
+    script_timeout = get_config_value(
+        args.script_timeout,
+        DEFAULT_TIMEOUT,
+        "script-timeout",
+        config,
+        int,
+    )
+    script_coalesce = get_config_value(
+        args.script_coalesce,
+        False,
+        "script-coalesce",
+        config,
+        bool,
+    )
+    script_stream = get_config_value(
+        args.script_stream,
+        False,
+        "script-stream",
+        config,
+        bool,
+    )
+    precompress_dir = get_config_value(
+        args.precompress_dir,
+        None,
+        "precompress-dir",
+        config,
+    )
+    precompress_size = get_config_value(
+        args.precompress_size,
+        DEFAULT_PRECOMPRESS_SIZE,
+        "precompress-size",
+        config,
+        int,
+    )
+    compress_rules = get_config_value(
+        args.compress_rules,
+        None,
+        "compress-rules",
+        config,
+    )
+    compress_sample = get_config_value(
+        args.compress_sample,
+        DEFAULT_SAMPLE_SIZE,
+        "compress-sample",
+        config,
+        int,
+    )
+    mmap_threshold = get_config_value(
+        args.mmap_threshold,
+        0,
+        "mmap-threshold",
+        config,
+        int,
+    )
+    max_transfers = get_config_value(
+        args.max_transfers,
+        DEFAULT_MAX_TRANSFERS,
+        "max-transfers",
+        config,
+        int,
+    )
+    files_manifest = get_config_value(
+        args.files_manifest,
+        False,
+        "files-manifest",
+        config,
+        bool,
+    )
+    content_index = get_config_value(
+        args.content_index,
+        None,
+        "content-index",
+        config,
+    )
+    scan_manifest = get_config_value(
+        args.scan_manifest,
+        None,
+        "scan-manifest",
+        config,
+    )
+    file_listings = get_config_value(
+        args.file_listings,
+        False,
+        "file-listings",
+        config,
+        bool,
+    )
+    page_search = get_config_value(
+        args.page_search,
+        False,
+        "page-search",
+        config,
+        bool,
+    )
+    search_index = get_config_value(
+        args.search_index,
+        None,
+        "search-index",
+        config,
+    )
+    script_schedule = get_config_value(
+        args.script_schedule,
+        None,
+        "script-schedule",
+        config,
+    )
     log_level = get_config_value(args.log_level, "INFO", "log-level", config)
 
     setup_logging(log_level)
@@ -84,6 +252,31 @@ def main() -> None:
         node_name,
         page_refresh_interval,
         file_refresh_interval,
+        page_cache_size,
+        watch,
+        scan_workers,
+        script_workers,
+        page_backends,
+        script_cache_size,
+        script_cache_ttl,
+        script_max_concurrent,
+        script_queue_size,
+        script_timeout,
+        script_coalesce,
+        script_stream,
+        precompress_dir,
+        precompress_size,
+        compress_rules,
+        compress_sample,
+        mmap_threshold,
+        max_transfers,
+        files_manifest,
+        content_index,
+        scan_manifest,
+        file_listings,
+        page_search,
+        search_index,
+        script_schedule,
     )
     RNS.log("Page node running. Press Ctrl-C to exit.", RNS.LOG_INFO)
     RNS.log(f"Node address: {RNS.prettyhexrep(node.destination.hash)}", RNS.LOG_INFO)
@@ -0,0 +1,91 @@
+"""Machine-readable manifest of the served files.
+
+The manifest lists every served file with its path relative to the files
+directory, size, mtime and SHA-256, so mirrors and clients can tell which
+files they already have without fetching them. Files are taken from the
+node's file routes, so only paths that can be requested are listed, and
+digests from its ContentIndex, so a rescan only hashes new and modified
+files. The manifest is only encoded again after the routes or the index
+changed.
+
+The manifest is served msgpack encoded as::
+
+    {"version": 1, "complete": bool,
+     "files": [[path, size, mtime, sha256], ...]}
+
+with files sorted by path, mtime in whole seconds and sha256 as 32 raw
+bytes, or nil while the file is still being hashed (``complete`` is false
+until every file has a hash).
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from RNS.vendor import umsgpack
+
+from .cache import content_etag
+from .content_index import ContentIndex
+from .routes import RouteTable
+
+MANIFEST_PATH = "/file/.manifest"
+MANIFEST_VERSION = 1
+
+
+class FilesManifest:
+    """Encode the files manifest from the file routes and a content index."""
+
+    def __init__(self, routes: RouteTable, index: ContentIndex) -> None:
+        """Build manifests for the files in routes with digests from index."""
+        self.routes = routes
+        self.index = index
+        self._generation: Optional[Tuple[int, int]] = None
+        self._packed = b""
+        self._etag = b""
+        self._lock = threading.Lock()
+
+    def current(self) -> Tuple[bytes, bytes]:
+        """Return the msgpack encoded manifest and its etag.
+
+        The encoding is rebuilt only after the routes or the index changed.
+        """
+        with self._lock:
+            generation = (self.routes.generation, self.index.generation)
+            if self._generation != generation:
+                _, entries = self.index.snapshot()
+                indexed = dict(entries)
+                files = []
+                for request_path, route in self.routes.items():
+                    rel = request_path[len(self.routes.prefix) :]
+                    entry = indexed.get(route.path)
+                    if entry is not None:
+                        mtime_ns, size, _ = entry.fingerprint
+                        digest = entry.sha256
+                    else:
+                        # Registered before the index picked it up.
+                        try:
+                            st = os.stat(route.path)
+                        except OSError:
+                            continue
+                        mtime_ns, size, digest = st.st_mtime_ns, st.st_size, None
+                    files.append([rel, size, mtime_ns // 1_000_000_000, digest])
+                files.sort()
+                self._packed = umsgpack.packb(
+                    {
+                        "version": MANIFEST_VERSION,
+                        "complete": all(f[3] is not None for f in files),
+                        "files": files,
+                    },
+                )
+                self._etag = content_etag(self._packed)
+                self._generation = generation
+            return self._packed, self._etag
+
+    def join(self) -> None:
+        """Wait until the index applied all queued updates."""
+        self.index.join()
+
+    def stats(self) -> Dict[str, int]:
+        """Return file and hashing counters."""
+        stats = self.index.stats()
+        return {key: stats[key] for key in ("files", "pending", "hashed")}
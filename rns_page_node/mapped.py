@@ -0,0 +1,226 @@
+"""Shared memory mappings for serving large files.
+
+Each large file is mapped once and every concurrent transfer of it reads
+from the same mapping through its own MappedReader, instead of each
+transfer opening the file and issuing its own read syscalls into private
+buffers. Mappings are checked against the file's stat fingerprint when a
+transfer starts; a changed file gets a fresh mapping and the old one is
+unmapped once its last transfer ends. Mappings are keyed by path and
+fingerprint; when the caller knows the file's content digest from a
+content index, they are keyed by it instead, so files with identical
+content share one mapping.
+
+RNS only sends a response as a file if it is exactly an io.BufferedReader
+whose name it can stat for the size, so readers are wrapped in one and
+named after a private duplicate of the file descriptor.
+
+Files must be replaced atomically (written elsewhere and renamed into
+place) while mapped: truncating a mapped file in place makes reads from
+the mapping fault. Readers check the file's size before every read and
+fail the transfer instead, but a truncation racing a read can still
+crash the process.
+"""
+
+import io
+import mmap
+import os
+import threading
+from typing import Callable, Dict, Optional, Union
+
+from .cache import Fingerprint, stat_fingerprint
+
+
+class _Mapping:
+    """A mapped file and the number of readers using it."""
+
+    def __init__(self, path: str, fingerprint: Fingerprint) -> None:
+        self.path = path
+        self.fingerprint = fingerprint
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.size = len(self.map)
+        self.readers = 0
+        self.stale = False
+
+    def close(self) -> None:
+        try:
+            self.map.close()
+        except BufferError:
+            # A reader that was never closed still holds a view; the
+            # mapping is released when it is garbage collected.
+            return
+        os.close(self.fd)
+
+
+class MappedReader(io.RawIOBase):
+    """A seekable raw reader over a shared mapping."""
+
+    def __init__(
+        self,
+        mapping: _Mapping,
+        release: Callable[[_Mapping], None],
+    ) -> None:
+        """Create a reader; release is called with mapping when it is closed."""
+        super().__init__()
+        self._mapping = mapping
+        self._release = release
+        self._view = memoryview(mapping.map)
+        self._position = 0
+        self.name = os.dup(mapping.fd)
+
+    def readable(self) -> bool:
+        """Return True."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True."""
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        """Copy the next bytes of the mapping into buffer.
+
+        Raises:
+            OSError: If the file was truncated below the mapped size, where
+                reading the mapping would fault
+
+        """
+        if os.fstat(self.name).st_size < self._mapping.size:
+            raise OSError(f"{self._mapping.path} was truncated while mapped")
+        count = max(min(len(buffer), self._mapping.size - self._position), 0)
+        buffer[:count] = self._view[self._position : self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to offset relative to whence and return the new position."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._mapping.size
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        """Return the current position."""
+        return self._position
+
+    def close(self) -> None:
+        """Release the view, the descriptor and the reference on the mapping."""
+        if not self.closed:
+            self._view.release()
+            os.close(self.name)
+            self._release(self._mapping)
+        super().close()
+
+
+class MappedFiles:
+    """Map files at or above a size threshold and share the mappings."""
+
+    def __init__(self, threshold: int) -> None:
+        """Initialize the registry.
+
+        Args:
+            threshold: Minimum file size in bytes served from a mapping
+
+        """
+        self.threshold = threshold
+        self.hits = 0
+        self.mapped = 0
+        self._mappings: Dict[Union[str, bytes], _Mapping] = {}
+        self._lock = threading.Lock()
+
+    def open(
+        self,
+        path: str,
+        content_key: Optional[bytes] = None,
+    ) -> Optional[io.BufferedReader]:
+        """Return a reader for path from its mapping, or None if it is too small.
+
+        Args:
+            path: File to read
+            content_key: Digest of the file's content; a mapping of any file
+                with the same digest is reused as long as that file is
+                unchanged
+
+        Raises:
+            OSError: If the file cannot be stat'ed or mapped
+
+        """
+        st = os.stat(path)
+        if st.st_size < self.threshold or st.st_size == 0:
+            return None
+        fingerprint = stat_fingerprint(st)
+        key: Union[str, bytes] = path if content_key is None else content_key
+        with self._lock:
+            mapping = self._mappings.get(key)
+            if mapping is not None and self._is_current(mapping, fingerprint, key):
+                self.hits += 1
+            else:
+                if mapping is not None:
+                    self._retire(mapping)
+                mapping = _Mapping(path, fingerprint)
+                self._mappings[key] = mapping
+                self.mapped += 1
+            mapping.readers += 1
+        try:
+            return io.BufferedReader(MappedReader(mapping, self._release))
+        except BaseException:
+            self._release(mapping)
+            raise
+
+    @staticmethod
+    def _is_current(
+        mapping: _Mapping,
+        fingerprint: Fingerprint,
+        key: Union[str, bytes],
+    ) -> bool:
+        if isinstance(key, str):
+            return mapping.fingerprint == fingerprint
+        # Keyed by content: the mapped file only has to be unchanged, which
+        # its open descriptor tells without a path lookup.
+        try:
+            return stat_fingerprint(os.fstat(mapping.fd)) == mapping.fingerprint
+        except OSError:
+            return False
+
+    def _release(self, mapping: _Mapping) -> None:
+        with self._lock:
+            mapping.readers -= 1
+            if mapping.stale and mapping.readers == 0:
+                mapping.close()
+
+    def _retire(self, mapping: _Mapping) -> None:
+        """Mark mapping as replaced and unmap it if no reader uses it."""
+        mapping.stale = True
+        if mapping.readers == 0:
+            mapping.close()
+
+    def invalidate(self, path: str) -> None:
+        """Drop the mappings of a file that changed or is no longer served."""
+        with self._lock:
+            for key in [k for k, m in self._mappings.items() if m.path == path]:
+                self._retire(self._mappings.pop(key))
+
+    def clear(self) -> None:
+        """Drop all mappings."""
+        with self._lock:
+            mappings = list(self._mappings.values())
+            self._mappings.clear()
+            for mapping in mappings:
+                self._retire(mapping)
+
+    def stats(self) -> Dict[str, int]:
+        """Return mapping counters."""
+        with self._lock:
+            return {
+                "mappings": len(self._mappings),
+                "readers": sum(m.readers for m in self._mappings.values()),
+                "mapped": self.mapped,
+                "hits": self.hits,
+            }
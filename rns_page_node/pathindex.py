@@ -0,0 +1,178 @@
+"""Compact index of the served pages or files.
+
+Paths returned by the scanner all start with the scanned directory, which
+on large trees makes the shared prefix most of the memory a plain list of
+absolute paths uses. PathIndex stores each path once, relative to the
+directory, in a set for O(1) membership and set-based diffs between scans,
+and keeps a sorted array of the same strings for prefix listings, built on
+first use and kept up to date by later changes.
+
+Iterating, indexing and len() behave like the list of absolute paths the
+node used to keep, in sorted order.
+"""
+
+import os
+from bisect import bisect_left, insort
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union, overload
+
+_MAX_CHAR = "\U0010ffff"
+
+
+class PathIndex:
+    """A set of paths under a base directory, stored relative to it."""
+
+    def __init__(self, base: Union[Path, str], paths: Iterable[str] = ()) -> None:
+        """Index paths, which are expected to be joined onto base."""
+        self.base = str(Path(base))
+        self._prefix = os.path.join(self.base, "")
+        self._relative: Set[str] = set()
+        self._outside: Set[str] = set()
+        self._sorted: Optional[List[str]] = None
+        for path in paths:
+            self.add(path)
+
+    def relative(self, full_path: str) -> Optional[str]:
+        """Return full_path relative to base, or None if it is outside base."""
+        if full_path.startswith(self._prefix):
+            return full_path[len(self._prefix) :]
+        return None
+
+    def add(self, full_path: str) -> bool:
+        """Add full_path and return False if it was already indexed."""
+        relative = self.relative(full_path)
+        if relative is None:
+            if full_path in self._outside:
+                return False
+            self._outside.add(full_path)
+            return True
+        if relative in self._relative:
+            return False
+        self._relative.add(relative)
+        if self._sorted is not None:
+            insort(self._sorted, relative)
+        return True
+
+    append = add
+
+    def remove_tree(self, full_path: str, is_dir: bool) -> List[str]:
+        """Remove full_path, or everything below it for directories.
+
+        Returns:
+            The removed paths, joined onto base
+
+        """
+        relative = self.relative(full_path)
+        if full_path.rstrip(os.sep) == self.base:
+            relative = ""
+        removed: List[str] = []
+        if relative is None:
+            prefix = full_path.rstrip(os.sep) + os.sep
+            removed = [
+                p
+                for p in self._outside
+                if p == full_path or (is_dir and p.startswith(prefix))
+            ]
+            self._outside.difference_update(removed)
+            return removed
+        if relative in self._relative:
+            self._relative.discard(relative)
+            if self._sorted is not None:
+                del self._sorted[bisect_left(self._sorted, relative)]
+            removed.append(full_path)
+        if is_dir:
+            prefix = relative.rstrip(os.sep) + os.sep if relative else ""
+            ordered = self._ordered()
+            start = bisect_left(ordered, prefix)
+            end = bisect_left(ordered, prefix + _MAX_CHAR, start)
+            below = ordered[start:end]
+            del ordered[start:end]
+            self._relative.difference_update(below)
+            removed.extend(self._prefix + p for p in below)
+        return removed
+
+    def with_prefix(self, prefix: str) -> List[str]:
+        """Return the sorted relative paths starting with prefix."""
+        ordered = self._ordered()
+        start = bisect_left(ordered, prefix)
+        return ordered[start : bisect_left(ordered, prefix + _MAX_CHAR, start)]
+
+    def children(self, directory: str) -> Tuple[List[str], List[str]]:
+        """Return the sorted (file names, subdirectory names) in a directory.
+
+        Args:
+            directory: Directory relative to base, "" for base itself
+
+        Subdirectories are skipped over by bisection, so the cost depends on
+        the number of entries directly in directory, not below it.
+        """
+        ordered = self._ordered()
+        prefix = directory + os.sep if directory else ""
+        files: List[str] = []
+        subdirs: List[str] = []
+        position = bisect_left(ordered, prefix)
+        while position < len(ordered) and ordered[position].startswith(prefix):
+            name, separator, _ = ordered[position][len(prefix) :].partition(os.sep)
+            if separator:
+                subdirs.append(name)
+                subdir_end = prefix + name + os.sep + _MAX_CHAR
+                position = bisect_left(ordered, subdir_end, position)
+            else:
+                files.append(name)
+                position += 1
+        return files, subdirs
+
+    def diff(self, previous: "PathIndex") -> Tuple[List[str], List[str]]:
+        """Return the (added, removed) paths relative to a previous index."""
+        added = [self._prefix + p for p in self._relative - previous._relative]
+        added.extend(self._outside - previous._outside)
+        removed = [self._prefix + p for p in previous._relative - self._relative]
+        removed.extend(previous._outside - self._outside)
+        return added, removed
+
+    def _ordered(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self._relative)
+        return self._sorted
+
+    def __contains__(self, full_path: object) -> bool:
+        """Return True if full_path is indexed."""
+        if not isinstance(full_path, str):
+            return False
+        relative = self.relative(full_path)
+        if relative is None:
+            return full_path in self._outside
+        return relative in self._relative
+
+    def __len__(self) -> int:
+        """Return the number of indexed paths."""
+        return len(self._relative) + len(self._outside)
+
+    def __iter__(self) -> Iterator[str]:
+        """Yield the indexed paths joined onto base, in sorted order."""
+        for relative in list(self._ordered()):
+            yield self._prefix + relative
+        yield from sorted(self._outside)
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        """Return paths by position in iteration order."""
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PathIndex index out of range")
+        ordered = self._ordered()
+        if index < len(ordered):
+            return self._prefix + ordered[index]
+        return sorted(self._outside)[index - len(ordered)]
+
+    def __repr__(self) -> str:
+        """Return a short description with the base and the number of paths."""
+        return f"PathIndex({self.base!r}, {len(self)} paths)"
@@ -0,0 +1,280 @@
+"""Background pre-compression of served files.
+
+Files under the files directory are compressed once, in a background
+thread, into a cache directory instead of being compressed by RNS on every
+transfer. Artifacts are named after the SHA-256 of the file content, taken
+from the node's ContentIndex when it has one, so every unique content is
+compressed and stored once however many paths serve it. The cache is
+bounded by a byte budget with LRU eviction, and artifacts that no served
+file refers to any more are removed after each scan.
+
+Compressed variants are served under ``/file/.bz2/<path>`` with handlers
+that do not compress again, and carry ``encoding`` and ``size`` metadata so
+clients can decompress them. Hidden paths are never scanned, so the prefix
+cannot collide with a served file.
+"""
+
+import bz2
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+import RNS
+
+from .cache import Fingerprint, stat_fingerprint
+from .content_index import ContentIndex, hash_file
+
+DEFAULT_PRECOMPRESS_SIZE = 256 * 1024 * 1024
+MIN_COMPRESS_SIZE = 4096
+MIN_SAVINGS = 0.1
+COMPRESSION_LEVEL = 9
+COMPRESSED_PREFIX = "/file/.bz2/"
+ARTIFACT_SUFFIX = ".bz2"
+_TEMP_PREFIX = ".tmp-"
+_CHUNK_SIZE = 1024 * 1024
+_CLEANUP = object()
+_STOP = object()
+
+
+class Artifact(NamedTuple):
+    """A compressed artifact and the size of the file it was made from."""
+
+    path: str
+    original_size: int
+
+
+class CompressedStore:
+    """Compress files in the background and keep the artifacts on disk."""
+
+    def __init__(
+        self,
+        cache_dir: Union[Path, str],
+        max_bytes: int = DEFAULT_PRECOMPRESS_SIZE,
+        index: Optional[ContentIndex] = None,
+    ) -> None:
+        """Open the cache directory and start the compression thread.
+
+        Args:
+            cache_dir: Directory holding compressed artifacts, created if missing
+            max_bytes: Disk budget for artifacts; least recently served
+                artifacts are removed beyond it
+            index: Content index to take file digests from instead of
+                hashing every file again
+
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.index = index
+        self.total_bytes = 0
+        self.compressed = 0
+        self.reused = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.errors = 0
+        self._entries: Dict[str, Tuple[Fingerprint, Optional[str]]] = {}
+        self._artifacts: "OrderedDict[str, int]" = OrderedDict()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._load_existing()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _load_existing(self) -> None:
+        """Account for artifacts left by a previous run, oldest first."""
+        found = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(_TEMP_PREFIX):
+                    self._unlink(entry.path)
+                elif entry.name.endswith(ARTIFACT_SUFFIX) and entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._artifacts[name] = size
+            self.total_bytes += size
+
+    def submit(self, paths: Iterable[str]) -> None:
+        """Queue files to be compressed if they changed since the last pass."""
+        for path in paths:
+            with self._lock:
+                if path in self._pending:
+                    continue
+                self._pending.add(path)
+            self._queue.put(path)
+
+    def forget(self, paths: Iterable[str]) -> None:
+        """Drop files that are no longer served."""
+        with self._lock:
+            for path in paths:
+                self._entries.pop(os.path.realpath(path), None)
+
+    def cleanup(self) -> None:
+        """Queue removal of artifacts no served file refers to."""
+        self._queue.put(_CLEANUP)
+
+    def lookup(self, path: str) -> Optional[Artifact]:
+        """Return the artifact for path if it matches the file on disk."""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry[1] is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if stat_fingerprint(st) != entry[0]:
+            return None
+        with self._lock:
+            if entry[1] not in self._artifacts:
+                return None
+            self._artifacts.move_to_end(entry[1])
+        return Artifact(str(self.cache_dir / entry[1]), st.st_size)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if item is _CLEANUP:
+                self._prune()
+                continue
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            path = str(item)
+            with self._lock:
+                self._pending.discard(path)
+            try:
+                self._process(os.path.realpath(path))
+            except OSError as e:
+                with self._lock:
+                    self.errors += 1
+                RNS.log(f"Error pre-compressing {path}: {e}", RNS.LOG_ERROR)
+
+    def _process(self, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        fingerprint = stat_fingerprint(st)
+        with self._lock:
+            current = self._entries.get(path)
+            if current is not None and current[0] == fingerprint:
+                return
+        if st.st_size < MIN_COMPRESS_SIZE:
+            with self._lock:
+                self._entries[path] = (fingerprint, None)
+            return
+
+        digest = self.index.digest(path) if self.index is not None else None
+        if digest is None:
+            digest = hash_file(path)
+        name = f"{digest.hex()}{ARTIFACT_SUFFIX}"
+        with self._lock:
+            exists = name in self._artifacts
+            if exists:
+                self.reused += 1
+        if not exists and not self._compress(path, name, st.st_size):
+            with self._lock:
+                self.skipped += 1
+                self._entries[path] = (fingerprint, None)
+            return
+        with self._lock:
+            self._entries[path] = (fingerprint, name)
+        self._enforce_limit()
+
+    def _compress(self, path: str, name: str, size: int) -> bool:
+        """Write the artifact for path; return False if it is not worth keeping."""
+        limit = min(size * (1 - MIN_SAVINGS), self.max_bytes)
+        fd, temp_path = tempfile.mkstemp(prefix=_TEMP_PREFIX, dir=self.cache_dir)
+        written = 0
+        try:
+            compressor = bz2.BZ2Compressor(COMPRESSION_LEVEL)
+            with open(path, "rb") as source, os.fdopen(fd, "wb") as target:
+                while chunk := source.read(_CHUNK_SIZE):
+                    data = compressor.compress(chunk)
+                    written += len(data)
+                    if written > limit:
+                        break
+                    target.write(data)
+                else:
+                    data = compressor.flush()
+                    written += len(data)
+                    target.write(data)
+            if written > limit:
+                self._unlink(temp_path)
+                return False
+            os.replace(temp_path, self.cache_dir / name)
+        except BaseException:
+            self._unlink(temp_path)
+            raise
+        with self._lock:
+            self._artifacts[name] = written
+            self.total_bytes += written
+            self.compressed += 1
+        return True
+
+    def _enforce_limit(self) -> None:
+        evicted = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and self._artifacts:
+                name, size = self._artifacts.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                evicted.append(name)
+            if evicted:
+                evicted_set = set(evicted)
+                for path, (fingerprint, name) in self._entries.items():
+                    if name in evicted_set:
+                        self._entries[path] = (fingerprint, None)
+        for name in evicted:
+            self._unlink(self.cache_dir / name)
+
+    def _prune(self) -> None:
+        with self._lock:
+            referenced = {name for _, name in self._entries.values() if name}
+            stale = [name for name in self._artifacts if name not in referenced]
+            for name in stale:
+                self.total_bytes -= self._artifacts.pop(name)
+        for name in stale:
+            self._unlink(self.cache_dir / name)
+        if stale:
+            RNS.log(f"Removed {len(stale)} stale compressed files", RNS.LOG_DEBUG)
+
+    @staticmethod
+    def _unlink(path: Union[Path, str]) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """Return artifact and compression counters."""
+        with self._lock:
+            return {
+                "artifacts": len(self._artifacts),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "compressed": self.compressed,
+                "reused": self.reused,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+
+    def join(self) -> None:
+        """Wait until all queued work has been processed."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def shutdown(self) -> None:
+        """Stop the compression thread."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
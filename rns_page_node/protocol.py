@@ -0,0 +1,49 @@
+"""Length-prefixed framing used to talk to script workers and page backends.
+
+Each frame is an 8 byte header holding the big-endian lengths of a JSON
+object and a raw body, followed by the JSON object and the body itself.
+"""
+
+import json
+import struct
+from typing import Any, BinaryIO, Dict, Tuple
+
+FRAME_HEADER = struct.Struct(">II")
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+def write_frame(stream: BinaryIO, header: Dict[str, Any], body: bytes = b"") -> None:
+    """Write a single frame to stream and flush it."""
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    stream.write(FRAME_HEADER.pack(len(encoded), len(body)))
+    stream.write(encoded)
+    if body:
+        stream.write(body)
+    stream.flush()
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size) if size else b""
+    if len(data) != size:
+        raise EOFError("stream closed while reading frame")
+    return data
+
+
+def read_frame(stream: BinaryIO) -> Tuple[Dict[str, Any], bytes]:
+    """Read a single frame from stream.
+
+    Raises:
+        EOFError: If the stream ends before a complete frame was read
+        ValueError: If the frame header is malformed
+        TypeError: If the frame header is not a JSON object
+
+    """
+    header_size, body_size = FRAME_HEADER.unpack(
+        _read_exact(stream, FRAME_HEADER.size),
+    )
+    if header_size > MAX_HEADER_SIZE:
+        raise ValueError(f"frame header too large: {header_size} bytes")
+    header = json.loads(_read_exact(stream, header_size).decode("utf-8"))
+    if not isinstance(header, dict):
+        raise TypeError("frame header is not an object")
+    return header, _read_exact(stream, body_size)
@@ -0,0 +1,213 @@
+"""Byte ranges and chunk manifests for resumable file downloads.
+
+File requests may carry request data selecting what is sent:
+
+* ``{"offset": n, "length": m}`` returns ``m`` bytes starting at ``n``
+  (without ``length``, everything from ``n`` to the end of the file).
+* ``{"manifest": True}`` returns a manifest with the file's size, mtime and
+  the SHA-256 of each ``chunk_size`` sized chunk, so a client can resume an
+  interrupted download, or fetch chunks over several links in parallel,
+  and verify the pieces before reassembling them.
+
+RNS sends file responses by stat'ing the handle's name for its size, so a
+slice is copied into an unlinked temporary file (with copy_file_range where
+the platform has it) rather than handed out as a view on the original.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Union
+
+from .cache import Fingerprint, stat_fingerprint
+
+MANIFEST_CHUNK_SIZE = 1024 * 1024
+MANIFEST_CACHE_ENTRIES = 256
+_COPY_SIZE = 1024 * 1024
+
+_CachedManifest = Tuple[Fingerprint, Dict[str, Any]]
+
+
+class ByteRange(NamedTuple):
+    """A requested slice of a file; length None means up to the end."""
+
+    offset: int
+    length: Optional[int]
+
+
+def _non_negative_int(value: Any, key: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{key} must be a non-negative integer")
+    return value
+
+
+def parse_range(data: Any) -> Optional[ByteRange]:
+    """Return the byte range requested in data, or None for the whole file.
+
+    Raises:
+        ValueError: If offset or length are not non-negative integers
+
+    """
+    if not isinstance(data, dict) or ("offset" not in data and "length" not in data):
+        return None
+    offset = _non_negative_int(data.get("offset", 0), "offset")
+    length = data.get("length")
+    if length is not None:
+        length = _non_negative_int(length, "length")
+    return ByteRange(offset, length)
+
+
+def wants_manifest(data: Any) -> bool:
+    """Return True if data asks for the chunk manifest instead of content."""
+    return isinstance(data, dict) and bool(data.get("manifest"))
+
+
+def resolve_range(byte_range: ByteRange, size: int) -> Tuple[int, int]:
+    """Clamp byte_range to a file of size bytes and return (offset, length).
+
+    Raises:
+        ValueError: If the range starts beyond the end of the file
+
+    """
+    if byte_range.offset > size:
+        raise ValueError(f"offset {byte_range.offset} is beyond {size} bytes")
+    remaining = size - byte_range.offset
+    if byte_range.length is None:
+        return byte_range.offset, remaining
+    return byte_range.offset, min(byte_range.length, remaining)
+
+
+def _copy_range(source_fd: int, target_fd: int, offset: int, length: int) -> None:
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < length:
+                count = os.copy_file_range(
+                    source_fd,
+                    target_fd,
+                    length - copied,
+                    offset + copied,
+                )
+                if count == 0:
+                    return
+                copied += count
+            return
+        except OSError:
+            # Not supported between these filesystems; copy the rest by hand.
+            os.lseek(target_fd, copied, os.SEEK_SET)
+    while copied < length:
+        chunk = os.pread(source_fd, min(_COPY_SIZE, length - copied), offset + copied)
+        if not chunk:
+            return
+        os.write(target_fd, chunk)
+        copied += len(chunk)
+
+
+def open_slice(path: str, offset: int, length: int) -> io.BufferedReader:
+    """Copy a slice of path into an unlinked temporary file and open it.
+
+    The returned handle's name is its file descriptor, which RNS can stat
+    for the slice size; closing the handle releases the copy.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix="rns-range-")
+    os.unlink(temp_path)
+    try:
+        source_fd = os.open(path, os.O_RDONLY)
+        try:
+            _copy_range(source_fd, fd, offset, length)
+        finally:
+            os.close(source_fd)
+        os.lseek(fd, 0, os.SEEK_SET)
+        return open(fd, "rb")
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def build_manifest(path: str, chunk_size: int = MANIFEST_CHUNK_SIZE) -> Dict[str, Any]:
+    """Hash path chunk by chunk and return its manifest."""
+    chunks = []
+    with open(path, "rb") as handle:
+        st = os.fstat(handle.fileno())
+        while chunk := handle.read(chunk_size):
+            chunks.append(hashlib.sha256(chunk).digest())
+    return {
+        "name": os.path.basename(path).encode("utf-8"),
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "chunk_size": chunk_size,
+        "hash": "sha256",
+        "chunks": chunks,
+    }
+
+
+class ManifestCache:
+    """Keep recently requested manifests until their file changes.
+
+    Manifests requested with a content key are shared by every file with
+    that content; only the name and mtime are taken from the requested file.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MANIFEST_CACHE_ENTRIES,
+        chunk_size: int = MANIFEST_CHUNK_SIZE,
+    ) -> None:
+        """Initialize an empty cache holding up to max_entries manifests."""
+        self.max_entries = max_entries
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Union[str, bytes], _CachedManifest]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, path: str, content_key: Optional[bytes] = None) -> Dict[str, Any]:
+        """Return the manifest for path, hashing it again if it changed.
+
+        Args:
+            path: File to describe
+            content_key: Digest of the file's content, as a cache key that
+                stays valid across files and changes with the same content
+
+        Raises:
+            OSError: If the file cannot be read
+
+        """
+        fingerprint = stat_fingerprint(os.stat(path))
+        key: Union[str, bytes] = path if content_key is None else content_key
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and (
+                content_key is not None or cached[0] == fingerprint
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return {
+                    **cached[1],
+                    "name": os.path.basename(path).encode("utf-8"),
+                    "mtime": fingerprint[0],
+                }
+            self.misses += 1
+        manifest = build_manifest(path, self.chunk_size)
+        if manifest["size"] != fingerprint[1] or manifest["mtime"] != fingerprint[0]:
+            return manifest
+        with self._lock:
+            self._entries[key] = (fingerprint, manifest)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return manifest
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
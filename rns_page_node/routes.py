@@ -0,0 +1,81 @@
+"""Precomputed routes from request paths to served files.
+
+Request paths are derived from the resolved path of each page and file
+when it is registered, and only for files inside the served directory, so
+the file a request path refers to is known without resolving it again.
+RouteTable keeps that mapping for the handlers, replacing per-request
+``resolve()``, containment and ``is_file()`` checks with a dict lookup.
+
+Tables are updated in place by the node while it holds its lock, so a
+scan or watcher event costs time proportional to the paths it adds or
+removes, not to the size of the tree. Handlers read without locking: a
+single dict lookup is atomic. Routes are re-validated whenever a path is
+registered again; a file that vanished in between fails to open and is
+answered like a missing file.
+"""
+
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Route(NamedTuple):
+    """The absolute path a request path is served from and its file name."""
+
+    path: str
+    name: bytes
+
+
+class RouteTable:
+    """A mapping from request paths under a prefix to routes."""
+
+    def __init__(self, base: str, prefix: str) -> None:
+        """Create an empty table for request paths under prefix, served from base.
+
+        Args:
+            base: Resolved directory the request paths are relative to
+            prefix: Request path prefix, such as ``/page/``
+
+        """
+        self.base = base
+        self.prefix = prefix
+        self.generation = 0
+        self._routes: Dict[str, Route] = {}
+
+    def route(self, request_path: str) -> Route:
+        """Return the route for a registered request path."""
+        relative = request_path[len(self.prefix) :]
+        path = os.path.join(self.base, *relative.split("/"))
+        return Route(path, os.path.basename(path).encode("utf-8"))
+
+    def get(self, request_path: str) -> Optional[Route]:
+        """Return the route for request_path, or None if it is not registered."""
+        return self._routes.get(request_path)
+
+    def update(
+        self,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = (),
+    ) -> None:
+        """Add routes for the added request paths and drop the removed ones.
+
+        Callers serialize updates; concurrent lookups are safe. Every update
+        advances generation, so views built from the table know when to
+        rebuild.
+        """
+        for request_path in removed:
+            self._routes.pop(request_path, None)
+        for request_path in added:
+            self._routes[request_path] = self.route(request_path)
+        self.generation += 1
+
+    def items(self) -> List[Tuple[str, Route]]:
+        """Return a copy of the (request path, route) pairs."""
+        return list(self._routes.items())
+
+    def __len__(self) -> int:
+        """Return the number of routes."""
+        return len(self._routes)
+
+    def __contains__(self, request_path: object) -> bool:
+        """Return True if request_path has a route."""
+        return request_path in self._routes
@@ -0,0 +1,138 @@
+"""Persisted result of the last page and file scan.
+
+On large trees the initial scan, and sampling every file for its
+compression setting, delays the first announce by as long as it takes to
+walk the tree. The node can instead save the served pages and files, with
+each file's compression decision and the stat fingerprint it was made
+for, and on the next start register handlers straight from that manifest,
+start announcing, and reconcile with the filesystem in the background.
+
+Saved decisions are only reused while the compression settings that
+produced them are unchanged. The manifest is msgpack encoded.
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+import RNS
+from RNS.vendor import umsgpack
+
+from .compression import Decision
+
+SCAN_MANIFEST_VERSION = 1
+
+
+class ScannedFile(NamedTuple):
+    """A served file's request path and compression decision, if reusable."""
+
+    request_path: str
+    decision: Optional[Decision]
+
+
+class ScanState(NamedTuple):
+    """Served pages with their request paths, and served files."""
+
+    pages: Dict[str, str]
+    files: Dict[str, ScannedFile]
+
+
+def _encode_decision(decision: Optional[Decision]) -> Optional[List[Any]]:
+    if decision is None:
+        return None
+    fingerprint = list(decision.fingerprint) if decision.fingerprint else None
+    return [
+        decision.auto_compress,
+        decision.reason,
+        decision.size,
+        decision.ratio,
+        fingerprint,
+    ]
+
+
+def _decode_decision(value: Optional[List[Any]]) -> Optional[Decision]:
+    if value is None:
+        return None
+    auto_compress, reason, size, ratio, fingerprint = value
+    return Decision(
+        auto_compress,
+        reason,
+        size,
+        ratio,
+        tuple(fingerprint) if fingerprint else None,
+    )
+
+
+def load_scan_manifest(
+    path: Union[Path, str],
+    pagespath: Union[Path, str],
+    filespath: Union[Path, str],
+    settings: List[Any],
+) -> Optional[ScanState]:
+    """Return the saved scan for these directories, or None if there is none.
+
+    Args:
+        path: Manifest file
+        pagespath: Pages directory the scan must have been made of
+        filespath: Files directory the scan must have been made of
+        settings: Current compression settings; saved decisions made with
+            other settings are dropped
+
+    """
+    try:
+        with open(path, "rb") as handle:
+            stored = umsgpack.unpackb(handle.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        RNS.log(f"Ignoring unreadable scan manifest {path}: {e}", RNS.LOG_WARNING)
+        return None
+    try:
+        if (
+            stored.get("version") != SCAN_MANIFEST_VERSION
+            or stored["pages_dir"] != str(pagespath)
+            or stored["files_dir"] != str(filespath)
+        ):
+            return None
+        reuse = stored["settings"] == settings
+        files = {
+            full_path: ScannedFile(
+                request_path,
+                _decode_decision(decision) if reuse else None,
+            )
+            for full_path, request_path, decision in stored["files"]
+        }
+        return ScanState(dict(stored["pages"]), files)
+    except (KeyError, TypeError, ValueError) as e:
+        RNS.log(f"Ignoring invalid scan manifest {path}: {e}", RNS.LOG_WARNING)
+        return None
+
+
+def save_scan_manifest(
+    path: Union[Path, str],
+    pagespath: Union[Path, str],
+    filespath: Union[Path, str],
+    settings: List[Any],
+    state: ScanState,
+) -> None:
+    """Write state atomically to path, logging instead of raising on errors."""
+    packed = umsgpack.packb(
+        {
+            "version": SCAN_MANIFEST_VERSION,
+            "pages_dir": str(pagespath),
+            "files_dir": str(filespath),
+            "settings": settings,
+            "pages": [list(page) for page in state.pages.items()],
+            "files": [
+                [full_path, scanned.request_path, _encode_decision(scanned.decision)]
+                for full_path, scanned in state.files.items()
+            ],
+        },
+    )
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as handle:
+            handle.write(packed)
+        os.replace(temp_path, path)
+    except OSError as e:
+        RNS.log(f"Could not save scan manifest: {e}", RNS.LOG_ERROR)
@@ -0,0 +1,325 @@
+"""Scheduled background rendering of script pages.
+
+Script pages whose output only needs to be fresh every few minutes can be
+rendered on a schedule instead of on request, declared with a directive
+below the shebang::
+
+    #!/usr/bin/env python3
+    #!schedule every=300
+
+or for several pages at once with ``glob:seconds`` rules in the
+``script-schedule`` option, where globs match the path relative to the
+pages directory or the file name. ``#!schedule off`` opts a page out of
+the rules.
+
+A scheduler thread runs each scheduled page without request variables,
+one at a time, and keeps the latest output as a snapshot that serve_page
+returns for requests without ``field_*`` or ``var_*`` data, so those
+requests never wait on the script. Until the first render finishes, and
+for requests with variables, the page runs as usual. When a render fails,
+the previous snapshot is kept and the error is recorded in the page's
+status. A snapshot is never served for a script that changed since it was
+examined, or whose ``#!schedule`` directive was removed; the page is
+examined again and runs as usual in the meantime.
+"""
+
+import fnmatch
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import RNS
+
+from .cache import Fingerprint, content_etag, stat_fingerprint
+from .directives import Directives, is_script, parse_directives
+
+MIN_SCHEDULE_INTERVAL = 1.0
+_HEADER_SIZE = 4096
+
+
+class ScheduleRule(NamedTuple):
+    """A ``glob:seconds`` rule scheduling the pages matching pattern."""
+
+    pattern: str
+    interval: float
+
+
+class Snapshot(NamedTuple):
+    """The latest output of a scheduled page and when it was rendered."""
+
+    content: bytes
+    etag: bytes
+    rendered_at: float
+
+
+def parse_schedule(spec: Optional[str]) -> List[ScheduleRule]:
+    """Parse ``glob:seconds`` rules separated by commas.
+
+    Invalid rules are logged and skipped.
+    """
+    rules: List[ScheduleRule] = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        pattern, _, seconds = item.rpartition(":")
+        try:
+            interval = float(seconds)
+        except ValueError:
+            interval = 0
+        if not pattern or interval <= 0:
+            RNS.log(f"Invalid schedule rule: {item}", RNS.LOG_WARNING)
+            continue
+        rules.append(ScheduleRule(pattern.strip(), interval))
+    return rules
+
+
+def schedule_interval(
+    directives: Directives,
+    relative_path: str,
+    rules: Optional[List[ScheduleRule]] = None,
+) -> float:
+    """Return the seconds between renders of a page, 0 if it is not scheduled.
+
+    A ``#!schedule every=N`` directive takes precedence over the rules;
+    ``#!schedule off`` disables scheduling for the page.
+    """
+    options = directives.get("schedule")
+    if options is not None:
+        if "off" in options:
+            return 0
+        try:
+            return max(float(options.get("every", "")), MIN_SCHEDULE_INTERVAL)
+        except ValueError:
+            return 0
+    name = relative_path.rsplit("/", 1)[-1]
+    for rule in rules or ():
+        if any(fnmatch.fnmatch(p, rule.pattern) for p in (relative_path, name)):
+            return max(rule.interval, MIN_SCHEDULE_INTERVAL)
+    return 0
+
+
+def has_request_variables(data: Any) -> bool:
+    """Return True if request data carries ``field_*`` or ``var_*`` entries."""
+    return isinstance(data, dict) and any(
+        isinstance(key, str) and key.startswith(("field_", "var_")) for key in data
+    )
+
+
+class _ScheduledPage:
+    """Schedule, latest snapshot and render history of one page."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.by_directive = False
+        self.fingerprint: Optional[Fingerprint] = None
+        self.next_run = 0.0
+        self.snapshot: Optional[Snapshot] = None
+        self.duration = 0.0
+        self.last_error: Optional[str] = None
+        self.renders = 0
+        self.failures = 0
+
+
+class PageScheduler:
+    """Render scheduled script pages in a background thread."""
+
+    def __init__(
+        self,
+        base: str,
+        render: Callable[[str], bytes],
+        rules: Optional[List[ScheduleRule]] = None,
+    ) -> None:
+        """Start the scheduler thread with no pages scheduled.
+
+        Args:
+            base: Pages directory, which rules match paths relative to
+            render: Runs the script at a resolved page path and returns its
+                output, raising on failure
+            rules: Schedule rules for pages without a ``#!schedule`` directive
+
+        """
+        self.base = os.path.realpath(base)
+        self.rules = rules or []
+        self._render = render
+        self._pages: Dict[str, _ScheduledPage] = {}
+        self._pending: Dict[str, None] = {}
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+        """Examine added or modified pages for a schedule and drop removed ones.
+
+        Added pages are examined in the scheduler thread; scheduled pages
+        among them are rendered again right away.
+        """
+        with self._condition:
+            for full_path in removed:
+                path = os.path.realpath(full_path)
+                self._pages.pop(path, None)
+                self._pending.pop(path, None)
+            for full_path in added:
+                self._pending[os.path.realpath(full_path)] = None
+            self._condition.notify()
+
+    def changed(self) -> List[str]:
+        """Return the scheduled pages whose script changed since examined."""
+        with self._condition:
+            pages = [(path, page.fingerprint) for path, page in self._pages.items()]
+        changed = []
+        for path, fingerprint in pages:
+            try:
+                current: Optional[Fingerprint] = stat_fingerprint(os.stat(path))
+            except OSError:
+                current = None
+            if current != fingerprint:
+                changed.append(path)
+        return changed
+
+    def snapshot(
+        self,
+        file_path: str,
+        directives: Optional[Directives] = None,
+        fingerprint: Optional[Fingerprint] = None,
+    ) -> Optional[Snapshot]:
+        """Return the latest snapshot of a resolved page path, if any.
+
+        Args:
+            file_path: Resolved page path
+            directives: Current directives of the page; a page scheduled by
+                a ``#!schedule`` directive that is gone or ``off`` is
+                dropped, and one with a directive that is not scheduled yet,
+                such as one edited between rescans, is examined
+            fingerprint: Current fingerprint of the page; a snapshot of a
+                script that changed since it was examined is not returned
+                and the page is examined again
+
+        """
+        options = (directives or {}).get("schedule")
+        with self._condition:
+            page = self._pages.get(file_path)
+            if page is not None:
+                if page.by_directive and (options is None or "off" in options):
+                    del self._pages[file_path]
+                    return None
+                if fingerprint is None or fingerprint == page.fingerprint:
+                    return page.snapshot
+            elif options is None or "off" in options:
+                return None
+            if file_path not in self._pending:
+                self._pending[file_path] = None
+                self._condition.notify()
+        return None
+
+    def _examine(self, path: str) -> Tuple[float, bool, Optional[Fingerprint]]:
+        """Return the schedule of the script page at path.
+
+        Returns:
+            Tuple of (interval, whether a ``#!schedule`` directive set it,
+            fingerprint of the script)
+
+        """
+        try:
+            with open(path, "rb") as handle:
+                header = handle.read(_HEADER_SIZE)
+                fingerprint = stat_fingerprint(os.fstat(handle.fileno()))
+        except OSError:
+            return 0, False, None
+        if not is_script(header) or not os.access(path, os.X_OK):
+            return 0, False, fingerprint
+        directives = parse_directives(header)
+        relative = os.path.relpath(path, self.base).replace(os.sep, "/")
+        interval = schedule_interval(directives, relative, self.rules)
+        return interval, "schedule" in directives, fingerprint
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped and not self._pending:
+                    runs = [page.next_run for page in self._pages.values()]
+                    wait = min(runs) - time.monotonic() if runs else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if self._stopped:
+                    return
+                pending = list(self._pending)
+                self._pending.clear()
+
+            for path in pending:
+                interval, by_directive, fingerprint = self._examine(path)
+                with self._condition:
+                    if interval <= 0:
+                        self._pages.pop(path, None)
+                        continue
+                    page = self._pages.setdefault(path, _ScheduledPage(interval))
+                    if page.fingerprint != fingerprint:
+                        # Output of the old script is not served again.
+                        page.snapshot = None
+                    page.interval = interval
+                    page.by_directive = by_directive
+                    page.fingerprint = fingerprint
+                    page.next_run = 0.0
+
+            now = time.monotonic()
+            with self._condition:
+                due = [p for p, page in self._pages.items() if page.next_run <= now]
+            for path in due:
+                if self._stopped:
+                    return
+                self._render_page(path)
+
+    def _render_page(self, path: str) -> None:
+        """Render a scheduled page and store its snapshot or error."""
+        with self._condition:
+            page = self._pages.get(path)
+            fingerprint = page.fingerprint if page is not None else None
+        started = time.monotonic()
+        error = None
+        try:
+            output = self._render(path)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            RNS.log(f"Scheduled render of {path} failed: {error}", RNS.LOG_ERROR)
+        finished = time.monotonic()
+        with self._condition:
+            page = self._pages.get(path)
+            if page is None or page.fingerprint != fingerprint:
+                return
+            page.duration = finished - started
+            page.next_run = finished + page.interval
+            page.renders += 1
+            page.last_error = error
+            if error is None:
+                page.snapshot = Snapshot(output, content_etag(output), time.time())
+            else:
+                page.failures += 1
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Return the schedule, last render and last error of every page.
+
+        Keys are page paths relative to the pages directory; ``rendered_at``
+        is a Unix timestamp, or None before the first successful render.
+        """
+        with self._condition:
+            return {
+                os.path.relpath(path, self.base): {
+                    "interval": page.interval,
+                    "rendered_at": page.snapshot.rendered_at if page.snapshot else None,
+                    "duration": round(page.duration, 3),
+                    "last_error": page.last_error,
+                    "renders": page.renders,
+                    "failures": page.failures,
+                }
+                for path, page in self._pages.items()
+            }
+
+    def shutdown(self) -> None:
+        """Stop the scheduler thread after the render in progress, if any."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
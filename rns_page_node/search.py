@@ -0,0 +1,370 @@
+"""Full-text search over the static pages.
+
+PageSearch keeps an inverted index from words to the pages containing
+them, built from the text of each page with Micron formatting stripped.
+Pages are indexed in a background thread when they are scanned and only
+indexed again when their (mtime, size, inode) fingerprint changes; script
+pages are skipped, since their output is only known when they run.
+Results are ranked with BM25.
+
+The index can be persisted to a file, msgpack encoded, so that a restart
+only reads pages that changed while the node was down. The built-in search
+page is served at ``/page/.search.mu`` and reads the query from the ``q``
+field or link variable.
+"""
+
+import math
+import os
+import queue
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import RNS
+from RNS.vendor import umsgpack
+
+from .cache import Fingerprint, stat_fingerprint
+from .directives import is_script
+from .listings import escape_micron, field_default, link_label
+
+SEARCH_PATH = "/page/.search.mu"
+SEARCH_INDEX_VERSION = 2
+DEFAULT_SEARCH_RESULTS = 20
+SUMMARY_LENGTH = 160
+_K1 = 1.2
+_B = 0.75
+_STOP = object()
+
+_WORD = re.compile(r"\w{2,}")
+_LINK = re.compile(r"`\[([^`\]]*)`[^\]]*\]")
+_FIELD = re.compile(r"`<[^`>]*`([^>]*)>")
+_COLOR = re.compile(r"`[FB](?:[0-9A-Fa-f]{3}|T[0-9A-Fa-f]{6}|g\d{2})")
+_TAG = re.compile(r"`[!*_=fbcalr`]?")
+
+
+def strip_micron(text: str) -> str:
+    """Return the readable text of a Micron page.
+
+    Comments, divider lines, heading markers, links (kept as their label),
+    input fields (kept as their default value) and formatting tags are
+    removed.
+    """
+    lines = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        stripped = line.lstrip(">")
+        if stripped.startswith("-") and len(stripped.strip()) <= 2:
+            continue
+        stripped = stripped.replace("\\`", "\x00")
+        stripped = _LINK.sub(r"\1", stripped)
+        stripped = _FIELD.sub(r"\1", stripped)
+        stripped = _COLOR.sub("", stripped)
+        stripped = _TAG.sub("", stripped)
+        lines.append(stripped.replace("\x00", "`").strip())
+    return "\n".join(line for line in lines if line)
+
+
+def tokenize(text: str) -> List[str]:
+    """Return the lowercased words of text, ignoring single characters."""
+    return _WORD.findall(text.lower())
+
+
+class IndexedPage(NamedTuple):
+    """What the index keeps about one page."""
+
+    full_path: str
+    fingerprint: Fingerprint
+    title: str
+    summary: str
+    length: int
+    terms: Dict[str, int]
+
+
+class SearchResult(NamedTuple):
+    """A ranked search hit."""
+
+    request_path: str
+    title: str
+    summary: str
+    score: float
+
+
+def _describe(request_path: str, text: str) -> Tuple[str, str]:
+    """Return (title, summary): the first heading or the file name, and text."""
+    title = ""
+    for line in text.splitlines():
+        if line.startswith(">"):
+            title = strip_micron(line)
+            if title:
+                break
+    if not title:
+        title = request_path.rsplit("/", 1)[-1]
+    summary = " ".join(strip_micron(text).split())
+    if len(summary) > SUMMARY_LENGTH:
+        summary = summary[:SUMMARY_LENGTH].rsplit(" ", 1)[0] + " ..."
+    return title, summary
+
+
+def render_results(query: str, results: List[SearchResult]) -> bytes:
+    """Return the Micron search page for query, listing results."""
+    lines = [
+        ">Search",
+        "",
+        f"`B444`<24|q`{field_default(query)}>`b  `[Search`:{SEARCH_PATH}`q]",
+        "",
+    ]
+    if query and not results:
+        lines.append(f"No pages match {escape_micron(query)}.")
+    elif results:
+        lines += [f"{len(results)} matching pages:", ""]
+    for result in results:
+        lines.append(f"`[{link_label(result.title)}`:{result.request_path}]")
+        if result.summary:
+            lines.append(escape_micron(result.summary, line_start=True))
+        lines.append("")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class PageSearch:
+    """Incrementally maintained inverted index over page text."""
+
+    def __init__(self, persist_path: Optional[str] = None) -> None:
+        """Load the persisted index, if any, and start the indexing thread.
+
+        Args:
+            persist_path: File the index is saved to and loaded from
+                (None = kept in memory only)
+
+        """
+        self.persist_path = persist_path
+        self.indexed = 0
+        self.loaded = 0
+        self.searches = 0
+        self._pages: Dict[str, IndexedPage] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._load()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as handle:
+                stored = umsgpack.unpackb(handle.read())
+            if stored.get("version") != SEARCH_INDEX_VERSION:
+                return
+            for request_path, full_path, fingerprint, title, summary, terms in stored[
+                "pages"
+            ]:
+                self._set(
+                    request_path,
+                    IndexedPage(
+                        full_path,
+                        tuple(fingerprint),
+                        title,
+                        summary,
+                        sum(terms.values()),
+                        terms,
+                    ),
+                )
+        except Exception as e:
+            RNS.log(
+                f"Ignoring unreadable search index {self.persist_path}: {e}",
+                RNS.LOG_WARNING,
+            )
+            self._pages.clear()
+            self._postings.clear()
+            self._total_length = 0
+            return
+        self.loaded = len(self._pages)
+        self._dirty = False
+
+    def save(self) -> None:
+        """Write the index to persist_path if it changed since the last save."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            pages = [
+                [
+                    request_path,
+                    page.full_path,
+                    list(page.fingerprint),
+                    page.title,
+                    page.summary,
+                    page.terms,
+                ]
+                for request_path, page in self._pages.items()
+            ]
+            self._dirty = False
+        temp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(temp_path, "wb") as handle:
+                handle.write(
+                    umsgpack.packb({"version": SEARCH_INDEX_VERSION, "pages": pages}),
+                )
+            os.replace(temp_path, self.persist_path)
+        except OSError as e:
+            RNS.log(f"Could not save search index: {e}", RNS.LOG_ERROR)
+
+    def sync(self, pages: Iterable[Tuple[str, str]]) -> None:
+        """Queue a full scan of (full path, request path) pairs.
+
+        Only served pages should be passed, with the path they are served
+        from; pages not in it are dropped from the index.
+        """
+        self._queue.put(("sync", list(pages)))
+
+    def refresh(self, pages: Iterable[Tuple[str, str]]) -> None:
+        """Queue added or modified (full path, request path) pairs."""
+        self._queue.put(("refresh", list(pages)))
+
+    def remove(self, request_paths: Iterable[str]) -> None:
+        """Drop pages that are no longer served, by request path."""
+        with self._lock:
+            for request_path in request_paths:
+                self._set(request_path, None)
+
+    def _set(self, request_path: str, page: Optional[IndexedPage]) -> None:
+        """Replace the entry for request_path, keeping the postings in step."""
+        old = self._pages.pop(request_path, None)
+        if old is not None:
+            self._total_length -= old.length
+            for term in old.terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(request_path, None)
+                    if not postings:
+                        del self._postings[term]
+        if page is not None:
+            self._pages[request_path] = page
+            self._total_length += page.length
+            for term, count in page.terms.items():
+                self._postings.setdefault(term, {})[request_path] = count
+        if old is not None or page is not None:
+            self._dirty = True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            action, pages = item  # type: ignore[misc]
+            if action == "sync":
+                current = {request_path for _, request_path in pages}
+                with self._lock:
+                    for request_path in [p for p in self._pages if p not in current]:
+                        self._set(request_path, None)
+            for full_path, request_path in pages:
+                self._index(full_path, request_path)
+            if self._queue.empty():
+                self.save()
+
+    def _index(self, full_path: str, request_path: str) -> None:
+        """Index a page again if it changed since it was last indexed."""
+        try:
+            with open(full_path, "rb") as handle:
+                fingerprint = stat_fingerprint(os.fstat(handle.fileno()))
+                with self._lock:
+                    current = self._pages.get(request_path)
+                if (
+                    current is not None
+                    and current.fingerprint == fingerprint
+                    and current.full_path == full_path
+                ):
+                    return
+                content = handle.read()
+        except OSError:
+            with self._lock:
+                self._set(request_path, None)
+            return
+        if is_script(content):
+            with self._lock:
+                self._set(request_path, None)
+            return
+        text = content.decode("utf-8", "replace")
+        terms: Dict[str, int] = {}
+        for term in tokenize(strip_micron(text)):
+            terms[term] = terms.get(term, 0) + 1
+        title, summary = _describe(request_path, text)
+        page = IndexedPage(
+            full_path,
+            fingerprint,
+            title,
+            summary,
+            sum(terms.values()),
+            terms,
+        )
+        with self._lock:
+            self._set(request_path, page)
+            self.indexed += 1
+
+    def search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_RESULTS,
+    ) -> List[SearchResult]:
+        """Return up to limit pages matching words of query, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            self.searches += 1
+            count = len(self._pages)
+            if not terms or not count:
+                return []
+            average = self._total_length / count or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                matches = len(postings)
+                idf = math.log(1 + (count - matches + 0.5) / (matches + 0.5))
+                for request_path, frequency in postings.items():
+                    length = self._pages[request_path].length
+                    norm = frequency + _K1 * (1 - _B + _B * length / average)
+                    scores[request_path] = scores.get(request_path, 0.0) + (
+                        idf * frequency * (_K1 + 1) / norm
+                    )
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            return [
+                SearchResult(
+                    request_path,
+                    self._pages[request_path].title,
+                    self._pages[request_path].summary,
+                    score,
+                )
+                for request_path, score in ranked[:limit]
+            ]
+
+    def join(self) -> None:
+        """Wait until all queued updates have been applied."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def stats(self) -> Dict[str, int]:
+        """Return page, term and indexing counters."""
+        with self._lock:
+            return {
+                "pages": len(self._pages),
+                "terms": len(self._postings),
+                "indexed": self.indexed,
+                "loaded": self.loaded,
+                "searches": self.searches,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the indexing thread and save the index."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+        self.save()
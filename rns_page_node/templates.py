@@ -0,0 +1,229 @@
+"""Includes and templates for static pages.
+
+A static page can pull in shared fragments, such as a header, footer or
+menu, with lines of the form::
+
+    #!include header.mu
+
+which are replaced by the content of the named file, and can wrap itself
+in a layout by declaring in its header::
+
+    #!template layout.mu
+
+in which case the page takes the place of the ``#!content`` line of the
+layout. Paths are relative to the including file, or to the pages
+directory if they start with "/", and must stay inside the pages
+directory. Fragments may include further fragments, up to
+MAX_INCLUDE_DEPTH levels deep; include cycles and missing fragments are
+logged and the directive line is left in place (Micron shows it as a
+comment).
+
+Rendered pages are cached along with the stat fingerprint of every file
+they were built from, and re-rendered when any of them changes. The
+reverse edges of that dependency graph let watcher events drop every
+page built from a changed fragment at once.
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Set, Tuple, Union
+
+import RNS
+
+from .cache import Fingerprint, content_etag, stat_fingerprint
+
+MAX_INCLUDE_DEPTH = 8
+
+_INCLUDE = re.compile(rb"^#!include[ \t]+(\S+)[ \t]*\r?$")
+_TEMPLATE = re.compile(rb"^#!template[ \t]+(\S+)[ \t]*\r?$")
+_CONTENT = re.compile(rb"^#!content[ \t]*\r?$", re.MULTILINE)
+
+
+def uses_templates(content: bytes) -> bool:
+    """Return True if content may contain include or template directives."""
+    return b"#!include" in content or b"#!template" in content
+
+
+class RenderedPage(NamedTuple):
+    """A page with its includes expanded and the files it was built from."""
+
+    content: bytes
+    etag: bytes
+    fingerprint: Fingerprint
+    dependencies: Dict[str, Optional[Fingerprint]]
+
+
+class TemplateCache:
+    """Render and cache static pages that use includes or templates."""
+
+    def __init__(self, base: Union[Path, str]) -> None:
+        """Initialize an empty cache for pages under base."""
+        self.base = os.path.realpath(base)
+        self._prefix = os.path.join(self.base, "")
+        self.hits = 0
+        self.renders = 0
+        self._rendered: Dict[str, RenderedPage] = {}
+        self._dependents: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def render(
+        self,
+        file_path: Union[Path, str],
+        content: bytes,
+        fingerprint: Fingerprint,
+    ) -> Optional[RenderedPage]:
+        """Return the rendered page, or None if content uses no directives.
+
+        Args:
+            file_path: Resolved path of the page
+            content: Raw page content
+            fingerprint: Stat fingerprint content was read with
+
+        """
+        if not uses_templates(content):
+            return None
+        key = str(file_path)
+        with self._lock:
+            entry = self._rendered.get(key)
+        if (
+            entry is not None
+            and entry.fingerprint == fingerprint
+            and self._current(entry)
+        ):
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        dependencies: Dict[str, Optional[Fingerprint]] = {}
+        rendered = self._expand(key, content, (key,), dependencies)
+        entry = RenderedPage(
+            rendered,
+            content_etag(rendered),
+            fingerprint,
+            dependencies,
+        )
+        with self._lock:
+            self._forget(key)
+            self._rendered[key] = entry
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(key)
+            self.renders += 1
+        return entry
+
+    @staticmethod
+    def _current(entry: RenderedPage) -> bool:
+        """Return True if none of the files entry was built from has changed."""
+        for path, fingerprint in entry.dependencies.items():
+            try:
+                current: Optional[Fingerprint] = stat_fingerprint(os.stat(path))
+            except OSError:
+                current = None
+            if current != fingerprint:
+                return False
+        return True
+
+    def _expand(
+        self,
+        file_path: str,
+        content: bytes,
+        stack: Tuple[str, ...],
+        dependencies: Dict[str, Optional[Fingerprint]],
+    ) -> bytes:
+        """Return content with its includes and template applied."""
+        template = None
+        lines = []
+        in_header = True
+        for line in content.split(b"\n"):
+            in_header = in_header and line.startswith(b"#!")
+            if in_header and template is None:
+                match = _TEMPLATE.match(line)
+                if match is not None:
+                    template = match.group(1)
+                    continue
+            match = _INCLUDE.match(line)
+            if match is not None:
+                fragment = self._fragment(
+                    file_path,
+                    match.group(1),
+                    stack,
+                    dependencies,
+                )
+                if fragment is not None:
+                    lines.append(fragment.removesuffix(b"\n"))
+                    continue
+            lines.append(line)
+        body = b"\n".join(lines)
+        if template is None:
+            return body
+        layout = self._fragment(file_path, template, stack, dependencies)
+        if layout is None:
+            return body
+        body = body.removesuffix(b"\n")
+        return _CONTENT.sub(lambda _: body, layout, count=1)
+
+    def _fragment(
+        self,
+        file_path: str,
+        target: bytes,
+        stack: Tuple[str, ...],
+        dependencies: Dict[str, Optional[Fingerprint]],
+    ) -> Optional[bytes]:
+        """Return the expanded content of a fragment named in file_path."""
+        name = target.decode("utf-8", "replace")
+        if name.startswith("/"):
+            candidate = os.path.join(self.base, name.lstrip("/"))
+        else:
+            candidate = os.path.join(os.path.dirname(file_path), name)
+        path = os.path.realpath(candidate)
+        if not path.startswith(self._prefix):
+            RNS.log(
+                f"Not including {name} in {file_path}: outside the pages directory",
+                RNS.LOG_WARNING,
+            )
+            return None
+        if path in stack or len(stack) > MAX_INCLUDE_DEPTH:
+            RNS.log(
+                f"Not including {name} in {file_path}: include cycle or too deep",
+                RNS.LOG_WARNING,
+            )
+            return None
+        try:
+            with open(path, "rb") as handle:
+                dependencies[path] = stat_fingerprint(os.fstat(handle.fileno()))
+                fragment = handle.read()
+        except OSError as e:
+            dependencies[path] = None
+            RNS.log(f"Could not include {name} in {file_path}: {e}", RNS.LOG_WARNING)
+            return None
+        return self._expand(path, fragment, stack + (path,), dependencies)
+
+    def _forget(self, key: str) -> None:
+        """Drop the rendered page at key and its dependency edges."""
+        entry = self._rendered.pop(key, None)
+        if entry is None:
+            return
+        for dependency in entry.dependencies:
+            dependents = self._dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[dependency]
+
+    def invalidate(self, file_path: Union[Path, str]) -> None:
+        """Drop the rendered pages of file_path and of pages built from it."""
+        path = os.path.realpath(file_path)
+        with self._lock:
+            for key in {path, *self._dependents.get(path, ())}:
+                self._forget(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of rendered pages, fragments, hits and renders."""
+        with self._lock:
+            return {
+                "pages": len(self._rendered),
+                "fragments": len(self._dependents),
+                "hits": self.hits,
+                "renders": self.renders,
+            }
@@ -0,0 +1,111 @@
+"""Tracking of file handles held by in-progress transfers.
+
+Handles returned to RNS as file responses are closed by the Resource once
+the transfer concludes, but a transfer abandoned on a dropped link can keep
+its descriptor open until garbage collection. TransferTracker records every
+handed-out handle under the link that requested it, closes the remaining
+handles when that link closes, and caps the number of open transfers so the
+node answers "busy" instead of running into the descriptor limit.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+DEFAULT_MAX_TRANSFERS = 256
+
+
+class TransfersBusy(Exception):
+    """Raised when the maximum number of open transfers is reached."""
+
+
+class TransferTracker:
+    """Count, cap and clean up file handles of transfers per link."""
+
+    def __init__(self, max_open: int = DEFAULT_MAX_TRANSFERS) -> None:
+        """Initialize the tracker.
+
+        Args:
+            max_open: Maximum number of open transfer handles (0 = unlimited)
+
+        """
+        self.max_open = max_open
+        self.started = 0
+        self.rejected = 0
+        self.closed_by_link = 0
+        self._handles: Dict[Optional[bytes], List[BinaryIO]] = {}
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def _sweep(self) -> int:
+        """Forget handles RNS already closed and return how many are open."""
+        open_count = 0
+        for link_id in list(self._handles):
+            handles = [h for h in self._handles[link_id] if not h.closed]
+            if handles:
+                self._handles[link_id] = handles
+                open_count += len(handles)
+            else:
+                del self._handles[link_id]
+        return open_count
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """Reserve room for one transfer while its response is prepared.
+
+        Raises:
+            TransfersBusy: If max_open transfers are already open
+
+        """
+        with self._lock:
+            if self.max_open and self._sweep() + self._reserved >= self.max_open:
+                self.rejected += 1
+                raise TransfersBusy(f"{self.max_open} transfers are open")
+            self._reserved += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved -= 1
+
+    def track(self, link_id: Optional[bytes], handle: BinaryIO) -> None:
+        """Record handle as belonging to a transfer on link_id."""
+        with self._lock:
+            self._handles.setdefault(link_id, []).append(handle)
+            self.started += 1
+
+    def close_link(self, link_id: Optional[bytes]) -> int:
+        """Close every handle still open for link_id and return the count."""
+        with self._lock:
+            handles = self._handles.pop(link_id, [])
+        closed = 0
+        for handle in handles:
+            if not handle.closed:
+                try:
+                    handle.close()
+                except (OSError, ValueError):
+                    pass
+                closed += 1
+        with self._lock:
+            self.closed_by_link += closed
+        return closed
+
+    def close_all(self) -> None:
+        """Close every tracked handle."""
+        with self._lock:
+            link_ids = list(self._handles)
+        for link_id in link_ids:
+            self.close_link(link_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return open-handle counts, in total and per link."""
+        with self._lock:
+            open_count = self._sweep()
+            return {
+                "open": open_count,
+                "max_open": self.max_open,
+                "links": len(self._handles),
+                "started": self.started,
+                "rejected": self.rejected,
+                "closed_by_link": self.closed_by_link,
+            }
@@ -0,0 +1,252 @@
+"""Linux inotify watcher used to apply incremental page and file changes."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple, Union
+
+import RNS
+
+from .scanner import first_visit
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+EventCallback = Callable[[str, str, bool], None]
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is not None:
+        return _libc
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    _libc = libc
+    return _libc
+
+
+def inotify_available() -> bool:
+    """Return True if inotify can be used on this platform."""
+    return _load_libc() is not None
+
+
+class InotifyWatcher:
+    """Watch a directory tree and report added and removed paths.
+
+    The callback is called as ``on_event(action, path, is_dir)`` where
+    action is ``"added"`` or ``"removed"``. Files inside newly created or
+    moved-in directories are reported individually as added. A removed
+    directory is reported once with ``is_dir=True``; consumers should drop
+    everything below it. Hidden entries (names starting with ".") are
+    ignored, and symlinked directories are only followed the first time
+    they are reached, matching the directory scanners. If the kernel event
+    queue overflows, on_overflow is called so the consumer can do a full
+    rescan.
+    """
+
+    def __init__(
+        self,
+        base: Union[Path, str],
+        on_event: EventCallback,
+        on_overflow: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Initialize the watcher and add watches for the whole tree.
+
+        Raises:
+            OSError: If inotify is unavailable or a watch cannot be added
+
+        """
+        libc = _load_libc()
+        if libc is None:
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self.base = Path(base)
+        self.on_event = on_event
+        self.on_overflow = on_overflow
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._watches: Dict[int, Path] = {}
+        self._visited: Set[Tuple[int, int]] = set()
+        self._linked: Dict[Path, Tuple[int, int]] = {}
+        first_visit(str(self.base), self._visited)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        try:
+            self._add_tree(self.base, report=False)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def start(self) -> None:
+        """Start delivering events from a background thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the watcher thread and release the inotify descriptor."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd,
+            os.fsencode(str(directory)),
+            WATCH_MASK | IN_ONLYDIR,
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(directory))
+        self._watches[wd] = directory
+
+    def _add_tree(self, directory: Path, report: bool) -> None:
+        """Watch directory and its subdirectories, optionally reporting files."""
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            self._add_watch(current)
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    path = Path(entry.path)
+                    if entry.is_symlink():
+                        key = first_visit(entry.path, self._visited)
+                        if key is None:
+                            continue
+                        self._linked[path] = key
+                    pending.append(path)
+                elif report and entry.is_file():
+                    self.on_event("added", entry.path, False)
+
+    def _remove_tree(self, directory: Path) -> None:
+        """Drop watches for directory and everything below it."""
+        for wd, path in list(self._watches.items()):
+            if path == directory or directory in path.parents:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._watches.pop(wd, None)
+        for path in list(self._linked):
+            if path == directory or directory in path.parents:
+                self._visited.discard(self._linked.pop(path))
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 1.0)
+                if not readable:
+                    continue
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                if not self._stop_event.is_set():
+                    RNS.log(f"Error reading inotify events: {e}", RNS.LOG_ERROR)
+                return
+            try:
+                self._dispatch(buffer)
+            except Exception as e:
+                RNS.log(f"Error handling inotify events: {e}", RNS.LOG_ERROR)
+
+    def _dispatch(self, buffer: bytes) -> None:
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buffer):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                RNS.log(
+                    f"inotify queue overflow for {self.base}, rescanning",
+                    RNS.LOG_WARNING,
+                )
+                if self.on_overflow is not None:
+                    self.on_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None or not raw_name:
+                continue
+            name = os.fsdecode(raw_name)
+            if name.startswith("."):
+                continue
+            path = directory / name
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not is_dir and os.path.isdir(path):
+                    # A symlink to a directory is followed like the scanner
+                    # does, once per directory.
+                    key = first_visit(str(path), self._visited)
+                    if key is None:
+                        continue
+                    self._linked[path] = key
+                    is_dir = True
+                if is_dir:
+                    try:
+                        self._add_tree(path, report=True)
+                    except OSError as e:
+                        RNS.log(f"Could not watch {path}: {e}", RNS.LOG_WARNING)
+                else:
+                    self.on_event("added", str(path), False)
+            elif mask & IN_CLOSE_WRITE:
+                self.on_event("added", str(path), False)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                is_dir = is_dir or path in self._linked
+                if is_dir:
+                    self._remove_tree(path)
+                self.on_event("removed", str(path), is_dir)
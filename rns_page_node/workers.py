@@ -0,0 +1,333 @@
+"""Pool of persistent Python processes for running script pages.
+
+Python script pages normally pay for a fork/exec and interpreter start on
+every request. Workers started by ScriptWorkerPool run those scripts with
+runpy inside a long-lived interpreter instead, so modules imported by one
+request stay warm for the next. Request variables are passed per request
+and the script's standard output is captured as the page content, or
+written straight to a file named by the caller when the page is streamed.
+
+worker_main() runs a single worker that talks the frame protocol over its
+stdin/stdout.
+"""
+
+import os
+import queue
+import re
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from .executor import ScriptTimeout, kill_process_group
+from .protocol import read_frame, write_frame
+
+DEFAULT_MAX_REQUESTS = 1000
+
+_WORKER_COMMAND = "from rns_page_node.workers import worker_main; worker_main()"
+
+_SHEBANG = re.compile(rb"^#!\s*(\S+)\s*(.*?)\s*$")
+_interpreters: Dict[bytes, bool] = {}
+
+
+def _is_own_interpreter(interpreter: bytes) -> bool:
+    """Return True if the interpreter resolves to sys.executable.
+
+    A bare name is looked up on PATH, as env or the kernel would.
+    """
+    own = _interpreters.get(interpreter)
+    if own is None:
+        path: Optional[str] = os.fsdecode(interpreter)
+        if os.sep not in path:
+            path = shutil.which(path)
+        own = path is not None and os.path.realpath(path) == os.path.realpath(
+            sys.executable,
+        )
+        _interpreters[interpreter] = own
+    return own
+
+
+def is_python_script(content: bytes) -> bool:
+    """Return True if content is a script the workers' interpreter should run.
+
+    That is a shebang naming the interpreter the node runs under, either
+    by path or as ``python3`` (bare or through ``env``) resolving to it on
+    PATH. Scripts for another Python, such as python2, a virtualenv or a
+    python3 on PATH other than the node's, and shebangs with options
+    still run as subprocesses.
+    """
+    match = _SHEBANG.match(content.split(b"\n", 1)[0])
+    if match is None:
+        return False
+    interpreter, argument = match.groups()
+    if os.path.basename(interpreter) == b"env" and argument == b"python3":
+        return _is_own_interpreter(argument)
+    return not argument and _is_own_interpreter(interpreter)
+
+
+class ScriptWorkerError(RuntimeError):
+    """Raised when a worker fails to produce output for a script."""
+
+
+class _Worker:
+    """A single worker process and its protocol pipes."""
+
+    def __init__(self) -> None:
+        package_root = str(Path(__file__).resolve().parent.parent)
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(
+            p for p in (package_root, env.get("PYTHONPATH")) if p
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", _WORKER_COMMAND],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+        self.requests = 0
+
+    def run(
+        self,
+        script_path: str,
+        env: Dict[str, str],
+        output_path: Optional[str] = None,
+    ) -> bytes:
+        request = {"script": script_path, "env": env}
+        if output_path is not None:
+            request["output"] = output_path
+        write_frame(self.process.stdin, request)
+        header, body = read_frame(self.process.stdout)
+        self.requests += 1
+        if not header.get("ok"):
+            raise ScriptWorkerError(header.get("error") or "script failed")
+        return body
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        kill_process_group(self.process)
+
+    def stop(self) -> None:
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class ScriptWorkerPool:
+    """A fixed-size pool of pre-started Python worker processes."""
+
+    def __init__(self, size: int, max_requests: int = DEFAULT_MAX_REQUESTS) -> None:
+        """Start size worker processes.
+
+        Args:
+            size: Number of worker processes
+            max_requests: Requests served before a worker is replaced,
+                limiting the effect of state leaking between scripts
+
+        """
+        self.size = size
+        self.max_requests = max_requests
+        self.requests = 0
+        self.failures = 0
+        self.restarts = 0
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._add_worker()
+
+    def _add_worker(self) -> None:
+        worker = _Worker()
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace_worker(self, worker: _Worker) -> None:
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self.restarts += 1
+        worker.stop()
+        if not self._closed:
+            self._add_worker()
+
+    def run(
+        self,
+        script_path: str,
+        env: Dict[str, str],
+        timeout: float = 0,
+        output_path: Optional[str] = None,
+    ) -> bytes:
+        """Run a Python script page in a worker and return its output.
+
+        Args:
+            script_path: Absolute path of the script
+            env: Request variables to set on top of the worker environment
+            timeout: Wall-clock seconds before the worker is killed (0 = unlimited)
+            output_path: File the worker writes the output to directly, in
+                which case an empty bytes object is returned
+
+        Raises:
+            ScriptWorkerError: If the script fails or the worker dies
+            ScriptTimeout: If the script exceeded the timeout
+
+        """
+        worker = self._idle.get()
+        with self._lock:
+            self.requests += 1
+        timer = None
+        timed_out = threading.Event()
+        if timeout > 0:
+
+            def expire() -> None:
+                timed_out.set()
+                worker.kill()
+
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            output = worker.run(script_path, env, output_path)
+        except ScriptWorkerError:
+            with self._lock:
+                self.failures += 1
+            self._release(worker)
+            raise
+        except (OSError, EOFError, TypeError, ValueError) as e:
+            with self._lock:
+                self.failures += 1
+            self._replace_worker(worker)
+            if timed_out.is_set():
+                raise ScriptTimeout(
+                    f"{script_path} exceeded the {timeout}s timeout",
+                ) from e
+            raise ScriptWorkerError(f"worker failed: {e}") from e
+        finally:
+            if timer is not None:
+                timer.cancel()
+        self._release(worker)
+        return output
+
+    def _release(self, worker: _Worker) -> None:
+        if self._closed:
+            worker.stop()
+        elif not worker.alive() or worker.requests >= self.max_requests:
+            self._replace_worker(worker)
+        else:
+            self._idle.put(worker)
+
+    def stats(self) -> Dict[str, int]:
+        """Return pool counters."""
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "idle": self._idle.qsize(),
+                "requests": self.requests,
+                "failures": self.failures,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self) -> None:
+        """Stop all idle workers; busy workers stop when they are released."""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+
+def _open_spool(output_path: object) -> BinaryIO:
+    """Return the file a script's output is redirected into."""
+    if output_path:
+        return open(str(output_path), "r+b")
+    return tempfile.TemporaryFile()
+
+
+def _run_request(
+    header: Dict[str, object],
+    base_env: Dict[str, str],
+    base_cwd: str,
+    devnull: int,
+) -> Tuple[bytes, Optional[str]]:
+    """Run one script with stdout redirected into a spool file.
+
+    The spool is the file named by the request's "output" key if present,
+    in which case the output stays there and an empty body is returned.
+    """
+    script = str(header["script"])
+    request_env = header.get("env") or {}
+    output_path = header.get("output")
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    error: Optional[str] = None
+
+    with _open_spool(output_path) as spool:
+        sys.stdout.flush()
+        os.dup2(spool.fileno(), 1)
+        os.environ.clear()
+        os.environ.update(base_env)
+        os.environ.update({str(k): str(v) for k, v in dict(request_env).items()})
+        sys.argv = [script]
+        sys.path.insert(0, os.path.dirname(script))
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f"script exited with status {e.code}"
+        except BaseException:
+            error = traceback.format_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+            except Exception as e:
+                sys.stderr.write(f"Could not flush output of {script}: {e}\n")
+            sys.stdout = sys.__stdout__
+            os.dup2(devnull, 1)
+            sys.argv = saved_argv
+            sys.path[:] = saved_path
+            os.chdir(base_cwd)
+            os.environ.clear()
+            os.environ.update(base_env)
+        spool.seek(0)
+        output = b"" if output_path else spool.read()
+
+    if error is not None:
+        sys.stderr.write(f"Error running script page {script}: {error}\n")
+        sys.stderr.flush()
+    return output, error
+
+
+def worker_main() -> None:
+    """Serve script requests over stdin/stdout until stdin is closed."""
+    proto_in = os.fdopen(os.dup(0), "rb")
+    proto_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    base_env = dict(os.environ)
+    base_cwd = os.getcwd()
+
+    while True:
+        try:
+            header, _ = read_frame(proto_in)
+        except (EOFError, TypeError, ValueError):
+            return
+        output, error = _run_request(header, base_env, base_cwd, devnull)
+        write_frame(proto_out, {"ok": error is None, "error": error}, output)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark the scandir tree scanner against the previous iterdir scanner."""
+
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Union
+
+from rns_page_node.scanner import scan_tree
+
+
+def legacy_scan_files(base: Union[Path, str]) -> List[str]:
+    """Previous recursive Path.iterdir() implementation of PageNode._scan_files."""
+    if isinstance(base, str):
+        base = Path(base)
+    if not base.exists():
+        return []
+    served: List[str] = []
+    for entry in base.iterdir():
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            served.extend(legacy_scan_files(entry))
+        elif entry.is_file():
+            served.append(str(entry))
+    return served
+
+
+def build_tree(root: Path, dirs: int, files_per_dir: int, depth: int) -> int:
+    """Create a synthetic tree and return the number of files created."""
+    created = 0
+    for d in range(dirs):
+        directory = root.joinpath(*[f"level{level}" for level in range(d % depth)])
+        directory = directory / f"dir{d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        for f in range(files_per_dir):
+            (directory / f"file{f}.mu").touch()
+            created += 1
+        (directory / ".hidden").touch()
+    return created
+
+
+def best_of(runs: int, func, *args, **kwargs) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", help="Scan an existing tree instead of a synthetic one")
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.path:
+        root = Path(args.path)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="rns-page-node-bench-")
+        root = Path(tmp_dir)
+        build_tree(root, args.dirs, args.files_per_dir, args.depth)
+
+    try:
+        expected = sorted(legacy_scan_files(root))
+        assert sorted(scan_tree(root)) == expected
+        assert sorted(scan_tree(root, workers=args.workers)) == expected
+        print(f"Scanning {len(expected)} files under {root}")
+
+        results = {
+            "legacy iterdir": best_of(args.runs, legacy_scan_files, root),
+            "scandir": best_of(args.runs, scan_tree, root),
+            f"scandir, {args.workers} workers": best_of(
+                args.runs,
+                scan_tree,
+                root,
+                workers=args.workers,
+            ),
+        }
+        baseline = results["legacy iterdir"]
+        for name, seconds in results.items():
+            print(f"  {name:<24} {seconds * 1000:9.1f} ms  {baseline / seconds:5.2f}x")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,46 @@
 #!/usr/bin/env python3
+import bz2
+import hashlib
+import io
+import os
 import random
 import shutil
 import string
+import sys
 import threading
 import time
 import tracemalloc
+import types
 import unittest
 from pathlib import Path
+from unittest import mock
 
 import RNS
+from RNS.vendor import umsgpack
 
 from rns_page_node import PageNode
+from rns_page_node import content_index as content_index_module
+from rns_page_node import workers as workers_module
+from rns_page_node.backends import BackendError
+from rns_page_node.compression import (
+    ALWAYS_COMPRESS_LIMIT,
+    CompressionPolicy,
+    parse_rules,
+)
+from rns_page_node.content_index import ContentIndex
+from rns_page_node.handlers import DEFAULT_BUSY, DEFAULT_NOTALLOWED, NOT_MODIFIED
+from rns_page_node.listings import escape_micron, link_label
+from rns_page_node.mapped import MappedFiles
+from rns_page_node.pathindex import PathIndex
+from rns_page_node.ranges import MANIFEST_CHUNK_SIZE
+from rns_page_node.routes import RouteTable
+from rns_page_node.scan_manifest import (
+    ScannedFile,
+    load_scan_manifest,
+    save_scan_manifest,
+)
+from rns_page_node.transfers import TransferTracker
+from rns_page_node.workers import is_python_script
 
 
 class AdvancedTests(unittest.TestCase):
@@ -239,6 +269,33 @@ class AdvancedTests(unittest.TestCase):
         ]
         self.assertCountEqual(found_files, actual_expected_files)
 
+    def test_parallel_scanning(self):
+        """Sequential and threaded scans find the same nested, non-hidden entries."""
+        from rns_page_node.scanner import scan_tree
+
+        scan_test_dir = self.test_dir / "nested_scan"
+        if scan_test_dir.exists():
+            shutil.rmtree(scan_test_dir)
+        expected = []
+        for i in range(10):
+            directory = scan_test_dir.joinpath(*[f"d{j}" for j in range(i % 4)])
+            directory = directory / f"sub{i}"
+            directory.mkdir(parents=True)
+            (directory / f"page{i}.mu").touch()
+            (directory / f"file{i}.txt").touch()
+            (directory / ".hidden.mu").touch()
+            expected.append(str(directory / f"page{i}.mu"))
+        (scan_test_dir / ".hidden_dir").mkdir()
+        (scan_test_dir / ".hidden_dir" / "secret.mu").touch()
+        (scan_test_dir / "d0" / "loop").symlink_to(scan_test_dir.resolve())
+
+        self.assertCountEqual(scan_tree(scan_test_dir, suffix=".mu"), expected)
+        self.assertCountEqual(
+            scan_tree(scan_test_dir, suffix=".mu", workers=4),
+            expected,
+        )
+        self.assertEqual(len(scan_tree(scan_test_dir, workers=4)), 20)
+
     def test_property_script_execution(self):
         """Property-based testing for script execution vs reading."""
         script_path = self.pages_dir / "prop_script.mu"
@@ -281,6 +338,1326 @@ class AdvancedTests(unittest.TestCase):
         )
         self.assertEqual(response, b"plain text content")
 
+    def test_page_cache(self):
+        """Page cache serves hits and picks up edits through stat validation."""
+        page_path = self.pages_dir / "cached.mu"
+        page_path.write_text("first version")
+        self.node.page_cache.clear()
+        hits = self.node.page_cache.hits
+
+        for _ in range(3):
+            response = self.node.serve_page(
+                "/page/cached.mu",
+                None,
+                None,
+                None,
+                None,
+                None,
+            )
+            self.assertEqual(response, b"first version")
+        self.assertEqual(self.node.page_cache.hits, hits + 2)
+
+        page_path.write_text("second version, longer")
+        response = self.node.serve_page("/page/cached.mu", None, None, None, None, None)
+        self.assertEqual(response, b"second version, longer")
+
+        from rns_page_node import PageCache
+
+        small_cache = PageCache(max_bytes=16)
+        small_cache.get(page_path)
+        self.assertEqual(small_cache.stats()["entries"], 0)
+        small_page = self.pages_dir / "small.mu"
+        small_page.write_text("tiny")
+        small_cache.get(small_page)
+        self.assertEqual(small_cache.stats()["bytes"], 4)
+
+    def test_diff_registration(self):
+        """Rescans register new paths and deregister removed ones."""
+
+        def handler_registered(path):
+            path_hash = RNS.Identity.truncated_hash(path.encode("utf-8"))
+            return path_hash in self.node.destination.request_handlers
+
+        page_path = self.pages_dir / "transient.mu"
+        file_path = self.files_dir / "transient.bin"
+        page_path.write_text("transient page")
+        file_path.write_bytes(b"transient file")
+        self.node.register_pages()
+        self.node.register_files()
+        self.assertTrue(handler_registered("/page/transient.mu"))
+        self.assertTrue(handler_registered("/file/transient.bin"))
+        handler_count = len(self.node.destination.request_handlers)
+
+        self.node.register_pages()
+        self.node.register_files()
+        self.assertEqual(len(self.node.destination.request_handlers), handler_count)
+
+        page_path.unlink()
+        file_path.unlink()
+        self.node.register_pages()
+        self.node.register_files()
+        self.assertFalse(handler_registered("/page/transient.mu"))
+        self.assertFalse(handler_registered("/file/transient.bin"))
+        self.assertNotIn(str(page_path), self.node.servedpages)
+        self.assertTrue(handler_registered("/page/index.mu"))
+
+    def test_script_response_cache(self):
+        """Script output is cached per variables when the page opts in."""
+        script_path = self.pages_dir / "cached_script.mu"
+        script_path.write_text(
+            "#!/bin/sh\n#!cache ttl=60\necho \"$var_n $(date +%s%N)\"\n",
+        )
+        script_path.chmod(0o755)
+
+        def request(data):
+            return self.node.serve_page(
+                "/page/cached_script.mu",
+                data,
+                None,
+                None,
+                None,
+                None,
+            )
+
+        first = request({"var_n": "1", "var_x": "a"})
+        self.assertEqual(request({"var_x": "a", "var_n": "1"}), first)
+        other = request({"var_n": "2"})
+        self.assertNotEqual(other, first)
+        self.assertTrue(other.startswith(b"2 "))
+
+        time.sleep(0.01)
+        script_path.write_text(
+            "#!/bin/sh\n#!cache ttl=60\necho \"changed $var_n\"\n",
+        )
+        self.assertEqual(request({"var_n": "1", "var_x": "a"}), b"changed 1\n")
+
+        script_path.write_text("#!/bin/sh\n#!cache off\necho \"$(date +%s%N)\"\n")
+        self.assertNotEqual(request(None), request(None))
+
+    def test_script_limits(self):
+        """Slow scripts are killed on timeout and a full queue answers busy."""
+        from rns_page_node.executor import ScriptExecutor
+
+        script_path = self.pages_dir / "slow.mu"
+        script_path.write_text("#!/bin/sh\nsleep 5\necho done\n")
+        script_path.chmod(0o755)
+        executor = ScriptExecutor(max_concurrent=1, queue_size=0, timeout=1)
+        original = self.node.script_executor
+        self.node.script_executor = executor
+        results = []
+        try:
+            slow = threading.Thread(
+                target=lambda: results.append(
+                    self.node.serve_page("/page/slow.mu", None, None, None, None, None),
+                ),
+            )
+            started = time.time()
+            slow.start()
+            time.sleep(0.3)
+            busy = self.node.serve_page("/page/slow.mu", None, None, None, None, None)
+            self.assertIn(b"Busy", busy)
+            slow.join(timeout=10)
+            self.assertLess(time.time() - started, 4)
+        finally:
+            self.node.script_executor = original
+
+        self.assertNotEqual(results[0], b"done\n")
+        stats = executor.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["running"], 0)
+
+    def test_conditional_page_requests(self):
+        """Unchanged pages are answered with a not-modified marker."""
+        page_path = self.pages_dir / "versioned.mu"
+        page_path.write_bytes(b">Version 1\n")
+
+        def request(etag):
+            return self.node.serve_page(
+                "/page/versioned.mu",
+                {"etag": etag},
+                None,
+                None,
+                None,
+                None,
+            )
+
+        etag = hashlib.sha256(b">Version 1\n").digest()[:8]
+        self.assertEqual(request(etag), NOT_MODIFIED)
+        self.assertEqual(request(etag.hex()), NOT_MODIFIED)
+        self.assertEqual(request(b"\x00" * 8), b">Version 1\n")
+
+        time.sleep(0.01)
+        page_path.write_bytes(b">Version 2\n")
+        self.assertEqual(request(etag), b">Version 2\n")
+
+        script_path = self.pages_dir / "versioned_script.mu"
+        script_path.write_text("#!/bin/sh\necho generated\n")
+        script_path.chmod(0o755)
+        script_etag = hashlib.sha256(b"generated\n").digest()[:8]
+        result = self.node.serve_page(
+            "/page/versioned_script.mu",
+            {"etag": script_etag},
+            None,
+            None,
+            None,
+            None,
+        )
+        self.assertEqual(result, NOT_MODIFIED)
+
+    def test_script_coalescing(self):
+        """Identical concurrent script requests share a single execution."""
+        counter_path = self.test_dir / "coalesce_count"
+        counter_path.write_text("")
+        script_path = self.pages_dir / "coalesced.mu"
+        script_path.write_text(
+            "#!/bin/sh\n#!coalesce\n"
+            f"echo run >> {counter_path.resolve()}\n"
+            "sleep 0.5\necho \"$var_n\"\n",
+        )
+        script_path.chmod(0o755)
+
+        results = []
+
+        def request(value):
+            results.append(
+                self.node.serve_page(
+                    "/page/coalesced.mu",
+                    {"var_n": value},
+                    None,
+                    None,
+                    None,
+                    None,
+                ),
+            )
+
+        threads = [
+            threading.Thread(target=request, args=(value,))
+            for value in ("a", "a", "a", "a", "b")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        self.assertCountEqual(results, [b"a\n"] * 4 + [b"b\n"])
+        self.assertEqual(counter_path.read_text().count("run"), 2)
+
+    def test_script_streaming(self):
+        """Streamed script output is returned as a file response."""
+        script_path = self.pages_dir / "streamed.mu"
+        script_path.write_text(
+            "#!/bin/sh\n#!stream\nhead -c 2000000 /dev/zero | tr '\\0' x\n",
+        )
+        script_path.chmod(0o755)
+
+        result = self.node.serve_page("/page/streamed.mu", None, None, None, None, None)
+        self.assertIsInstance(result, list)
+        spool, metadata = result
+        try:
+            self.assertIs(type(spool), io.BufferedReader)
+            self.assertEqual(metadata["name"], b"streamed.mu")
+            self.assertEqual(os.stat(spool.name).st_size, 2_000_000)
+            self.assertEqual(spool.read(), b"x" * 2_000_000)
+        finally:
+            spool.close()
+
+        script_path.write_text("#!/bin/sh\n#!stream off\necho small\n")
+        result = self.node.serve_page("/page/streamed.mu", None, None, None, None, None)
+        self.assertEqual(result, b"small\n")
+
+    def test_watcher_symlink_loop(self):
+        """The watcher follows each symlinked directory once, like the scanner."""
+        from rns_page_node.watcher import InotifyWatcher, inotify_available
+
+        if not inotify_available():
+            self.skipTest("inotify not available")
+
+        loop_dir = self.test_dir / "watch-loop"
+        (loop_dir / "a").mkdir(parents=True, exist_ok=True)
+        (loop_dir / "shared").mkdir(exist_ok=True)
+        (loop_dir / "a" / "up").symlink_to(loop_dir.resolve())
+        (loop_dir / "a" / "one").symlink_to((loop_dir / "shared").resolve())
+        (loop_dir / "two").symlink_to((loop_dir / "shared").resolve())
+
+        events = []
+        watcher = InotifyWatcher(loop_dir, lambda *event: events.append(event))
+        try:
+            self.assertEqual(len(watcher._watches), 3)
+            linked = list(watcher._linked)
+            self.assertEqual(len(linked), 1)
+            # Removing the link lets the directory be watched again later.
+            watcher._remove_tree(linked[0])
+            self.assertEqual(len(watcher._visited), 1)
+        finally:
+            watcher.stop()
+
+        # Symlinked directories appearing later are watched and reported too.
+        outside = self.test_dir / "watch-outside"
+        outside.mkdir(exist_ok=True)
+        (outside / "inner.txt").write_bytes(b"inner")
+        events.clear()
+        watcher = InotifyWatcher(loop_dir, lambda *event: events.append(event))
+        watcher.start()
+        try:
+            link = loop_dir / "late"
+            link.symlink_to(outside.resolve())
+            deadline = time.time() + 5
+            while ("added", str(link / "inner.txt"), False) not in events:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+            self.assertIn(link, watcher._linked)
+            link.unlink()
+            while ("removed", str(link), True) not in events:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+            self.assertNotIn(link, watcher._linked)
+        finally:
+            watcher.stop()
+
+    def test_watch_mode(self):
+        """Watcher events register and deregister individual pages and files."""
+        from rns_page_node.watcher import inotify_available
+
+        if not inotify_available():
+            self.skipTest("inotify not available")
+
+        watch_dir = self.test_dir / "watch"
+        pages_dir = watch_dir / "pages"
+        files_dir = watch_dir / "files"
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        files_dir.mkdir(parents=True, exist_ok=True)
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(files_dir),
+            announce_interval=0,
+            watch=True,
+        )
+
+        def wait_for(predicate):
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                if predicate():
+                    return True
+                time.sleep(0.05)
+            return False
+
+        def handler_registered(path):
+            path_hash = RNS.Identity.truncated_hash(path.encode("utf-8"))
+            return path_hash in node.destination.request_handlers
+
+        try:
+            (pages_dir / "new.mu").write_text("new page")
+            (pages_dir / "sub").mkdir()
+            (pages_dir / "sub" / "deep.mu").write_text("deep page")
+            (files_dir / "data.bin").write_bytes(b"data")
+            self.assertTrue(wait_for(lambda: handler_registered("/page/new.mu")))
+            self.assertTrue(wait_for(lambda: handler_registered("/page/sub/deep.mu")))
+            self.assertTrue(wait_for(lambda: handler_registered("/file/data.bin")))
+
+            shutil.rmtree(pages_dir / "sub")
+            (files_dir / "data.bin").rename(files_dir / "renamed.bin")
+            self.assertTrue(
+                wait_for(lambda: not handler_registered("/page/sub/deep.mu")),
+            )
+            self.assertTrue(wait_for(lambda: handler_registered("/file/renamed.bin")))
+            self.assertFalse(handler_registered("/file/data.bin"))
+            self.assertEqual(len(node.servedfiles), 1)
+        finally:
+            node.shutdown()
+
+    def test_script_workers(self):
+        """Python script pages run in persistent workers with request variables."""
+        worker_dir = self.test_dir / "workers"
+        pages_dir = worker_dir / "pages"
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        script_path = pages_dir / "pid.mu"
+        script_path.write_text(
+            "#!/usr/bin/env python3\n"
+            "import os\n"
+            "print(os.getpid(), os.environ.get('var_name', 'none'))\n",
+        )
+        script_path.chmod(0o755)
+        failing_path = pages_dir / "fail.mu"
+        failing_path.write_text("#!/usr/bin/env python3\nraise SystemExit(3)\n")
+        failing_path.chmod(0o755)
+        options_path = pages_dir / "options.mu"
+        options_path.write_text(
+            "#!/usr/bin/env -S python3 -u\nimport os\nprint(os.getpid())\n",
+        )
+        options_path.chmod(0o755)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(worker_dir / "files"),
+            announce_interval=0,
+            script_workers=1,
+        )
+        try:
+            first = node.serve_page(
+                "/page/pid.mu",
+                {"var_name": "alice"},
+                None,
+                None,
+                None,
+                None,
+            )
+            second = node.serve_page("/page/pid.mu", None, None, None, None, None)
+            first_pid, first_name = first.split()
+            second_pid, second_name = second.split()
+            self.assertEqual(first_name, b"alice")
+            self.assertEqual(second_name, b"none")
+            self.assertEqual(first_pid, second_pid)
+
+            response = node.serve_page("/page/fail.mu", None, None, None, None, None)
+            self.assertIn(b"SystemExit(3)", response)
+            self.assertEqual(node.script_pool.stats()["failures"], 1)
+
+            # Shebangs the pool cannot honour run as subprocesses.
+            options = node.serve_page("/page/options.mu", None, None, None, None, None)
+            self.assertNotEqual(options.strip(), first_pid)
+            self.assertTrue(is_python_script(f"#!{sys.executable}\n".encode()))
+            for shebang in (
+                b"#!/usr/bin/env python2",
+                b"#!/opt/venv/bin/python3",
+                b"#!/usr/bin/env python3 -u",
+                b"#!/bin/sh",
+            ):
+                self.assertFalse(is_python_script(shebang + b"\nprint(1)\n"))
+            # python3 is only ours if PATH resolves it to the node's interpreter.
+            other = mock.patch.object(
+                workers_module.shutil, "which", return_value="/opt/other/python3"
+            )
+            with other, mock.patch.dict(workers_module._interpreters, clear=True):
+                self.assertFalse(is_python_script(b"#!/usr/bin/env python3\n"))
+                self.assertFalse(is_python_script(b"#!python3\n"))
+        finally:
+            node.shutdown()
+
+    def test_files_manifest(self):
+        """The files manifest lists hashes and follows changes on rescan."""
+        manifest_dir = self.test_dir / "manifest"
+        files_dir = manifest_dir / "files"
+        (files_dir / "sub").mkdir(parents=True, exist_ok=True)
+        (files_dir / "a.txt").write_bytes(b"alpha")
+        (files_dir / "sub" / "b.txt").write_bytes(b"beta")
+        secret_dir = manifest_dir / "secret"
+        secret_dir.mkdir(exist_ok=True)
+        (secret_dir / "key.txt").write_bytes(b"private")
+        (files_dir / "key.txt").symlink_to((secret_dir / "key.txt").resolve())
+
+        node = PageNode(
+            RNS.Identity(),
+            str(manifest_dir / "pages"),
+            str(files_dir),
+            announce_interval=0,
+            files_manifest=True,
+        )
+        try:
+
+            def fetch(data=None):
+                node.files_manifest.join()
+                return node.serve_files_manifest(
+                    "/file/.manifest",
+                    data,
+                    None,
+                    None,
+                    None,
+                    None,
+                )
+
+            packed = fetch()
+            manifest = umsgpack.unpackb(packed)
+            self.assertTrue(manifest["complete"])
+            self.assertEqual(
+                [(f[0], f[1], f[3]) for f in manifest["files"]],
+                [
+                    ("a.txt", 5, hashlib.sha256(b"alpha").digest()),
+                    ("sub/b.txt", 4, hashlib.sha256(b"beta").digest()),
+                ],
+            )
+            etag = hashlib.sha256(packed).digest()[:8]
+            self.assertEqual(fetch({"etag": etag}), NOT_MODIFIED)
+
+            (files_dir / "sub" / "b.txt").unlink()
+            (files_dir / "c.txt").write_bytes(b"gamma")
+            node.register_files()
+            manifest = umsgpack.unpackb(fetch({"etag": etag}))
+            self.assertEqual([f[0] for f in manifest["files"]], ["a.txt", "c.txt"])
+            self.assertEqual(node.files_manifest.stats()["hashed"], 3)
+        finally:
+            node.shutdown()
+
+    def test_ranged_file_requests(self):
+        """Files can be fetched by byte range and verified with a manifest."""
+        content = os.urandom(MANIFEST_CHUNK_SIZE * 2 + 1000)
+        (self.files_dir / "ranged.bin").write_bytes(content)
+
+        def request(data):
+            return self.node.serve_file(
+                "/file/ranged.bin",
+                data,
+                None,
+                None,
+                None,
+                None,
+            )
+
+        handle, metadata = request({"offset": 1000, "length": 5000})
+        with handle:
+            self.assertIs(type(handle), io.BufferedReader)
+            self.assertEqual(os.stat(handle.name).st_size, 5000)
+            self.assertEqual(handle.read(), content[1000:6000])
+        self.assertEqual(metadata["size"], len(content))
+        self.assertEqual((metadata["offset"], metadata["length"]), (1000, 5000))
+
+        handle, metadata = request({"offset": len(content) - 10})
+        with handle:
+            self.assertEqual(handle.read(), content[-10:])
+        self.assertEqual(metadata["length"], 10)
+
+        self.assertEqual(request({"offset": len(content) + 1}), DEFAULT_NOTALLOWED.encode("utf-8"))
+        self.assertEqual(request({"offset": -1}), DEFAULT_NOTALLOWED.encode("utf-8"))
+
+        manifest = request({"manifest": True})
+        self.assertEqual(manifest["size"], len(content))
+        self.assertEqual(len(manifest["chunks"]), 3)
+        chunk_size = manifest["chunk_size"]
+        for index, digest in enumerate(manifest["chunks"]):
+            chunk = content[index * chunk_size : (index + 1) * chunk_size]
+            self.assertEqual(hashlib.sha256(chunk).digest(), digest)
+        self.assertEqual(request({"manifest": True}), manifest)
+        self.assertEqual(self.node.file_manifests.stats()["hits"], 1)
+
+    def test_transfer_limits(self):
+        """Transfer handles are capped and closed when their link closes."""
+        tracker = TransferTracker(2)
+        original, self.node.transfers = self.node.transfers, tracker
+        try:
+
+            def request(link_id):
+                return self.node.serve_file(
+                    "/file/test.txt",
+                    None,
+                    None,
+                    link_id,
+                    None,
+                    None,
+                )
+
+            first = request(b"link-a")
+            second = request(b"link-b")
+            self.assertEqual(request(b"link-b"), DEFAULT_BUSY.encode("utf-8"))
+            self.assertEqual(tracker.stats()["open"], 2)
+            self.assertEqual(tracker.stats()["rejected"], 1)
+
+            first[0].close()
+            third = request(b"link-b")
+            self.assertIsInstance(third, list)
+
+            link = types.SimpleNamespace(link_id=b"link-b")
+            self.node.on_disconnect(link)
+            self.assertTrue(second[0].closed)
+            self.assertTrue(third[0].closed)
+            self.assertEqual(tracker.stats()["open"], 0)
+            self.assertEqual(tracker.stats()["closed_by_link"], 2)
+        finally:
+            self.node.transfers = original
+
+    def test_scan_manifest(self):
+        """Startup registers from the saved scan and reconciles in the background."""
+        scan_dir = self.test_dir / "scan"
+        pages_dir = scan_dir / "pages"
+        files_dir = scan_dir / "files"
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        files_dir.mkdir(parents=True, exist_ok=True)
+        (pages_dir / "index.mu").write_text("Scanned")
+        for name in ("kept.log", "changed.log", "removed.log"):
+            (files_dir / name).write_bytes(b"line\n" * 2000)
+        manifest_path = str(scan_dir / "scan-manifest")
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(files_dir),
+            announce_interval=0,
+            scan_manifest=manifest_path,
+        )
+        self.assertTrue(node.scan_ready.wait(10))
+        settings = node.compression_policy.settings()
+        node.shutdown()
+
+        state = load_scan_manifest(manifest_path, pages_dir, files_dir, settings)
+        self.assertEqual(list(state.pages.values()), ["/page/index.mu"])
+        self.assertEqual(len(state.files), 3)
+        # Mark every saved decision so reused ones can be told apart.
+        for full_path, scanned in state.files.items():
+            decision = scanned.decision._replace(auto_compress=123, reason="saved")
+            state.files[full_path] = ScannedFile(scanned.request_path, decision)
+        save_scan_manifest(manifest_path, pages_dir, files_dir, settings, state)
+        (files_dir / "removed.log").unlink()
+        (files_dir / "changed.log").write_bytes(b"changed\n" * 3000)
+        (files_dir / "added.log").write_bytes(b"new\n" * 10)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(files_dir),
+            announce_interval=0,
+            scan_manifest=manifest_path,
+        )
+        try:
+            self.assertTrue(node.scan_ready.wait(10))
+            self.assertEqual(
+                sorted(Path(p).name for p in node.servedfiles),
+                ["added.log", "changed.log", "kept.log"],
+            )
+            policy = node.compression_policy
+            self.assertEqual(policy.decision("/file/kept.log").reason, "saved")
+            self.assertNotEqual(policy.decision("/file/changed.log").reason, "saved")
+            self.assertIsNone(policy.decision("/file/removed.log"))
+            response = node.serve_page("/page/index.mu", None, None, None, None, None)
+            self.assertEqual(response, b"Scanned")
+
+            # Completed rescans are saved.
+            (files_dir / "rescanned.log").write_bytes(b"new\n")
+            node.register_files()
+            state = load_scan_manifest(manifest_path, pages_dir, files_dir, settings)
+            self.assertEqual(len(state.files), 4)
+            # Watcher changes are saved at shutdown at the latest.
+            (files_dir / "watched.log").write_bytes(b"new\n")
+            node._on_file_event("added", str(files_dir / "watched.log"), False)
+        finally:
+            node.shutdown()
+        state = load_scan_manifest(manifest_path, pages_dir, files_dir, settings)
+        self.assertEqual(len(state.files), 5)
+
+    def test_path_index(self):
+        """Served paths are indexed relative to the base and diffed as sets."""
+        base = os.path.join("srv", "files")
+        names = ["b.txt", os.path.join("docs", "a.txt"), os.path.join("docs", "z.txt")]
+        paths = [os.path.join(base, name) for name in names]
+        index = PathIndex(base, paths)
+
+        self.assertEqual(len(index), 3)
+        self.assertIn(paths[1], index)
+        self.assertNotIn(os.path.join(base, "missing.txt"), index)
+        self.assertEqual(list(index), sorted(paths))
+        self.assertEqual(index[0], min(paths))
+        self.assertEqual(index[-1], max(paths))
+        self.assertEqual(index.with_prefix("docs" + os.sep), sorted(names[1:]))
+        self.assertFalse(index.add(paths[0]))
+
+        rescanned = PathIndex(base, [paths[0], os.path.join(base, "c.txt")])
+        added, removed = rescanned.diff(index)
+        self.assertEqual(added, [os.path.join(base, "c.txt")])
+        self.assertEqual(sorted(removed), sorted(paths[1:]))
+
+        self.assertTrue(index.add(os.path.join(base, "docs", "b.txt")))
+        removed = index.remove_tree(os.path.join(base, "docs"), is_dir=True)
+        self.assertEqual(len(removed), 3)
+        self.assertEqual(list(index), [paths[0]])
+
+    def test_file_listings(self):
+        """Directory listings are paginated and re-rendered incrementally."""
+        listing_dir = self.test_dir / "listings"
+        files_dir = listing_dir / "files"
+        (files_dir / "docs").mkdir(parents=True, exist_ok=True)
+        (files_dir / "other").mkdir(parents=True, exist_ok=True)
+        (files_dir / "readme.txt").write_bytes(b"x" * 2048)
+        (files_dir / "other" / "one.txt").write_bytes(b"1")
+        for number in range(250):
+            (files_dir / "docs" / f"doc{number:03}.txt").write_bytes(b"d")
+        secret_dir = listing_dir / "secret"
+        secret_dir.mkdir(exist_ok=True)
+        (secret_dir / "key.txt").write_bytes(b"private")
+        (files_dir / "key.txt").symlink_to((secret_dir / "key.txt").resolve())
+        (files_dir / "vault").symlink_to(secret_dir.resolve())
+        (files_dir / "other" / "-notes #1.txt").write_bytes(b"n")
+        (files_dir / "other" / ">odd`].txt").write_bytes(b"o")
+
+        node = PageNode(
+            RNS.Identity(),
+            str(listing_dir / "pages"),
+            str(files_dir),
+            announce_interval=0,
+            file_listings=True,
+        )
+        try:
+
+            def listing(path, data=None):
+                return node.serve_listing(path, data, None, None, None, None)
+
+            root = listing("/page/.files.mu").decode("utf-8")
+            self.assertIn("`[docs/`:/page/.files/docs.mu]", root)
+            self.assertIn("`[readme.txt`:/file/readme.txt]  2.0 KiB", root)
+            self.assertNotIn("key.txt", root)
+            self.assertNotIn("vault", root)
+            self.assertIsNone(node.listings.get("/page/.files/vault.mu"))
+            other = listing("/page/.files/other.mu").decode("utf-8").splitlines()
+            self.assertIn("`[-notes #1.txt`:/file/other/-notes #1.txt]  1 B", other)
+            self.assertIn("\\>odd\\`].txt  1 B", other)
+            self.assertEqual(escape_micron("-a`b\\", line_start=True), "\\-a\\`b\\\\")
+            self.assertEqual(escape_micron("-a"), "-a")
+            self.assertEqual(link_label("a`b]"), "a'b)")
+
+            second = listing("/page/.files/docs.mu", {"var_page": "2"})
+            self.assertIn(b"/file/docs/doc100.txt", second)
+            self.assertNotIn(b"/file/docs/doc099.txt", second)
+            self.assertIn(b"Page 2 of 3", second)
+            self.assertIn(b"`[Next`:/page/.files/docs.mu`page=3]", second)
+            etag = hashlib.sha256(second).digest()[:8]
+            self.assertEqual(
+                listing("/page/.files/docs.mu", {"var_page": "2", "etag": etag}),
+                NOT_MODIFIED,
+            )
+
+            rendered = node.listings.stats()["rendered"]
+            shutil.rmtree(files_dir / "other")
+            node.register_files()
+            self.assertEqual(node.listings.stats()["rendered"], rendered + 1)
+            self.assertEqual(
+                listing("/page/.files/other.mu"),
+                DEFAULT_NOTALLOWED.encode("utf-8"),
+            )
+            self.assertNotIn(b"other/", listing("/page/.files.mu"))
+
+            # Files rewritten in place are listed with their new size.
+            (files_dir / "readme.txt").write_bytes(b"x" * 4096)
+            node.register_files()
+            root = listing("/page/.files.mu").decode("utf-8")
+            self.assertIn("`[readme.txt`:/file/readme.txt]  4.0 KiB", root)
+        finally:
+            node.shutdown()
+
+    def test_page_search(self):
+        """Search ranks static pages and only re-indexes changed ones."""
+        search_dir = self.test_dir / "search"
+        pages_dir = search_dir / "pages"
+        (pages_dir / "guides").mkdir(parents=True, exist_ok=True)
+        (pages_dir / "index.mu").write_text(">Welcome\n`!Mesh`! networks for all\n")
+        (pages_dir / "guides" / "mesh.mu").write_text(
+            ">>Mesh Guide\n-\nMesh mesh `[routing`:/page/index.mu] over LoRa.\n",
+        )
+        (pages_dir / "script.mu").write_text("#!/bin/sh\necho mesh\n")
+        outside_dir = search_dir / "outside"
+        outside_dir.mkdir(exist_ok=True)
+        (outside_dir / "notes.mu").write_text(">Private\nlaunch codes swordfish\n")
+        (pages_dir / "notes.mu").symlink_to((outside_dir / "notes.mu").resolve())
+        index_path = search_dir / "search-index"
+
+        def start():
+            node = PageNode(
+                RNS.Identity(),
+                str(pages_dir),
+                str(search_dir / "files"),
+                announce_interval=0,
+                search_index=str(index_path),
+            )
+            node.search.join()
+            return node
+
+        def search(node, data):
+            return node.serve_search("/page/.search.mu", data, None, None, None, None)
+
+        node = start()
+        try:
+            results = search(node, {"field_q": "MESH"}).decode("utf-8")
+            self.assertIn("2 matching pages", results)
+            self.assertLess(
+                results.index("`[Mesh Guide`:/page/guides/mesh.mu]"),
+                results.index("`[Welcome`:/page/index.mu]"),
+            )
+            self.assertNotIn("/page/script.mu", results)
+            self.assertIn(b"routing", search(node, {"var_q": "routing"}))
+            self.assertIn(b"No pages match", search(node, {"var_q": "absent"}))
+            # A query cannot end the search field early.
+            field = search(node, {"var_q": "a>`[x`:/page/x.mu]"}).splitlines()[2]
+            self.assertEqual(field.count(b">"), 1)
+            self.assertTrue(field.startswith(b"`B444`<24|q`a\\`[x\\`:/page/x.mu]>"))
+            self.assertEqual(
+                node.serve_page("/page/notes.mu", None, None, None, None, None),
+                DEFAULT_NOTALLOWED.encode("utf-8"),
+            )
+            hidden = search(node, {"var_q": "swordfish"})
+            self.assertIn(b"No pages match", hidden)
+            self.assertNotIn(b"notes.mu", hidden)
+            self.assertEqual(node.search.stats()["indexed"], 2)
+        finally:
+            node.shutdown()
+
+        (pages_dir / "index.mu").write_text(">Welcome\nNow about antennas\n")
+        node = start()
+        try:
+            stats = node.search.stats()
+            self.assertEqual(stats["loaded"], 2)
+            self.assertEqual(stats["indexed"], 1)
+            self.assertIn(b"/page/index.mu", search(node, {"var_q": "antennas"}))
+            self.assertNotIn(b"/page/index.mu", search(node, {"var_q": "mesh"}))
+        finally:
+            node.shutdown()
+
+    def test_page_templates(self):
+        """Includes and templates are rendered once and follow fragment edits."""
+        template_dir = self.test_dir / "templates"
+        pages_dir = template_dir / "pages"
+        (pages_dir / "docs").mkdir(parents=True, exist_ok=True)
+        (template_dir / "secret.mu").write_text("secret\n")
+        (pages_dir / ".layout.mu").write_text(
+            ">Site\n#!include .menu.mu\n#!content\n-\nFooter\n",
+        )
+        (pages_dir / ".menu.mu").write_text("`[Home`:/page/index.mu]\n")
+        page_path = pages_dir / "docs" / "page.mu"
+        page_path.write_text("#!template /.layout.mu\nHello page\n")
+        page_path.chmod(0o755)
+        (pages_dir / "loop.mu").write_text(
+            "#!include loop.mu\n#!include ../secret.mu\nend\n",
+        )
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(template_dir / "files"),
+            announce_interval=0,
+        )
+        try:
+
+            def page(path, data=None):
+                return node.serve_page(path, data, None, None, None, None)
+
+            expected = b">Site\n`[Home`:/page/index.mu]\nHello page\n-\nFooter\n"
+            self.assertEqual(page("/page/docs/page.mu"), expected)
+            self.assertEqual(page("/page/docs/page.mu"), expected)
+            self.assertEqual(node.templates.stats()["renders"], 1)
+            etag = hashlib.sha256(expected).digest()[:8]
+            self.assertEqual(page("/page/docs/page.mu", {"etag": etag}), NOT_MODIFIED)
+
+            (pages_dir / ".menu.mu").write_text("`[Start`:/page/index.mu]\n")
+            self.assertIn(b"`[Start`:/page/index.mu]", page("/page/docs/page.mu"))
+            self.assertEqual(node.templates.stats()["renders"], 2)
+
+            node.templates.invalidate(pages_dir / ".menu.mu")
+            self.assertEqual(node.templates.stats()["pages"], 0)
+
+            self.assertEqual(
+                page("/page/loop.mu"),
+                b"#!include loop.mu\n#!include ../secret.mu\nend\n",
+            )
+        finally:
+            node.shutdown()
+
+    def test_script_schedule(self):
+        """Scheduled script pages are served from background snapshots."""
+        schedule_dir = self.test_dir / "schedule"
+        pages_dir = schedule_dir / "pages"
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        status_path = pages_dir / "status.mu"
+        status_path.write_text(
+            '#!/bin/sh\n#!schedule every=60\necho "$var_n $(date +%s%N)"\n',
+        )
+        fail_path = pages_dir / "fail.mu"
+        fail_path.write_text("#!/bin/sh\nexit 3\n")
+        for path in (status_path, fail_path):
+            path.chmod(0o755)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(schedule_dir / "files"),
+            announce_interval=0,
+            script_schedule="fail.mu:60",
+        )
+        try:
+
+            def page(path, data=None):
+                return node.serve_page(path, data, None, None, None, None)
+
+            deadline = time.time() + 10
+            status = {}
+            while time.time() < deadline:
+                status = node.scheduler.status()
+                names = ("status.mu", "fail.mu")
+                if all(status.get(name, {}).get("renders") for name in names):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(status["status.mu"]["interval"], 60)
+            self.assertIsNone(status["status.mu"]["last_error"])
+            self.assertIsNotNone(status["status.mu"]["rendered_at"])
+            self.assertEqual(status["fail.mu"]["failures"], 1)
+            self.assertIn("status 3", status["fail.mu"]["last_error"])
+
+            snapshot = page("/page/status.mu")
+            self.assertEqual(page("/page/status.mu"), snapshot)
+            etag = hashlib.sha256(snapshot).digest()[:8]
+            self.assertEqual(page("/page/status.mu", {"etag": etag}), NOT_MODIFIED)
+            self.assertTrue(page("/page/status.mu", {"var_n": "7"}).startswith(b"7 "))
+            self.assertEqual(node.scheduler.status()["status.mu"]["renders"], 1)
+
+            fail_path.write_text("#!/bin/sh\n#!schedule off\nexit 3\n")
+            node.scheduler.update(added=[str(fail_path)])
+            deadline = time.time() + 5
+            while "fail.mu" in node.scheduler.status() and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertNotIn("fail.mu", node.scheduler.status())
+
+            def wait_for_render(name, renders):
+                deadline = time.time() + 5
+                while time.time() < deadline:
+                    if node.scheduler.status().get(name, {}).get("renders") == renders:
+                        return
+                    time.sleep(0.05)
+                self.fail(f"{name} was not rendered {renders} times")
+
+            # A changed script is served live until its new output is rendered.
+            status_path.write_text("#!/bin/sh\n#!schedule every=60\necho changed\n")
+            self.assertEqual(page("/page/status.mu"), b"changed\n")
+            wait_for_render("status.mu", 2)
+            self.assertEqual(page("/page/status.mu"), b"changed\n")
+
+            # Rescans pass scheduled pages modified on disk to the scheduler.
+            status_path.write_text("#!/bin/sh\n#!schedule every=60\necho rescanned\n")
+            node.register_pages()
+            wait_for_render("status.mu", 3)
+            self.assertEqual(page("/page/status.mu"), b"rescanned\n")
+
+            # Removing the directive drops the page on the next request.
+            status_path.write_text("#!/bin/sh\necho unscheduled\n")
+            self.assertEqual(page("/page/status.mu"), b"unscheduled\n")
+            self.assertNotIn("status.mu", node.scheduler.status())
+        finally:
+            node.shutdown()
+
+    def test_route_table(self):
+        """Handlers serve registered paths from the route table."""
+        route_dir = self.test_dir / "routes"
+        (route_dir / "pages").mkdir(parents=True, exist_ok=True)
+        (route_dir / "files" / "sub").mkdir(parents=True, exist_ok=True)
+        (route_dir / "pages" / "index.mu").write_text("Routed")
+        (route_dir / "files" / "sub" / "data.bin").write_bytes(b"payload")
+
+        node = PageNode(
+            RNS.Identity(),
+            str(route_dir / "pages"),
+            str(route_dir / "files"),
+            announce_interval=0,
+        )
+        try:
+            route = node.file_routes.get("/file/sub/data.bin")
+            self.assertEqual(
+                route.path,
+                os.path.realpath(route_dir / "files" / "sub" / "data.bin"),
+            )
+            self.assertEqual(route.name, b"data.bin")
+            self.assertIn("/page/index.mu", node.page_routes)
+
+            response = node.serve_page("/page/index.mu", None, None, None, None, None)
+            self.assertEqual(response, b"Routed")
+            handle, metadata = node.serve_file(
+                "/file/sub/data.bin",
+                None,
+                None,
+                None,
+                None,
+                None,
+            )
+            with handle:
+                self.assertEqual(handle.read(), b"payload")
+            self.assertEqual(metadata["name"], b"data.bin")
+
+            (route_dir / "files" / "sub" / "data.bin").unlink()
+            response = node.serve_file("/file/sub/data.bin", None, None, None, None, None)
+            self.assertEqual(response, DEFAULT_NOTALLOWED.encode("utf-8"))
+            node.register_files()
+            self.assertEqual(len(node.file_routes), 0)
+        finally:
+            node.shutdown()
+
+    def test_route_table_update_cost(self):
+        """Adding or removing a route does not depend on the table size."""
+
+        def event_time(size):
+            table = RouteTable("/srv/files", "/file/")
+            table.update(added=[f"/file/dir{i % 100}/f{i}" for i in range(size)])
+            routes = table._routes
+            started = time.perf_counter()
+            for i in range(2000):
+                table.update(added=[f"/file/new/{i}"])
+                table.update(removed=[f"/file/new/{i}"])
+            elapsed = time.perf_counter() - started
+            self.assertIs(table._routes, routes)
+            self.assertEqual(len(table), size)
+            return elapsed
+
+        small = min(event_time(100) for _ in range(3))
+        large = min(event_time(200_000) for _ in range(3))
+        # Copying a 200k entry table per event would be over 1000x slower.
+        self.assertLess(large, small * 10 + 0.05)
+
+    def test_content_index(self):
+        """Duplicate files share one digest and a restart reuses the index."""
+        index_dir = self.test_dir / "content-index"
+        index_dir.mkdir(exist_ok=True)
+        content = os.urandom(128 * 1024)
+        paths = [
+            os.path.realpath(index_dir / name) for name in ("a.iso", "b.iso", "c.txt")
+        ]
+        Path(paths[0]).write_bytes(content)
+        Path(paths[1]).write_bytes(content)
+        Path(paths[2]).write_bytes(b"other")
+        persist_path = str(index_dir / "index")
+
+        index = ContentIndex(persist_path)
+        index.sync(paths)
+        index.join()
+        digest = hashlib.sha256(content).digest()
+        self.assertEqual(index.digest(paths[0]), digest)
+        self.assertEqual(index.paths(digest), paths[:2])
+        stats = index.stats()
+        self.assertEqual((stats["unique"], stats["duplicates"]), (2, 1))
+        self.assertEqual(stats["duplicate_bytes"], len(content))
+
+        mapped = MappedFiles(64 * 1024)
+        with mapped.open(paths[0], digest), mapped.open(paths[1], digest) as second:
+            self.assertEqual(second.read(), content)
+        self.assertEqual(mapped.stats()["mapped"], 1)
+        mapped.clear()
+        index.shutdown()
+
+        Path(paths[2]).write_bytes(b"changed")
+        restarted = ContentIndex(persist_path)
+        try:
+            self.assertEqual(restarted.loaded, 3)
+            restarted.sync(paths)
+            restarted.join()
+            self.assertEqual(restarted.stats()["hashed"], 1)
+            self.assertEqual(
+                restarted.digest(paths[2]),
+                hashlib.sha256(b"changed").digest(),
+            )
+        finally:
+            restarted.shutdown()
+
+    def test_content_index_rewritten_while_hashing(self):
+        """A file rewritten while it is hashed is hashed again."""
+        index_dir = self.test_dir / "content-rewritten"
+        index_dir.mkdir(exist_ok=True)
+        path = os.path.realpath(index_dir / "log.txt")
+        Path(path).write_bytes(b"old")
+        real_hash = content_index_module.hash_file
+
+        def hash_then_rewrite(target):
+            digest = real_hash(target)
+            if Path(target).read_bytes() == b"old":
+                Path(target).write_bytes(b"rewritten")
+            return digest
+
+        index = ContentIndex()
+        patch = mock.patch.object(content_index_module, "hash_file", hash_then_rewrite)
+        try:
+            with patch:
+                index.sync([path])
+                index.join()
+                index.join()
+            self.assertEqual(index.digest(path), hashlib.sha256(b"rewritten").digest())
+            self.assertEqual(index.stats()["hashed"], 1)
+        finally:
+            index.shutdown()
+
+    def test_content_index_served_only(self):
+        """Only files with a request path are hashed, on rescan and on events."""
+        index_dir = self.test_dir / "content-served"
+        files_dir = index_dir / "files"
+        files_dir.mkdir(parents=True, exist_ok=True)
+        secret_dir = index_dir / "secret"
+        secret_dir.mkdir(exist_ok=True)
+        (files_dir / "a.txt").write_bytes(b"alpha")
+        for name in ("key.txt", "late.txt"):
+            (secret_dir / name).write_bytes(b"private")
+        (files_dir / "key.txt").symlink_to((secret_dir / "key.txt").resolve())
+
+        node = PageNode(
+            RNS.Identity(),
+            str(index_dir / "pages"),
+            str(files_dir),
+            announce_interval=0,
+            content_index=str(index_dir / "index"),
+        )
+        try:
+            late = files_dir / "late.txt"
+            late.symlink_to((secret_dir / "late.txt").resolve())
+            node._on_file_event("added", str(late), False)
+            node._on_file_event("added", str(files_dir / "key.txt"), False)
+            node.content_index.join()
+            _, entries = node.content_index.snapshot()
+            self.assertEqual(
+                [path for path, _ in entries],
+                [os.path.realpath(files_dir / "a.txt")],
+            )
+            self.assertEqual(node.content_index.stats()["hashed"], 1)
+        finally:
+            node.shutdown()
+
+    def test_mapped_files(self):
+        """Large files share one mapping until they change."""
+        mapped_path = self.files_dir / "mapped.iso"
+        content = os.urandom(256 * 1024)
+        mapped_path.write_bytes(content)
+        mapped = MappedFiles(64 * 1024)
+
+        first = mapped.open(str(mapped_path))
+        second = mapped.open(str(mapped_path))
+        self.assertIs(type(first), io.BufferedReader)
+        self.assertEqual(os.stat(first.name).st_size, len(content))
+        first.seek(1000)
+        self.assertEqual(first.read(5000), content[1000:6000])
+        self.assertEqual(second.read(), content)
+        self.assertEqual(mapped.stats()["mapped"], 1)
+        self.assertEqual(mapped.stats()["readers"], 2)
+        self.assertIsNone(mapped.open(str(self.files_dir / "test.txt")))
+
+        replacement = self.files_dir / "mapped.iso.new"
+        replacement.write_bytes(b"y" * len(content))
+        replacement.replace(mapped_path)
+        with mapped.open(str(mapped_path)) as third:
+            self.assertEqual(third.read(3), b"yyy")
+        first.seek(0)
+        self.assertEqual(first.read(10), content[:10])
+        self.assertEqual(mapped.stats()["mapped"], 2)
+
+        first.close()
+        second.close()
+
+        # Reading past the end of a truncated file would fault.
+        with mapped.open(str(mapped_path)) as truncated:
+            os.truncate(mapped_path, 0)
+            with self.assertRaises(OSError):
+                truncated.read(10)
+        mapped.clear()
+        self.assertEqual(mapped.stats()["mappings"], 0)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(self.pages_dir),
+            str(self.files_dir),
+            announce_interval=0,
+            mmap_threshold=64 * 1024,
+        )
+        try:
+            # Mapping alone does not hash the files directory.
+            self.assertIsNone(node.content_index)
+            self.assertIsNotNone(node.mapped_files)
+        finally:
+            node.shutdown()
+
+    def test_compression_policy(self):
+        """File handlers get a compression setting suited to their content."""
+        policy_dir = self.test_dir / "compression"
+        policy_dir.mkdir(exist_ok=True)
+        (policy_dir / "server.log").write_bytes(b"GET /page/index.mu 200\n" * 5000)
+        (policy_dir / "photo.jpg").write_bytes(b"\xff\xd8\xff" + b"x" * 100)
+        (policy_dir / "archive.bin").write_bytes(b"PK\x03\x04" + b"x" * 100)
+        (policy_dir / "noise.dat").write_bytes(os.urandom(65536))
+        (policy_dir / "data.csv").write_bytes(b"a,b,c\n" * 100)
+
+        policy = CompressionPolicy(parse_rules("*.csv:never, bad-rule"))
+
+        def decide(name):
+            return policy.decide(str(policy_dir / name), f"/file/{name}")
+
+        self.assertEqual(decide("server.log"), ALWAYS_COMPRESS_LIMIT)
+        self.assertIs(decide("photo.jpg"), False)
+        self.assertIs(decide("archive.bin"), False)
+        self.assertIs(decide("noise.dat"), False)
+        self.assertIs(decide("data.csv"), False)
+        self.assertEqual(
+            policy.stats()["reasons"],
+            {"entropy": 2, "extension": 1, "magic": 1, "rule": 1},
+        )
+
+        policy.record_transfer("/file/server.log")
+        policy.record_transfer("/file/noise.dat")
+        stats = policy.stats()
+        self.assertEqual(stats["transfers"], 2)
+        self.assertEqual(stats["bytes_compressed"], 5000 * 23)
+        self.assertGreater(stats["bytes_saved"], 0)
+        self.assertEqual(stats["bytes_skipped"], 65536)
+
+    def test_compression_redecided(self):
+        """Files modified in place get a new compression decision."""
+        policy_dir = self.test_dir / "compression-changed"
+        files_dir = policy_dir / "files"
+        files_dir.mkdir(parents=True, exist_ok=True)
+        (files_dir / "data.bin").write_bytes(b"GET /page/index.mu 200\n" * 5000)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(policy_dir / "pages"),
+            str(files_dir),
+            announce_interval=0,
+        )
+        try:
+            policy = node.compression_policy
+            self.assertEqual(
+                policy.decision("/file/data.bin").auto_compress,
+                ALWAYS_COMPRESS_LIMIT,
+            )
+            (files_dir / "data.bin").write_bytes(os.urandom(65536))
+            node.register_files()
+            self.assertIs(policy.decision("/file/data.bin").auto_compress, False)
+
+            # A watcher sees a new file created empty, then written.
+            (files_dir / "server.log").write_bytes(b"")
+            node._on_file_event("added", str(files_dir / "server.log"), False)
+            (files_dir / "server.log").write_bytes(b"GET /page/index.mu 200\n" * 5000)
+            node._on_file_event("added", str(files_dir / "server.log"), False)
+            self.assertEqual(
+                policy.decision("/file/server.log").auto_compress,
+                ALWAYS_COMPRESS_LIMIT,
+            )
+        finally:
+            node.shutdown()
+
+    def test_precompressed_files(self):
+        """Files are compressed once and served from the compressed store."""
+        store_dir = self.test_dir / "precompress"
+        files_dir = store_dir / "files"
+        files_dir.mkdir(parents=True, exist_ok=True)
+        content = b"compressible line of text\n" * 10_000
+        (files_dir / "big.txt").write_bytes(content)
+        (files_dir / "small.txt").write_bytes(b"tiny")
+        outside = store_dir / "outside.txt"
+        outside.write_bytes(b"private line of text\n" * 10_000)
+        (files_dir / "outside.txt").symlink_to(outside.resolve())
+
+        node = PageNode(
+            RNS.Identity(),
+            str(store_dir / "pages"),
+            str(files_dir),
+            announce_interval=0,
+            precompress_dir=str(store_dir / "cache"),
+        )
+        try:
+            node.compressed_store.join()
+            handle, metadata = node.serve_file(
+                "/file/.bz2/big.txt",
+                None,
+                None,
+                None,
+                None,
+                None,
+            )
+            with handle:
+                self.assertEqual(metadata["encoding"], b"bz2")
+                self.assertEqual(metadata["size"], len(content))
+                self.assertEqual(bz2.decompress(handle.read()), content)
+
+            handle, metadata = node.serve_file(
+                "/file/.bz2/small.txt",
+                None,
+                None,
+                None,
+                None,
+                None,
+            )
+            with handle:
+                self.assertNotIn("encoding", metadata)
+                self.assertEqual(handle.read(), b"tiny")
+            self.assertEqual(node.compressed_store.stats()["compressed"], 1)
+
+            (files_dir / "big.txt").unlink()
+            node.register_files()
+            node.compressed_store.join()
+            self.assertEqual(list((store_dir / "cache").iterdir()), [])
+            self.assertEqual(node.compressed_store.stats()["bytes"], 0)
+        finally:
+            node.shutdown()
+
+    def test_page_backends(self):
+        """Pages declaring a backend are served by one persistent process."""
+        backend_dir = self.test_dir / "backends"
+        pages_dir = backend_dir / "pages"
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        page_path = pages_dir / "live.mu"
+        page_path.write_text(
+            "#!/usr/bin/env python3\n"
+            "#!backend timeout=5 health=0\n"
+            "import json, os, struct, sys\n"
+            "inp, out = sys.stdin.buffer, sys.stdout.buffer\n"
+            "count = 0\n"
+            "while True:\n"
+            "    raw = inp.read(8)\n"
+            "    if len(raw) < 8:\n"
+            "        break\n"
+            "    hlen, blen = struct.unpack('>II', raw)\n"
+            "    header = json.loads(inp.read(hlen))\n"
+            "    inp.read(blen)\n"
+            "    if header['type'] == 'ping':\n"
+            "        reply, body = {'id': header['id'], 'type': 'pong'}, b''\n"
+            "    else:\n"
+            "        count += 1\n"
+            "        name = header['env'].get('var_name', 'none')\n"
+            "        body = f\"{os.getpid()} {count} {name}\".encode()\n"
+            "        reply = {'id': header['id'], 'ok': True}\n"
+            "    encoded = json.dumps(reply).encode()\n"
+            "    out.write(struct.pack('>II', len(encoded), len(body)))\n"
+            "    out.write(encoded + body)\n"
+            "    out.flush()\n",
+        )
+        page_path.chmod(0o755)
+        plain_path = pages_dir / "plain.mu"
+        plain_path.write_text(">Plain\n")
+        plain_path.chmod(0o644)
+        sidecar_path = pages_dir / "plain.mu.backend"
+        sidecar_path.write_text("command=python3 live.mu\ntimeout=5\nhealth=0\n")
+        sidecar_path.chmod(0o664)
+
+        node = PageNode(
+            RNS.Identity(),
+            str(pages_dir),
+            str(backend_dir / "files"),
+            announce_interval=0,
+            page_backends=True,
+        )
+        try:
+            first = node.serve_page(
+                "/page/live.mu",
+                {"var_name": "bob"},
+                None,
+                None,
+                None,
+                None,
+            ).split()
+            second = node.serve_page("/page/live.mu", None, None, None, None, None)
+            second = second.split()
+            self.assertEqual(first[1:], [b"1", b"bob"])
+            self.assertEqual(second[0], first[0])
+            self.assertEqual(second[1], b"2")
+
+            os.kill(int(first[0]), 9)
+            time.sleep(1.2)
+            third = node.serve_page("/page/live.mu", None, None, None, None, None)
+            self.assertNotEqual(third.split()[0], first[0])
+            stats = node.backends.stats()[str(page_path.resolve())]
+            self.assertEqual(stats["restarts"], 1)
+            # Frames that cannot be encoded fail like any other send.
+            backend = node.backends._backends[str(page_path.resolve())]
+            with self.assertRaises(BackendError):
+                backend.call({"type": "ping", "unencodable": object()})
+
+            # Sidecars only apply to executable pages and trusted sidecars.
+            def plain():
+                return node.serve_page("/page/plain.mu", None, None, None, None, None)
+
+            self.assertEqual(plain(), b">Plain\n")
+            plain_path.chmod(0o755)
+            self.assertEqual(plain(), b">Plain\n")
+            sidecar_path.chmod(0o644)
+            self.assertEqual(plain().split()[1:], [b"1", b"none"])
+        finally:
+            node.shutdown()
+
 
 if __name__ == "__main__":
     unittest.main()